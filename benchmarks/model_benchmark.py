@@ -0,0 +1,724 @@
+"""A micro-benchmark for all models in pytorch_model_dict with synthetic data"""
+
+import json
+import os
+import platform
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import torch
+
+from torchhydro.configs.model_config import MODEL_PARAM_DICT
+from torchhydro.models.basintree import BasinTree
+from torchhydro.models.model_dict_function import pytorch_model_dict
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class SyntheticDataSource:
+    """A data source generating forcing, attributes and targets locally
+
+    No dataset is needed, so that models could be benchmarked on any machine.
+    The first two forcing variables are precipitation and PET (mm/day), which are
+    the inputs of physical models in dPL models; the others are standard normal.
+    """
+
+    def __init__(
+        self,
+        n_basin=64,
+        n_time=730,
+        n_forcing=5,
+        n_attr=10,
+        n_target=1,
+        grid_size=(8, 8),
+        seed=1234,
+    ):
+        """
+        Parameters
+        ----------
+        n_basin
+            number of basins
+        n_time
+            number of time steps (days)
+        n_forcing
+            number of forcing variables, at least 2 (prcp and pet)
+        n_attr
+            number of basin attributes
+        n_target
+            number of target variables
+        grid_size
+            the size of gridded precipitation for models using images as input
+        seed
+            random seed
+        """
+        if n_forcing < 2:
+            raise ValueError("n_forcing should be at least 2: prcp and pet")
+        self.n_basin = n_basin
+        self.n_time = n_time
+        self.n_forcing = n_forcing
+        self.n_attr = n_attr
+        self.n_target = n_target
+        self.grid_size = tuple(grid_size)
+        self.basin_ids = [f"synthetic_{i:04d}" for i in range(n_basin)]
+        self.rng = np.random.default_rng(seed)
+        self.forcing = self._gen_forcing()
+        self.attributes = self.rng.standard_normal((n_basin, n_attr)).astype(
+            np.float32
+        )
+        self.target = self._gen_target()
+
+    def _gen_forcing(self):
+        t = np.arange(self.n_time)
+        # intermittent rainfall: about 30% rainy days with gamma-distributed depth
+        rainy = self.rng.random((self.n_time, self.n_basin)) < 0.3
+        prcp = np.where(
+            rainy, self.rng.gamma(0.8, 10.0, (self.n_time, self.n_basin)), 0.0
+        )
+        # seasonal pet
+        pet = (
+            3.0
+            + 2.0 * np.sin(2 * np.pi * t / 365.0)[:, None]
+            + 0.5 * self.rng.random((self.n_time, self.n_basin))
+        )
+        others = self.rng.standard_normal(
+            (self.n_time, self.n_basin, self.n_forcing - 2)
+        )
+        return np.concatenate(
+            [prcp[:, :, None], pet[:, :, None], others], axis=-1
+        ).astype(np.float32)
+
+    def _gen_target(self):
+        # a linear reservoir fed by precipitation, so targets are positive and smooth
+        prcp = self.forcing[:, :, 0]
+        q = np.zeros_like(prcp)
+        storage = np.zeros(self.n_basin, dtype=np.float32)
+        for i in range(self.n_time):
+            storage = storage + prcp[i]
+            q[i] = 0.1 * storage
+            storage = storage - q[i]
+        return np.repeat(q[:, :, None], self.n_target, axis=-1).astype(np.float32)
+
+    def read_nestedness(self):
+        """a nestedness table for NestedNarx
+
+        Every odd basin is upstream of the even one before it.
+        """
+        n_nested_within, n_station_ds, nested_within, next_ds = [], [], [], []
+        for i, basin in enumerate(self.basin_ids):
+            if i % 2 == 0 and i + 1 < self.n_basin:
+                n_nested_within.append(1)
+                n_station_ds.append(0)
+                nested_within.append(self.basin_ids[i + 1])
+                next_ds.append(None)
+            elif i % 2 == 1:
+                n_nested_within.append(0)
+                n_station_ds.append(1)
+                nested_within.append(None)
+                next_ds.append(self.basin_ids[i - 1])
+            else:
+                n_nested_within.append(0)
+                n_station_ds.append(0)
+                nested_within.append(None)
+                next_ds.append(None)
+        return pd.DataFrame(
+            {
+                "nes_n_nested_within": n_nested_within,
+                "nes_n_station_ds": n_station_ds,
+                "nes_station_nested_within": nested_within,
+                "nes_next_station_ds": next_ds,
+            },
+            index=self.basin_ids,
+        )
+
+    def sample(self, batch_size, seq_len, device="cpu"):
+        """randomly sample a batch of sequences
+
+        Parameters
+        ----------
+        batch_size
+            number of basins in the batch
+        seq_len
+            length of sequences
+        device
+            the device of tensors
+
+        Returns
+        -------
+        dict
+            x: raw forcing, (seq, batch, n_forcing);
+            c: normalized attributes, (batch, n_attr);
+            xc: normalized forcing and attributes, (seq, batch, n_forcing + n_attr);
+            y: targets, (seq, batch, n_target);
+            grid: gridded precipitation, (batch, seq, 1, grid_h, grid_w);
+            basin_idx: indices of chosen basins
+        """
+        if batch_size > self.n_basin or seq_len > self.n_time:
+            raise ValueError("batch_size or seq_len is larger than the synthetic data")
+        basin_idx = self.rng.choice(self.n_basin, batch_size, replace=False)
+        start = self.rng.integers(0, self.n_time - seq_len + 1)
+        x = self.forcing[start : start + seq_len, basin_idx]
+        c = self.attributes[basin_idx]
+        y = self.target[start : start + seq_len, basin_idx]
+        x_norm = (x - x.mean(axis=(0, 1))) / (x.std(axis=(0, 1)) + 1e-6)
+        xc = np.concatenate(
+            [x_norm, np.broadcast_to(c, (seq_len,) + c.shape)], axis=-1
+        )
+        # spread basin precipitation on a grid with some spatial noise
+        grid = x[:, :, 0].T[:, :, None, None, None] * self.rng.gamma(
+            4.0, 0.25, (batch_size, seq_len, 1) + self.grid_size
+        )
+        arrays = {"x": x, "c": c, "xc": xc, "y": y, "grid": grid}
+        batch = {
+            k: torch.from_numpy(np.ascontiguousarray(v, dtype=np.float32)).to(device)
+            for k, v in arrays.items()
+        }
+        batch["basin_idx"] = basin_idx
+        return batch
+
+
+def _n_param(model_name):
+    return len(MODEL_PARAM_DICT[model_name]["param_name"])
+
+
+def _dpl_ts_case(n_output, with_kernel=False):
+    def case(source, batch, n_hidden, warmup_length):
+        hyper = {
+            "n_input_features": batch["xc"].shape[-1],
+            "n_output_features": n_output,
+            "n_hidden_states": n_hidden,
+            "warmup_length": warmup_length,
+        }
+        if with_kernel:
+            hyper["kernel_size"] = 15
+        return hyper, (batch["x"], batch["xc"])
+
+    return case
+
+
+def _dpl_attr_case(n_output, with_kernel=False):
+    def case(source, batch, n_hidden, warmup_length):
+        hyper = {
+            "n_input_features": batch["c"].shape[-1],
+            "n_output_features": n_output,
+            "n_hidden_states": n_hidden,
+            "warmup_length": warmup_length,
+        }
+        if with_kernel:
+            hyper["kernel_size"] = 15
+        return hyper, (batch["x"], batch["c"])
+
+    return case
+
+
+def _lstm_case(source, batch, n_hidden, warmup_length):
+    hyper = {
+        "n_input_features": batch["xc"].shape[-1],
+        "n_output_features": batch["y"].shape[-1],
+        "n_hidden_states": n_hidden,
+    }
+    return hyper, (batch["xc"],)
+
+
+def _multi_out_case(source, batch, n_hidden, warmup_length):
+    hyper = {
+        "n_input_features": batch["xc"].shape[-1],
+        "n_output_features": 2,
+        "n_hidden_states": n_hidden,
+    }
+    return hyper, (batch["xc"],)
+
+
+def _kai_lstm_case(source, batch, n_hidden, warmup_length):
+    hyper = {
+        "linear_size": batch["xc"].shape[-1],
+        "n_input_features": n_hidden,
+        "n_output_features": batch["y"].shape[-1],
+        "n_hidden_states": n_hidden,
+    }
+    return hyper, (batch["xc"],)
+
+
+def _cnn_lstm_case(source, batch, n_hidden, warmup_length):
+    hyper = {
+        "nx": batch["xc"].shape[-1],
+        "ny": batch["y"].shape[-1],
+        "nobs": batch["c"].shape[-1],
+        "hidden_size": n_hidden,
+    }
+    return hyper, (batch["xc"], batch["c"][:, :, None])
+
+
+def _kernel_case(source, batch, n_hidden, warmup_length):
+    hyper = {
+        "nx": batch["xc"].shape[-1],
+        "ny": batch["y"].shape[-1],
+        "hidden_size": n_hidden,
+    }
+    return hyper, (batch["xc"],)
+
+
+def _rnn_case(**kwargs):
+    def case(source, batch, n_hidden, warmup_length):
+        hyper = {
+            "input_size": batch["xc"].shape[-1],
+            "output_size": batch["y"].shape[-1],
+            "hidden_size": n_hidden,
+        }
+        hyper |= kwargs
+        return hyper, (batch["xc"],)
+
+    return case
+
+
+def _forecast_lstm_case(source, batch, n_hidden, warmup_length):
+    hyper = {
+        "input_size": batch["xc"].shape[-1],
+        "output_size": batch["y"].shape[-1],
+        "hidden_size": n_hidden,
+        "forecast_length": batch["xc"].shape[0] // 4,
+    }
+    return hyper, (batch["xc"],)
+
+
+def _spp_lstm_case(source, batch, n_hidden, warmup_length):
+    seq_len = batch["grid"].shape[1]
+    hyper = {
+        "forecast_history": seq_len - seq_len // 4,
+        "forecast_length": seq_len // 4,
+        "n_output": batch["y"].shape[-1],
+        "n_hidden_states": n_hidden,
+        "dropout": 0.1,
+    }
+    return hyper, (batch["grid"],)
+
+
+def _spp_lstm2_case(source, batch, n_hidden, warmup_length):
+    seq_len = batch["grid"].shape[1]
+    hyper = {
+        "forecast_history": seq_len - seq_len // 4,
+        "forecast_length": seq_len // 4,
+        "p_n_output": batch["y"].shape[-1],
+        "p_n_hidden_states": n_hidden,
+        "p_dropout": 0.1,
+        "p_in_channels": 1,
+        "p_out_channels": 8,
+        "len_c": batch["c"].shape[-1],
+    }
+    c = batch["c"][None].expand(seq_len, -1, -1)
+    return hyper, (batch["grid"], c)
+
+
+def _seq2seq_inputs(batch, prec_window):
+    """batch-first encoder/decoder inputs and targets for seq2seq models"""
+    seq_len = batch["xc"].shape[0]
+    forecast_length = seq_len // 4
+    xc = batch["xc"].transpose(0, 1)
+    y = batch["y"].transpose(0, 1)
+    n_y = y.shape[-1]
+    # the target is known in the history period
+    src1 = torch.cat([xc[:, :-forecast_length], y[:, :-forecast_length]], dim=-1)
+    src2 = xc[:, -forecast_length:, :1]
+    trgs = y[:, -(forecast_length + prec_window) :]
+    return forecast_length, n_y, src1, src2, trgs
+
+
+def _seq2seq_kwargs(n_hidden, forecast_length, n_en, n_y, prec_window):
+    return {
+        "en_input_size": n_en,
+        "de_input_size": n_y + 1,
+        "output_size": n_y,
+        "hidden_size": n_hidden,
+        "forecast_length": forecast_length,
+        "prec_window": prec_window,
+    }
+
+
+def _seq2seq_case(source, batch, n_hidden, warmup_length):
+    prec_window = 1
+    forecast_length, n_y, src1, src2, trgs = _seq2seq_inputs(batch, prec_window)
+    hyper = _seq2seq_kwargs(n_hidden, forecast_length, src1.shape[-1], n_y, prec_window)
+    return hyper, (src1, src2, trgs)
+
+
+def _data_enhanced_case(source, batch, n_hidden, warmup_length):
+    prec_window = 1
+    forecast_length, n_y, src1, src2, trgs = _seq2seq_inputs(batch, prec_window)
+    # the first variable is enhanced to 6 variables
+    hyper = _seq2seq_kwargs(
+        n_hidden, forecast_length, src1.shape[-1] + 5, n_y, prec_window
+    )
+    hyper["hidden_length"] = n_hidden
+    return hyper, (src1, src2, trgs)
+
+
+def _data_fusion_case(source, batch, n_hidden, warmup_length):
+    prec_window = 1
+    forecast_length, n_y, src1, src2, trgs = _seq2seq_inputs(batch, prec_window)
+    # the first two variables are fused to 1, then enhanced to 6 variables
+    hyper = _seq2seq_kwargs(
+        n_hidden, forecast_length, src1.shape[-1] + 4, n_y, prec_window
+    )
+    hyper["hidden_length"] = n_hidden
+    hyper["input_dim"] = 2
+    return hyper, (src1, src2, trgs)
+
+
+def _transformer_case(source, batch, n_hidden, warmup_length):
+    seq_len = batch["xc"].shape[0]
+    forecast_length = seq_len // 4
+    src = torch.cat(
+        [batch["xc"][:-forecast_length], batch["y"][:-forecast_length]], dim=-1
+    )
+    trg = batch["xc"][-forecast_length:, :, :1]
+    hyper = {
+        "n_encoder_inputs": src.shape[-1],
+        "n_decoder_inputs": trg.shape[-1],
+        "n_decoder_output": batch["y"].shape[-1],
+        "channels": n_hidden,
+        "nhead": 4,
+        "num_layers": 2,
+    }
+    return hyper, (src, trg)
+
+
+def _nn_module_xaj_case(source, batch, n_hidden, warmup_length):
+    hyper, inputs = _dpl_ts_case(_n_param("xaj_mz"), with_kernel=True)(
+        source, batch, n_hidden, warmup_length
+    )
+    hyper |= {"et_output": 1, "param_var_index": []}
+    return hyper, inputs
+
+
+def _narx_kwargs(batch, n_hidden):
+    return {
+        "n_input_features": batch["x"].shape[-1] + batch["y"].shape[-1],
+        "n_output_features": batch["y"].shape[-1],
+        "n_hidden_states": n_hidden,
+        "input_delay": 2,
+        "feedback_delay": 2,
+        "num_layers": 2,
+    }
+
+
+def _narx_case(source, batch, n_hidden, warmup_length):
+    x = torch.cat([batch["xc"][:, :, : batch["x"].shape[-1]], batch["y"]], dim=-1)
+    return _narx_kwargs(batch, n_hidden), (x,)
+
+
+def _nested_narx_case(source, batch, n_hidden, warmup_length):
+    # whole basin trees are needed, so basins of the batch are not randomly chosen
+    n_basin = batch["x"].shape[1]
+    outlets = source.basin_ids[: n_basin : 2]
+    nested_model = BasinTree(source.read_nestedness()).get_basin_trees(outlets)
+    idx = [source.basin_ids.index(b) for b in nested_model["basin_list"]]
+    seq_len = batch["x"].shape[0]
+    x = np.concatenate(
+        [source.forcing[:seq_len, idx], source.target[:seq_len, idx]], axis=-1
+    )
+    x = (x - x.mean(axis=(0, 1))) / (x.std(axis=(0, 1)) + 1e-6)
+    hyper = _narx_kwargs(batch, n_hidden)
+    hyper["nested_model"] = nested_model
+    return hyper, (torch.from_numpy(x).to(batch["x"].device),)
+
+
+"""
+Builders of hyperparameters and inputs for every model in pytorch_model_dict.
+All inputs are sequence-first except the seq2seq-family models, which are batch-first.
+"""
+MODEL_BENCHMARK_CASES = {
+    "KuaiLSTM": _lstm_case,
+    "CpuLSTM": _lstm_case,
+    "KaiLSTM": _kai_lstm_case,
+    "DapengCNNLSTM": _cnn_lstm_case,
+    "LSTMKernel": _kernel_case,
+    "KuaiLSTMMultiOut": _multi_out_case,
+    "DplLstmXaj": _dpl_ts_case(_n_param("xaj_mz"), with_kernel=True),
+    "DplAttrXaj": _dpl_attr_case(_n_param("xaj_mz"), with_kernel=True),
+    "SPPLSTM": _spp_lstm_case,
+    "SimpleLSTMForecast": _forecast_lstm_case,
+    "SPPLSTM2": _spp_lstm2_case,
+    "Seq2Seq": _seq2seq_case,
+    "DataEnhanced": _data_enhanced_case,
+    "DataFusion": _data_fusion_case,
+    "Transformer": _transformer_case,
+    "DplNnModuleXaj": _nn_module_xaj_case,
+    # 12 parameters of HBV and 2 of its gamma unit hydrograph
+    "DplLstmHbv": _dpl_ts_case(14),
+    "DplAnnHbv": _dpl_attr_case(14),
+    "DplLstmGr4j": _dpl_ts_case(_n_param("gr4j")),
+    "DplAnnGr4j": _dpl_attr_case(_n_param("gr4j")),
+    # ANNs of dPL-SAC and dPL-Tank take time series as input too
+    "DplAnnSac": _dpl_ts_case(_n_param("sac")),
+    "DplLstmSac": _dpl_ts_case(_n_param("sac")),
+    "DplAnnTank": _dpl_ts_case(_n_param("tank")),
+    "DplLstmTank": _dpl_ts_case(_n_param("tank")),
+    "Narx": _narx_case,
+    "NestedNarx": _nested_narx_case,
+    "sLSTM": _rnn_case(num_layers=2),
+    "pcLSTM": _rnn_case(num_layers=2),
+    "biLSTM": _rnn_case(),
+    "sGRU": _rnn_case(num_layers=2),
+    "stackedGRU": _rnn_case(num_layers=2),
+    "CpuGruModel": _rnn_case(),
+    "CudnnGruModel": _rnn_case(),
+    "CudnnGruModelGruKernel": _rnn_case(),
+    "CudnnGruModelMultiOutput": _multi_out_case,
+}
+
+
+class _PeakRssMonitor:
+    """sample the resident memory of this process in a thread to get its peak"""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.baseline = self.process.memory_info().rss
+        self.peak = self.baseline
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def _first_tensor(output):
+    # some models return a tuple, e.g. (output, states)
+    while isinstance(output, (tuple, list)):
+        output = output[0]
+    return output
+
+
+def _sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def _train_step(model, inputs, device):
+    """one forward and backward pass; return the time (s) of both"""
+    _sync(device)
+    start = time.perf_counter()
+    output = _first_tensor(model(*inputs))
+    _sync(device)
+    forward_end = time.perf_counter()
+    # a mean square loss so that gradients reach every output
+    loss = torch.nanmean(output**2)
+    loss.backward()
+    _sync(device)
+    backward_end = time.perf_counter()
+    model.zero_grad(set_to_none=True)
+    return forward_end - start, backward_end - forward_end
+
+
+def _peak_memory(model, inputs, device):
+    """peak memory (MB) of one forward and backward pass over the memory before it"""
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = torch.cuda.memory_allocated(device)
+        _train_step(model, inputs, device)
+        return (torch.cuda.max_memory_allocated(device) - baseline) / 2**20
+    if psutil is None:
+        return None
+    with _PeakRssMonitor() as monitor:
+        _train_step(model, inputs, device)
+    return (monitor.peak - monitor.baseline) / 2**20
+
+
+def benchmark_model(
+    model_name,
+    source,
+    batch_size=32,
+    seq_len=365,
+    n_hidden=64,
+    warmup_length=30,
+    n_warmup=1,
+    n_repeat=5,
+    device="cpu",
+):
+    """time forward and backward passes of one model in pytorch_model_dict
+
+    Parameters
+    ----------
+    model_name
+        the key in pytorch_model_dict
+    source
+        a SyntheticDataSource
+    batch_size
+        number of basins in a batch
+    seq_len
+        length of input sequences
+    n_hidden
+        hidden size of the model
+    warmup_length
+        warmup length of dPL models
+    n_warmup
+        number of untimed passes before timing
+    n_repeat
+        number of timed passes; medians are reported
+    device
+        the device to run the model
+
+    Returns
+    -------
+    dict
+        status, hyperparameters and the performance of the model;
+        if the model failed, status is "error" and the message is recorded
+    """
+    device = torch.device(device)
+    result = {"status": "ok"}
+    try:
+        torch.manual_seed(0)
+        batch = source.sample(batch_size, seq_len, device)
+        hyper, inputs = MODEL_BENCHMARK_CASES[model_name](
+            source, batch, n_hidden, warmup_length
+        )
+        result["model_hyperparam"] = {
+            k: v for k, v in hyper.items() if k != "nested_model"
+        }
+        model = pytorch_model_dict[model_name](**hyper).to(device)
+        model.train()
+        result["n_parameters"] = sum(p.numel() for p in model.parameters())
+        for _ in range(n_warmup):
+            _train_step(model, inputs, device)
+        times = np.array([_train_step(model, inputs, device) for _ in range(n_repeat)])
+        forward_s, backward_s = np.median(times, axis=0)
+        result |= {
+            "forward_ms": 1000 * forward_s,
+            "backward_ms": 1000 * backward_s,
+            "forward_samples_per_s": batch_size / forward_s,
+            "train_samples_per_s": batch_size / (forward_s + backward_s),
+            "peak_memory_mb": _peak_memory(model, inputs, device),
+        }
+    except Exception as e:
+        result["status"] = "error"
+        # only the first sentence, as some torch errors list all dispatch keys
+        message = str(e).strip().split("\n")[0].split(". ")[0]
+        result["error"] = f"{type(e).__name__}: {message}"
+    return result
+
+
+def run_model_benchmark(
+    model_names=None,
+    batch_size=32,
+    seq_len=365,
+    n_hidden=64,
+    warmup_length=30,
+    n_warmup=1,
+    n_repeat=5,
+    device="cpu",
+    seed=1234,
+):
+    """benchmark models in pytorch_model_dict with a same synthetic data source
+
+    Parameters
+    ----------
+    model_names
+        keys of pytorch_model_dict; by default, all models are benchmarked
+    other parameters
+        see benchmark_model
+
+    Returns
+    -------
+    dict
+        "meta" for the environment and settings, and "results" for every model
+    """
+    if model_names is None:
+        model_names = list(pytorch_model_dict.keys())
+    source = SyntheticDataSource(
+        n_basin=max(64, batch_size), n_time=max(730, seq_len), seed=seed
+    )
+    meta = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "torch_version": torch.__version__,
+        "python_version": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "device": str(device),
+        "num_threads": torch.get_num_threads(),
+        "batch_size": batch_size,
+        "seq_len": seq_len,
+        "n_hidden": n_hidden,
+        "warmup_length": warmup_length,
+        "n_repeat": n_repeat,
+    }
+    results = {}
+    for model_name in model_names:
+        results[model_name] = benchmark_model(
+            model_name,
+            source,
+            batch_size=batch_size,
+            seq_len=seq_len,
+            n_hidden=n_hidden,
+            warmup_length=warmup_length,
+            n_warmup=n_warmup,
+            n_repeat=n_repeat,
+            device=device,
+        )
+    return {"meta": meta, "results": results}
+
+
+def save_model_benchmark(benchmark, json_file):
+    """save the result of run_model_benchmark to a json file"""
+    dir_name = os.path.dirname(json_file)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    with open(json_file, "w") as f:
+        json.dump(benchmark, f, indent=4, default=float)
+
+
+# models whose recurrent cells run step by step in python, and their counterparts
+# built on nn.LSTM and nn.GRU with the same hyperparameters
+RNN_BENCHMARK_PAIRS = {"pcLSTM": "sLSTM", "stackedGRU": "sGRU"}
+
+
+def run_rnn_benchmark(pairs=None, **kwargs):
+    """benchmark recurrent models against their nn.LSTM and nn.GRU counterparts
+
+    Parameters
+    ----------
+    pairs
+        model name -> name of its counterpart; by default RNN_BENCHMARK_PAIRS
+    kwargs
+        see run_model_benchmark
+
+    Returns
+    -------
+    dict
+        the result of run_model_benchmark with "comparison", the time of each model
+        over the time of its counterpart, for models which both ran successfully
+    """
+    if pairs is None:
+        pairs = RNN_BENCHMARK_PAIRS
+    model_names = list(dict.fromkeys(list(pairs) + list(pairs.values())))
+    benchmark = run_model_benchmark(model_names, **kwargs)
+    results = benchmark["results"]
+    comparison = {}
+    for model_name, baseline in pairs.items():
+        result, base = results[model_name], results[baseline]
+        if result["status"] != "ok" or base["status"] != "ok":
+            continue
+        comparison[model_name] = {
+            "baseline": baseline,
+            "forward_ratio": result["forward_ms"] / base["forward_ms"],
+            "backward_ratio": result["backward_ms"] / base["backward_ms"],
+        }
+    benchmark["comparison"] = comparison
+    return benchmark
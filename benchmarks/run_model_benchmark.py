@@ -0,0 +1,50 @@
+"""
+Benchmark models in pytorch_model_dict with synthetic data and save results to a json file
+
+Run it from the root of the repository: python -m benchmarks.run_model_benchmark --models KuaiLSTM
+"""
+
+import argparse
+
+import torch
+
+from benchmarks.model_benchmark import run_model_benchmark, save_model_benchmark
+
+
+def run_benchmark(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    benchmark = run_model_benchmark(
+        model_names=args.models,
+        batch_size=args.batch_size,
+        seq_len=args.seq_len,
+        n_hidden=args.n_hidden,
+        warmup_length=args.warmup_length,
+        n_repeat=args.n_repeat,
+        device=args.device,
+    )
+    save_model_benchmark(benchmark, args.output)
+    for model_name, result in benchmark["results"].items():
+        if result["status"] == "ok":
+            print(
+                f"{model_name}: forward {result['forward_ms']:.2f} ms, "
+                f"backward {result['backward_ms']:.2f} ms"
+            )
+        else:
+            print(f"{model_name}: {result['error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark of torchhydro models")
+    parser.add_argument(
+        "--models", nargs="+", default=None, help="model names; all models by default"
+    )
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--seq_len", type=int, default=365)
+    parser.add_argument("--n_hidden", type=int, default=64)
+    parser.add_argument("--warmup_length", type=int, default=30)
+    parser.add_argument("--n_repeat", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", type=str, default="model_benchmark.json")
+    run_benchmark(parser.parse_args())
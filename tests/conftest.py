@@ -17,6 +17,24 @@ def configure_logging():
         logger.setLevel(logging.INFO)
 
 
+@pytest.fixture(params=["xaj", "hbv", "gr4j", "sac", "tank"])
+def pbm_case(request):
+    """A physics-based model of dPL: (factory taking its kwargs, number of input features, number of parameters)"""
+    from torchhydro.models.dpl4gr4j import Gr4j4Dpl
+    from torchhydro.models.dpl4hbv import Hbv4Dpl
+    from torchhydro.models.dpl4sac import Sac4Dpl
+    from torchhydro.models.dpl4tank import Tank4Dpl
+    from torchhydro.models.dpl4xaj import Xaj4Dpl
+
+    return {
+        "xaj": (lambda **kwargs: Xaj4Dpl(15, 10, **kwargs), 2, 15),
+        "hbv": (lambda **kwargs: Hbv4Dpl(10, **kwargs), 3, 14),
+        "gr4j": (lambda **kwargs: Gr4j4Dpl(10, **kwargs), 2, 4),
+        "sac": (lambda **kwargs: Sac4Dpl(10, **kwargs), 2, 21),
+        "tank": (lambda **kwargs: Tank4Dpl(10, **kwargs), 2, 20),
+    }[request.param]
+
+
 @pytest.fixture(scope="session")
 def basin4test():
     """Read the basin ID list, only choose final 5 basins as test data"""
@@ -247,3 +247,97 @@ def test_get_basin_tree():
 # test_basintree.py .                                                      [100%]
 
 # Finished running tests!
+
+
+def test_nestednarx_level_parallel():
+    import pandas as pd
+    import torch
+    from torchhydro.models.narx import NestedNarx
+
+    nestedness = pd.DataFrame(
+        {
+            "nes_n_nested_within": [5, 2, 1, 0, 0, 0, 1, 0, 0, 0],
+            "nes_n_station_ds": [0, 1, 1, 2, 2, 2, 0, 1, 0, 0],
+            "nes_station_nested_within": [
+                "A,B,C,D,E", "C,D", "E", None, None, None, "F", None, None, None,
+            ],
+            "nes_next_station_ds": [None, "R", "R", "A", "A", "B", None, "Q", None, None],
+        },
+        index=["R", "A", "B", "C", "D", "E", "Q", "F", "S1", "S2"],
+    )
+    nested_model = BasinTree(nestedness).get_basin_trees(["R", "Q", "S1", "S2"])
+    model = NestedNarx(3, 1, 8, 2, 2, num_layers=2, nested_model=nested_model, level_parallel=True)
+    x = torch.rand(20, len(nested_model["basin_list"]), 3)
+    out_parallel = model(x.clone())
+    model.level_parallel = False
+    out_sequential = model(x.clone())
+    assert out_parallel.shape == (20, 10, 1)
+    torch.testing.assert_close(out_parallel, out_sequential)
+
+
+def _small_nestedness():
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            "nes_n_nested_within": [5, 2, 1, 0, 0, 0, 1, 0, 0, 0],
+            "nes_n_station_ds": [0, 1, 1, 2, 2, 2, 0, 1, 0, 0],
+            "nes_station_nested_within": [
+                "A,B,C,D,E", "C,D", "E", None, None, None, "F", None, None, None,
+            ],
+            "nes_next_station_ds": [None, "R", "R", "A", "A", "B", None, "Q", None, None],
+        },
+        index=["R", "A", "B", "C", "D", "E", "Q", "F", "S1", "S2"],
+    )
+
+
+def test_basin_graph_index(tmp_path):
+    import numpy as np
+    from torchhydro.models.basintree import BasinGraphIndex
+
+    nestedness = _small_nestedness()
+    index = BasinGraphIndex.from_nestedness(nestedness)
+    np.testing.assert_array_equal(index.downstream, [-1, 0, 0, 1, 1, 2, -1, 6, -1, -1])
+    np.testing.assert_array_equal(index.level, [0, 1, 1, 2, 2, 2, 0, 1, 0, 0])
+    np.testing.assert_array_equal(index.level_offsets, [0, 4, 7, 10])
+    r = index.position["R"]
+    np.testing.assert_array_equal(
+        index.direct_upstream[index.direct_upstream_offsets[r]: index.direct_upstream_offsets[r + 1]], [1, 2]
+    )
+    assert index.basin_ids[index.upstream_of(index.position["A"])].tolist() == ["C", "D"]
+    covered = index.covered_by([index.position["A"], index.position["Q"]])
+    assert index.basin_ids[covered].tolist() == ["C", "D", "F"]
+
+    cached = BasinGraphIndex.cached(nestedness, tmp_path)
+    assert len(list(tmp_path.glob("basin_graph_*.npz"))) == 1
+    loaded = BasinGraphIndex.cached(nestedness, tmp_path)
+    for name in BasinGraphIndex.array_names:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
+        np.testing.assert_array_equal(getattr(cached, name), getattr(index, name))
+
+
+def test_basin_graph_index_loop():
+    import pytest
+    from torchhydro.models.basintree import BasinGraphIndex
+
+    nestedness = _small_nestedness()
+    nestedness.loc["R", "nes_next_station_ds"] = "C"
+    with pytest.raises(ValueError):
+        BasinGraphIndex.from_nestedness(nestedness)
+
+
+def test_basin_trees_with_graph_index():
+    nested_model = BasinTree(_small_nestedness()).get_basin_trees(["R", "A", "D", "Q", "S1", "S2"])
+    assert nested_model["basin_list_array"] == [
+        [["R"], ["A", "B"], ["C", "D", "E"]],
+        [["Q"], ["F"]],
+        [["S1", "S2"]],
+    ]
+    assert nested_model["basin_list"] == ["R", "A", "B", "C", "D", "E", "Q", "F", "S1", "S2"]
+    assert nested_model["order_list"] == [1, 2, 2, 3, 3, 3, 1, 2, 1, 1]
+    assert nested_model["n_basin_per_order_list"] == [[1, 2, 3], [1, 1], [2]]
+    assert nested_model["n_basin_per_order"] == [4, 3, 3]
+    assert nested_model["basin_tree_max_order"] == 3
+    basin_a = nested_model["basin_trees"][0][1][0]
+    assert basin_a.node_us.basin_us == ["C", "D"]
+    assert basin_a.node_ds is nested_model["basin_trees"][0][0][0].node_us
@@ -6,9 +6,15 @@ LastEditors: Lili Yu
 Description: test stl and mi module
 """
 
+import numpy as np
 import pandas as pd
 from hydrodataset import CamelsYstl
-from torchhydro.datasets.mi_stl import STL, MutualInformation, Decomposition
+from torchhydro.datasets.mi_stl import (
+    STL,
+    ArraySTL,
+    MutualInformation,
+    Decomposition,
+)
 
 
 def test_dataset():
@@ -1268,3 +1274,42 @@ def test_time_step():
     print(mi_)
 # time_step = 4
 # [0, 5.633958429349199, 5.63192183686367, 5.62844013674035, 5.640264980453122, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+
+
+def test_array_stl_loess():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(3, 40))
+    rho_weight = rng.uniform(0.2, 1, size=(3, 40))
+    stl = STL(frequency=1, cycle_length=12)
+    array_stl = ArraySTL(cycle_length=12)
+    for degree in [1, 2]:
+        result = array_stl.loess(9, x, degree=degree, rho_weight=rho_weight)
+        for i in range(x.shape[0]):
+            result_i = stl.loess(9, x[i].tolist(), degree, rho_weight[i].tolist())
+            np.testing.assert_allclose(result[i], result_i, atol=1e-10)
+    result = array_stl.moving_average_smoothing(10, x)
+    for i in range(x.shape[0]):
+        result_i = stl.moving_average_smoothing(10, x[i].tolist())
+        np.testing.assert_allclose(result[i], result_i, atol=1e-10)
+
+
+def test_array_stl_decompose():
+    rng = np.random.default_rng(0)
+    cycle_length = 12
+    time = np.arange(cycle_length * 10)
+    x = (
+        50
+        + 10 * np.sin(time * 2 * np.pi / cycle_length)
+        + 0.1 * time
+        + rng.normal(0, 3, size=(4, time.size))
+    )
+    params = {"ns": 7, "nl": 13, "nt": 19, "n_p": 12}
+    trend, season, residuals = ArraySTL(cycle_length, **params).decompose(x)
+    assert trend.shape == season.shape == residuals.shape == x.shape
+    stl = STL(1, cycle_length, **params)
+    for i in range(x.shape[0]):
+        trend_i, season_i, residuals_i = stl.decompose(x[i].tolist())
+        # results are rounded to 2 decimals
+        np.testing.assert_allclose(trend[i], trend_i, atol=0.011)
+        np.testing.assert_allclose(season[i], season_i, atol=0.011)
+        np.testing.assert_allclose(residuals[i], residuals_i, atol=0.011)
@@ -195,3 +195,82 @@ def test_forward_with_initial_states():
     assert output.shape == (20, 5, 20), "Output shape mismatch"
     assert hy.shape == (1, 5, 20), "Hidden state shape mismatch"
     assert cy.shape == (1, 5, 20), "Cell state shape mismatch"
+
+
+def _run_lstm_cell_tied(model, x, mask_w_ih=None, mask_w_hh=None):
+    """the sequence of CudnnLstmModel calculated by LstmCellTied step by step"""
+    from torchhydro.models.cudnnlstm import LstmCellTied
+
+    cell = LstmCellTied(
+        input_size=model.hidden_size, hidden_size=model.hidden_size, dr=0.0, dr_method="drW", gpu=-1
+    )
+    cell.load_state_dict(model.lstm.state_dict())
+    w_ih, w_hh = cell.w_ih, cell.w_hh
+    if mask_w_ih is not None:
+        cell.w_ih.data, cell.w_hh.data = w_ih.data * mask_w_ih, w_hh.data * mask_w_hh
+    ht, ct = None, None
+    out = []
+    for t in range(x.shape[0]):
+        ht, ct = cell(torch.relu(model.linearIn(x[t])), hidden=(ht, ct))
+        out.append(model.linearOut(ht))
+    return torch.stack(out)
+
+
+def test_cudnn_lstm_model_cpu():
+    torch.manual_seed(0)
+    model = CudnnLstmModel(
+        n_input_features=10, n_output_features=1, n_hidden_states=20, dr=0.5
+    )
+    input_data = torch.randn(20, 5, 10)
+    model.eval()
+    torch.testing.assert_close(model(input_data), _run_lstm_cell_tied(model, input_data))
+    # weight dropout: masks are newly generated in training, and the same for all time steps
+    model.train()
+    output = model(input_data)
+    torch.testing.assert_close(
+        output,
+        _run_lstm_cell_tied(model, input_data, model.lstm.mask_w_ih, model.lstm.mask_w_hh),
+    )
+    output.sum().backward()
+    assert model.lstm.w_ih.grad is not None
+    output, (hy, cy) = model.lstm(torch.randn(20, 5, 20), do_drop_mc=True)
+    assert output.shape == (20, 5, 20)
+    assert hy.shape == (1, 5, 20)
+    assert cy.shape == (1, 5, 20)
+
+
+def test_cpu_lstm_model_loads_cudnn_lstm_model():
+    from torchhydro.models.cudnnlstm import CpuLstmModel
+
+    torch.manual_seed(0)
+    model = CudnnLstmModel(
+        n_input_features=10, n_output_features=2, n_hidden_states=20, dr=0.5
+    )
+    cpu_model = CpuLstmModel(
+        n_input_features=10, n_output_features=2, n_hidden_states=20, dr=0.5
+    )
+    cpu_model.load_state_dict(model.state_dict())
+    model.eval()
+    cpu_model.eval()
+    input_data = torch.randn(20, 5, 10)
+    torch.testing.assert_close(cpu_model(input_data), model(input_data))
+
+
+def test_cudnn_gru_model_cpu():
+    from torchhydro.models.slstm import CudnnGruModel
+
+    torch.manual_seed(0)
+    model = CudnnGruModel(10, 1, 20, dr=0.5)
+    model.eval()
+    gru = torch.nn.GRU(20, 20)
+    with torch.no_grad():
+        gru.weight_ih_l0.copy_(torch.cat([model.gru.w_irz, model.gru.w_in]))
+        gru.weight_hh_l0.copy_(torch.cat([model.gru.w_hrz, model.gru.w_hn]))
+        gru.bias_ih_l0.copy_(torch.cat([model.gru.b_irz, model.gru.b_in]))
+        gru.bias_hh_l0.copy_(torch.cat([model.gru.b_hrz, model.gru.b_hn]))
+    input_data = torch.randn(20, 5, 10)
+    expected = model.linearOut(gru(torch.relu(model.linearIn(input_data)))[0])
+    torch.testing.assert_close(model(input_data), expected)
+    model.train()
+    model(input_data).sum().backward()
+    assert model.gru.w_irz.grad is not None
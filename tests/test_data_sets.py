@@ -16,7 +16,8 @@ import torch
 import xarray as xr
 import pickle
 from sklearn.preprocessing import StandardScaler
-from torchhydro.datasets.data_sets import BaseDataset, Seq2SeqDataset
+from torch.utils.data import DataLoader, default_collate
+from torchhydro.datasets.data_sets import BaseDataset, Seq2SeqDataset, get_collate_fn
 from torchhydro.datasets.data_sources import data_sources_dict
 
 
@@ -127,12 +128,10 @@ def test_create_lookup_table(tmp_path):
     is_tra_val_te = "train"
     dataset = BaseDataset(data_cfgs, is_tra_val_te)
     lookup_table = dataset.lookup_table
-    assert isinstance(lookup_table, dict)
+    assert isinstance(lookup_table, np.ndarray)
+    assert lookup_table.dtype == np.int32
+    assert lookup_table.ndim == 2 and lookup_table.shape[1] == 2
     assert len(lookup_table) > 0
-    assert all(
-        isinstance(key, int) and isinstance(value, tuple)
-        for key, value in lookup_table.items()
-    )
     is_tra_val_te = "test"
     mock_data = np.random.rand(100, 2)  # Replace with relevant data.
     scaler = StandardScaler()
@@ -143,9 +142,151 @@ def test_create_lookup_table(tmp_path):
         pickle.dump(scaler, file)
     dataset = BaseDataset(data_cfgs, is_tra_val_te)
     lookup_table = dataset.lookup_table
-    assert isinstance(lookup_table, dict)
+    assert isinstance(lookup_table, np.ndarray)
+    assert lookup_table.dtype == np.int32
+    assert lookup_table.ndim == 2 and lookup_table.shape[1] == 2
     assert len(lookup_table) > 0
-    assert all(
-        isinstance(key, int) and isinstance(value, tuple)
-        for key, value in lookup_table.items()
+
+
+def test_dataset_store(tmp_path, monkeypatch):
+    temp_test_path = tmp_path / "test_datasets"
+    os.makedirs(temp_test_path, exist_ok=True)
+    monkeypatch.setattr(
+        "torchhydro.datasets.data_store.CACHE_DIR", tmp_path / "cache"
+    )
+    data_sources_dict.update({"mockdatasource": MockDatasource})
+    data_cfgs = {
+        "source_cfgs": {
+            "source_name": "mockdatasource",
+            "source_path": str(temp_test_path),
+        },
+        "test_path": str(temp_test_path),
+        "object_ids": ["01013500", "01013501"],
+        "t_range_train": ["2001-01-01", "2002-01-01"],
+        "t_range_test": ["2002-01-01", "2003-01-01"],
+        "relevant_cols": ["prcp", "pet"],
+        "target_cols": ["streamflow", "surface_sm"],
+        "constant_cols": ["geol_1st_class", "geol_2nd_class"],
+        "forecast_history": 7,
+        "warmup_length": 14,
+        "forecast_length": 1,
+        "min_time_unit": "D",
+        "min_time_interval": 1,
+        "target_rm_nan": True,
+        "relevant_rm_nan": True,
+        "constant_rm_nan": True,
+        "scaler": "StandardScaler",
+        "stat_dict_file": None,
+        "b_cache_dataset": True,
+    }
+    dataset = BaseDataset(data_cfgs, "train")
+    assert isinstance(dataset.x, np.memmap)
+    # the mock data source gives random data, so same data means it is from the store
+    dataset_cached = BaseDataset(data_cfgs, "train")
+    np.testing.assert_array_equal(dataset_cached.x, dataset.x)
+    np.testing.assert_array_equal(dataset_cached.c, dataset.c)
+    np.testing.assert_array_equal(dataset_cached.lookup_table, dataset.lookup_table)
+    xc, y = dataset_cached[0]
+    xc_, y_ = dataset[0]
+    assert torch.equal(xc, xc_) and torch.equal(y, y_)
+    # memory-mapped arrays are reopened rather than pickled
+    dataset_unpickled = pickle.loads(pickle.dumps(dataset_cached))
+    assert isinstance(dataset_unpickled.x, np.memmap)
+    np.testing.assert_array_equal(dataset_unpickled.y, dataset.y)
+
+
+def test_dataset_store_save_is_atomic(tmp_path):
+    from torchhydro.datasets.data_store import DatasetStore
+
+    store = DatasetStore("key", store_dir=tmp_path)
+    x = np.arange(6.0).reshape(2, 3)
+    store.save({"x": x, "c": None}, np.zeros((2, 2), dtype=np.int32), None)
+    arrays, _, _ = store.load()
+    # another process saving the same store doesn't overwrite memory-mapped arrays
+    DatasetStore("key", store_dir=tmp_path).save(
+        {"x": x + 1}, np.zeros((2, 2), dtype=np.int32), None
     )
+    np.testing.assert_array_equal(arrays["x"], x)
+    np.testing.assert_array_equal(store.load()[0]["x"], x)
+    assert os.listdir(tmp_path) == ["key"]
+    # a broken store without meta.json is replaced
+    store.clear()
+    os.makedirs(store.store_path)
+    np.save(store.array_file("x"), x + 2)
+    store.save({"x": x}, np.zeros((2, 2), dtype=np.int32), None)
+    np.testing.assert_array_equal(store.load()[0]["x"], x)
+
+
+def test_dataset_getitems(tmp_path):
+    temp_test_path = tmp_path / "test_datasets"
+    os.makedirs(temp_test_path, exist_ok=True)
+    data_sources_dict.update({"mockdatasource": MockDatasource})
+    data_cfgs = {
+        "source_cfgs": {
+            "source_name": "mockdatasource",
+            "source_path": str(temp_test_path),
+        },
+        "test_path": str(temp_test_path),
+        "object_ids": ["01013500", "01013501"],
+        "t_range_train": ["2001-01-01", "2002-01-01"],
+        "t_range_test": ["2002-01-01", "2003-01-01"],
+        "relevant_cols": ["prcp", "pet"],
+        "target_cols": ["streamflow", "surface_sm"],
+        "constant_cols": ["geol_1st_class", "geol_2nd_class"],
+        "forecast_history": 7,
+        "warmup_length": 14,
+        "forecast_length": 1,
+        "min_time_unit": "D",
+        "min_time_interval": 1,
+        "target_rm_nan": True,
+        "relevant_rm_nan": True,
+        "constant_rm_nan": True,
+        "scaler": "StandardScaler",
+        "stat_dict_file": None,
+    }
+    for is_tra_val_te in ["train", "test"]:
+        dataset = BaseDataset(data_cfgs, is_tra_val_te)
+        items = [len(dataset) - 1, 0, 1]
+        samples = dataset.__getitems__(items)
+        assert len(samples) == len(items)
+        for (xc, y), item in zip(samples, items):
+            xc_, y_ = dataset[item]
+            assert torch.equal(xc, xc_) and torch.equal(y, y_)
+        expected = default_collate([dataset[i] for i in range(2)])
+        # the default collate_fn works with the samples too, get_collate_fn only skips stacking them
+        for collate_fn in [None, get_collate_fn(dataset)]:
+            loader = DataLoader(
+                dataset, batch_size=2, shuffle=False, collate_fn=collate_fn
+            )
+            xc, y = next(iter(loader))
+            assert torch.equal(xc, expected[0]) and torch.equal(y, expected[1])
+        keys = dataset.sample_keys(items)
+        basin, idx = dataset.lookup_table[0] if dataset.train_mode else (0, 0)
+        assert keys[1] == (dataset.basins[basin], dataset.times[idx])
+
+
+def test_data_source_pool(tmp_path):
+    from torchhydro.datasets.data_sources import (
+        HandlePool,
+        get_data_source,
+        invalidate_data_sources,
+        open_ts_xrdataset,
+    )
+
+    data_sources_dict.update({"mockdatasource": MockDatasource})
+    source = get_data_source("mockdatasource", str(tmp_path))
+    assert get_data_source("mockdatasource", str(tmp_path)) is source
+    assert get_data_source("mockdatasource", str(tmp_path / "other")) is not source
+    nc_file = tmp_path / "ts.nc"
+    xr.Dataset({"streamflow": (["basin", "time"], np.ones((2, 3)))}).to_netcdf(nc_file)
+    ts = open_ts_xrdataset(nc_file)
+    assert open_ts_xrdataset(nc_file) is ts
+    invalidate_data_sources(nc_file)
+    assert open_ts_xrdataset(nc_file) is not ts
+    invalidate_data_sources()
+    assert get_data_source("mockdatasource", str(tmp_path)) is not source
+    # least recently used objects are evicted
+    pool = HandlePool(maxsize=2)
+    for key in ["a", "b", "a", "c"]:
+        pool.get(key, object)
+    assert "a" in pool and "c" in pool and "b" not in pool
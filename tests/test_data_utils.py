@@ -11,7 +11,7 @@ import numpy as np
 import pytest
 import xarray as xr
 
-from torchhydro.datasets.data_utils import warn_if_nan
+from torchhydro.datasets.data_utils import create_lookup_table, warn_if_nan
 
 
 def test_warn_if_nan_no_nan_values():
@@ -52,3 +52,25 @@ def test_warn_if_nan_max_display():
         match=r"The dataarray contains 3 NaN values! Here are the indices of the first 2 NaNs:",
     ):
         warn_if_nan(da, max_display=2)
+
+
+@pytest.mark.parametrize("rm_all_nan", [True, False])
+def test_create_lookup_table(rm_all_nan):
+    rng = np.random.default_rng(42)
+    y = rng.random((4, 60, 2))
+    y[0, 20:40, :] = np.nan
+    y[1, :, 0] = np.nan
+    y[2, 35:, :] = np.nan
+    warmup_length, rho, horizon, nt = 5, 7, 3, 62
+    lookup = create_lookup_table(y, warmup_length, rho, horizon, nt, rm_all_nan)
+    # the same windows as looping over every basin and time
+    expected = [
+        (basin, f)
+        for basin in range(y.shape[0])
+        for f in range(warmup_length, nt - rho - horizon + 1)
+        if not (
+            rm_all_nan and np.all(np.isnan(y[basin, f + rho : f + rho + horizon]))
+        )
+    ]
+    assert lookup.dtype == np.int32
+    np.testing.assert_array_equal(lookup, np.array(expected).reshape(-1, 2))
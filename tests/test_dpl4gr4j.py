@@ -0,0 +1,53 @@
+"""Test funcs for GR4J model in dPL"""
+
+import math
+
+import torch
+
+from torchhydro.models.dpl4gr4j import Gr4j4Dpl, uh_gr4j
+
+
+def s_curve1(t, x4):
+    return 0.0 if t <= 0 else min(t / x4, 1.0) ** 2.5
+
+
+def s_curve2(t, x4):
+    if t <= 0:
+        return 0.0
+    if t <= x4:
+        return 0.5 * (t / x4) ** 2.5
+    return 1.0 - 0.5 * max(2 - t / x4, 0.0) ** 2.5 if t < 2 * x4 else 1.0
+
+
+def test_uh_gr4j():
+    # an integer x4 is included as ordinates of a basin end exactly at it
+    x4 = torch.tensor([1.1, 1.5, 2.0, 2.9], dtype=torch.float64, requires_grad=True)
+    uh1, uh2 = uh_gr4j(x4, 2.9)
+    assert uh1.shape == (3, 4, 1)
+    assert uh2.shape == (6, 4, 1)
+    for j, x4_j in enumerate(x4.tolist()):
+        uh1_j = [
+            s_curve1(t, x4_j) - s_curve1(t - 1, x4_j)
+            for t in range(1, math.ceil(x4_j) + 1)
+        ]
+        uh2_j = [
+            s_curve2(t, x4_j) - s_curve2(t - 1, x4_j)
+            for t in range(1, math.ceil(2 * x4_j) + 1)
+        ]
+        uh1_j += [0.0] * (uh1.shape[0] - len(uh1_j))
+        uh2_j += [0.0] * (uh2.shape[0] - len(uh2_j))
+        torch.testing.assert_close(uh1[:, j, 0], torch.tensor(uh1_j, dtype=torch.float64))
+        torch.testing.assert_close(uh2[:, j, 0], torch.tensor(uh2_j, dtype=torch.float64))
+    # the length of kernels is decided by x4 itself when max_x4 is not given
+    assert uh_gr4j(x4)[1].shape == (6, 4, 1)
+    grad = torch.autograd.grad((uh1.sum() + (uh2 * uh2).sum()), x4)[0]
+    assert torch.isfinite(grad).all()
+
+
+def test_gr4j4dpl():
+    p_and_e = torch.rand(50, 5, 2) * 10
+    parameters = torch.rand(5, 4, requires_grad=True)
+    q = Gr4j4Dpl(10)(p_and_e, parameters)
+    assert q.shape == (40, 5, 1)
+    q.sum().backward()
+    assert torch.isfinite(parameters.grad).all()
@@ -0,0 +1,28 @@
+"""Test funcs for HBV model in dPL"""
+
+import torch
+
+from torchhydro.models.dpl4hbv import DplLstmHbv, Hbv4Dpl
+
+
+def test_hbv4dpl_state_trace():
+    x = torch.rand(40, 3, 3) * 10
+    parameters = torch.rand(3, 14)
+    hbv = Hbv4Dpl(10)
+    q = hbv(x, parameters)
+    assert hbv.state_trace is None
+    hbv_log = Hbv4Dpl(10, log_state=True)
+    q_log = hbv_log(x, parameters)
+    torch.testing.assert_close(q_log, q)
+    assert set(hbv_log.state_trace) == {"sm", "ps", "swet", "re"}
+    for trace in hbv_log.state_trace.values():
+        assert trace.shape == (30, 3)
+        assert trace.device == x.device
+        assert not trace.requires_grad
+
+
+def test_dpllstmhbv_log_state():
+    model = DplLstmHbv(5, 14, 16, 10, log_state=True)
+    q = model(torch.rand(40, 3, 3) * 10, torch.rand(40, 3, 5))
+    assert q.shape == (30, 3, 1)
+    assert model.pb_model.state_trace["sm"].shape == (30, 3)
@@ -0,0 +1,49 @@
+"""Test funcs for Sacramento model in dPL"""
+
+import torch
+
+from torchhydro.models.dpl4sac import Sac4Dpl, muskingum_routing
+
+
+def test_muskingum_routing():
+    n_step, dt = 20, 12.0
+    inflow = torch.rand(n_step, 4, dtype=torch.float64) * 10
+    inflow0 = torch.rand(4, dtype=torch.float64)
+    ke = torch.rand(4, dtype=torch.float64, requires_grad=True) * 100
+    xe = torch.rand(4, dtype=torch.float64) - 0.5
+    mq = torch.rand(4, 3, dtype=torch.float64)
+    # basins have 0, 1, 2 and 3 river sections
+    rivernumber = torch.arange(4)
+    outflow, mq_end = muskingum_routing(inflow, inflow0, ke, xe, mq, rivernumber, dt)
+    for j in range(4):
+        ko = ke[j] * 24.0 / max(rivernumber[j].item(), 1)
+        c1 = ko * (1.0 - xe[j]) + dt
+        c2 = torch.clamp((-ko * xe[j] + dt) / c1, min=0.0)
+        c3 = torch.clamp((ko * (1.0 - xe[j]) - dt) / c1, min=0.0)
+        c1_ = (ko * xe[j] + dt) / c1
+        mq_j = list(mq[j, : rivernumber[j]])
+        i_start = inflow0[j]
+        for i in range(n_step):
+            i1, i2 = i_start, inflow[i, j]
+            i_start = inflow[i, j]
+            for k in range(rivernumber[j]):
+                o1 = mq_j[k]
+                mq_j[k] = c1_ * i1 + c2 * i2 + c3 * o1
+                i1, i2 = o1, mq_j[k]
+            torch.testing.assert_close(outflow[i, j], i2)
+        for k in range(rivernumber[j]):
+            torch.testing.assert_close(mq_end[j, k], mq_j[k])
+    grad = torch.autograd.grad(outflow.sum(), ke)[0]
+    assert grad[0] == 0
+    assert (grad[1:] != 0).all()
+
+
+def test_sac4dpl():
+    p_and_e = torch.rand(30, 3, 2) * 10
+    parameters = torch.rand(3, 21, requires_grad=True)
+    q, e = Sac4Dpl(10)(p_and_e, parameters)
+    assert q.shape == (20, 3, 1)
+    q.sum().backward()
+    # the gradient now flows through the river routing to KE and XE
+    assert torch.isfinite(parameters.grad).all()
+    assert (parameters.grad[:, 19:] != 0).all()
@@ -7,9 +7,25 @@ import torch
 from torchhydro import SETTING
 from torchhydro.configs.config import cmd, default_config_file, update_cfg
 from torchhydro.trainers.trainer import train_and_evaluate
-from torchhydro.models.dpl4xaj import DplLstmXaj
-from torchhydro.models.kernel_conv import uh_conv, uh_gamma
+from torchhydro.models.ann import SimpleAnn
+from torchhydro.models.dpl4sac import DplAnnSac
+from torchhydro.models.deferred_check import deferred_nan_check, raise_if
+from torchhydro.models.dpl4xaj import (
+    DplAnnXaj,
+    DplLstmXaj,
+    dedup_ann_forward,
+    linear_reservoir,
+    xaj_step,
+)
+from torchhydro.models.kernel_conv import (
+    linear_recursion,
+    linear_reservoir_routing,
+    uh_conv,
+    uh_gamma,
+)
 from torchhydro.models.dpl4xaj_nn4et import DplLstmNnModuleXaj
+from torchhydro.models.narx import narx_step
+from torchhydro.models.step_mode import get_step
 
 
 @pytest.fixture()
@@ -92,6 +108,34 @@ def test_dpl_lstm_xaj_eh5mm(device, dpl_eh5mm):
     assert isinstance(qe, torch.Tensor)
 
 
+def test_get_step():
+    assert get_step(xaj_step) is xaj_step
+    compiled = get_step(xaj_step, "compile")
+    # compiled steps are shared by all models
+    assert get_step(xaj_step, "compile") is compiled
+    assert get_step(narx_step, "compile") is not compiled
+    with pytest.raises(NotImplementedError):
+        get_step(xaj_step, "jit")
+
+
+def test_dpl_lstm_xaj_compile_step(device):
+    torch.manual_seed(1234)
+    x = torch.rand(20, 10, 5).to(device)
+    z = torch.rand(20, 10, 5).to(device)
+    dpl_eager = DplLstmXaj(5, 15, 64, kernel_size=15, warmup_length=5).to(device)
+    dpl_compile = DplLstmXaj(
+        5, 15, 64, kernel_size=15, warmup_length=5, step_mode="compile"
+    ).to(device)
+    dpl_compile.load_state_dict(dpl_eager.state_dict())
+    qe_eager = dpl_eager(x, z)
+    qe_eager.backward(torch.ones_like(qe_eager))
+    qe_compile = dpl_compile(x, z)
+    qe_compile.backward(torch.ones_like(qe_compile))
+    torch.testing.assert_close(qe_compile, qe_eager)
+    for p_compile, p_eager in zip(dpl_compile.parameters(), dpl_eager.parameters()):
+        torch.testing.assert_close(p_compile.grad, p_eager.grad)
+
+
 def test_uh_gamma():
     # batch = 10
     tempa = torch.Tensor(np.full(10, [2.5]))
@@ -150,6 +194,46 @@ def test_uh():
     )
 
 
+@pytest.mark.parametrize("n_step,len_uh", [(10, 5), (100, 15), (730, 240)])
+def test_uh_conv_fft(n_step, len_uh):
+    rf = torch.rand(n_step, 3, 1, dtype=torch.float64, requires_grad=True)
+    uh = torch.rand(len_uh, 3, 1, dtype=torch.float64, requires_grad=True)
+    qs_direct = uh_conv(rf, uh, backend="direct")
+    qs_fft = uh_conv(rf, uh, backend="fft")
+    torch.testing.assert_close(qs_fft, qs_direct)
+    grads_direct = torch.autograd.grad(qs_direct.sum(), [rf, uh])
+    grads_fft = torch.autograd.grad(qs_fft.sum(), [rf, uh])
+    for grad_fft, grad_direct in zip(grads_fft, grads_direct):
+        torch.testing.assert_close(grad_fft, grad_direct)
+    torch.testing.assert_close(uh_conv(rf, uh), qs_direct)
+
+
+@pytest.mark.parametrize("n_step", [1, 7, 64])
+def test_linear_reservoir_routing(n_step):
+    x = torch.rand(n_step, 4, dtype=torch.float64)
+    weight = torch.rand(4, dtype=torch.float64, requires_grad=True)
+    y0 = torch.rand(4, dtype=torch.float64)
+    y = y0
+    ys = []
+    for i in range(n_step):
+        y = linear_reservoir(x[i], weight, y)
+        ys.append(y)
+    ys = torch.stack(ys)
+    ys_routing = linear_reservoir_routing(x, weight, y0)
+    torch.testing.assert_close(ys_routing, ys)
+    grad = torch.autograd.grad(ys.sum(), weight)[0]
+    grad_routing = torch.autograd.grad(ys_routing.sum(), weight)[0]
+    torch.testing.assert_close(grad_routing, grad)
+    # time-varying coefficients
+    a = torch.rand(n_step, 4, dtype=torch.float64)
+    y = torch.zeros(4, dtype=torch.float64)
+    ys = []
+    for i in range(n_step):
+        y = a[i] * y + x[i]
+        ys.append(y)
+    torch.testing.assert_close(linear_recursion(a, x), torch.stack(ys))
+
+
 def test_dpl_lstm_xaj_nnmodule(device, dpl_nnmodule):
     # sequence-first tensor: time_sequence, batch, feature_size (assume that they are p, pet, srad, tmax, tmin)
     x = torch.rand(20, 10, 5).to(device)
@@ -297,3 +381,69 @@ def test_dpl_selfmadehydrodataset(dpl_selfmadehydrodataset_args):
     update_cfg(cfg, dpl_selfmadehydrodataset_args)
     train_and_evaluate(cfg)
     print("All processes are finished!")
+
+
+def test_dedup_ann_forward():
+    dl_model = SimpleAnn(4, 3, 8)
+    # windows of 2 basins repeated in a batch
+    z = torch.rand(2, 4).repeat(3, 1)
+    gen = dl_model(z)
+    gen_dedup = dedup_ann_forward(dl_model, z)
+    torch.testing.assert_close(gen_dedup, gen)
+    grads = torch.autograd.grad(gen.sum(), list(dl_model.parameters()))
+    grads_dedup = torch.autograd.grad(gen_dedup.sum(), list(dl_model.parameters()))
+    for grad_dedup, grad in zip(grads_dedup, grads):
+        torch.testing.assert_close(grad_dedup, grad)
+    z_ts = torch.rand(5, 2, 4)
+    torch.testing.assert_close(dedup_ann_forward(dl_model, z_ts), dl_model(z_ts))
+    # with dropout in training, windows of a basin don't share one dropout mask
+    dl_model = SimpleAnn(4, 3, 8, dr=0.5).train()
+    torch.manual_seed(0)
+    gen = dl_model(z)
+    torch.manual_seed(0)
+    torch.testing.assert_close(dedup_ann_forward(dl_model, z), gen)
+
+
+def test_dpl_ann_param_dedup():
+    x = torch.rand(30, 4, 2) * 10
+    z = torch.rand(2, 5).repeat(2, 1)
+    torch.manual_seed(0)
+    model = DplAnnXaj(5, 15, 8, 15, 10).eval()
+    torch.manual_seed(0)
+    model_dedup = DplAnnXaj(5, 15, 8, 15, 10, param_dedup=True).eval()
+    torch.testing.assert_close(model_dedup(x, z)[0], model(x, z)[0])
+    # only the final period of time-series inputs is used by ANN of SAC
+    z_ts = torch.rand(30, 4, 5)
+    sac = DplAnnSac(5, 21, 8, 10, param_dedup=True).eval()
+    q = sac(x, z_ts)
+    z_ts[:-1] = 0.0
+    torch.testing.assert_close(sac(x, z_ts), q)
+
+
+def test_deferred_nan_check():
+    x = torch.tensor([1.0, float("nan")])
+    with pytest.raises(ValueError):
+        raise_if(torch.isnan(x).any(), ValueError("nan"))
+    reached = False
+    with pytest.raises(ArithmeticError, match="first"):
+        with deferred_nan_check():
+            raise_if(torch.isnan(x[:1]).any(), ValueError("no nan"))
+            raise_if(torch.isnan(x).any(), ArithmeticError("first"))
+            raise_if(torch.isnan(x).any(), ValueError("second"))
+            reached = True
+    assert reached
+    with deferred_nan_check():
+        raise_if(torch.isnan(x[:1]).any(), ValueError("no nan"))
+
+
+def test_dpl_lstm_xaj_fast_mode():
+    x = torch.rand(30, 3, 2) * 10
+    z = torch.rand(30, 3, 5)
+    torch.manual_seed(0)
+    model = DplLstmXaj(5, 15, 8, kernel_size=15, warmup_length=10)
+    torch.manual_seed(0)
+    model_fast = DplLstmXaj(5, 15, 8, kernel_size=15, warmup_length=10, fast_mode=True)
+    torch.testing.assert_close(model_fast(x, z)[0], model(x, z)[0])
+    z[:, 0, 0] = float("nan")
+    with pytest.raises(ValueError):
+        model_fast(x, z)
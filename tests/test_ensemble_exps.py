@@ -4,7 +4,10 @@ from hydroutils import hydro_file
 
 from torchhydro import SETTING
 from torchhydro.configs.config import cmd, default_config_file, update_cfg
-from torchhydro.trainers.trainer import ensemble_train_and_evaluate
+from torchhydro.trainers.trainer import (
+    _nested_loop_ensemble_cfgs,
+    ensemble_train_and_evaluate,
+)
 
 
 @pytest.fixture()
@@ -170,3 +173,21 @@ def test_run_cross_val_tlcamelsus2cc(
     update_cfg(cfg, args)
     ensemble_train_and_evaluate(cfg)
     print("All processes are finished!")
+
+
+def test_nested_loop_ensemble_cfgs(tmpdir):
+    cfgs = default_config_file()
+    cfgs["data_cfgs"]["test_path"] = os.path.join(tmpdir, "test_camels", "exp1")
+    ensemble_items = {"batch_sizes": [20, 50], "seeds": [111, 222, 333]}
+    sub_cfgs = _nested_loop_ensemble_cfgs(
+        list(ensemble_items.keys()), 0, ensemble_items, cfgs
+    )
+    assert len(sub_cfgs) == 6
+    for i, sub_cfg in enumerate(sub_cfgs):
+        assert sub_cfg["data_cfgs"]["test_path"] == os.path.join(
+            tmpdir, "test_camels", f"exp1_{i}"
+        )
+        assert sub_cfg["training_cfgs"]["batch_size"] == [20, 50][i // 3]
+        assert sub_cfg["training_cfgs"]["random_seed"] == [111, 222, 333][i % 3]
+    # the original config is not changed
+    assert cfgs["data_cfgs"]["test_path"] == os.path.join(tmpdir, "test_camels", "exp1")
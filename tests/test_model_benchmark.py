@@ -0,0 +1,62 @@
+"""Test the micro-benchmark of models"""
+
+import json
+import os
+
+from benchmarks.model_benchmark import (
+    MODEL_BENCHMARK_CASES,
+    SyntheticDataSource,
+    run_model_benchmark,
+    run_rnn_benchmark,
+    save_model_benchmark,
+)
+from torchhydro.models.model_dict_function import pytorch_model_dict
+
+
+def test_benchmark_cases_cover_model_dict():
+    assert set(MODEL_BENCHMARK_CASES) == set(pytorch_model_dict)
+
+
+def test_synthetic_data_source():
+    source = SyntheticDataSource(n_basin=8, n_time=50, n_forcing=3, n_attr=4)
+    batch = source.sample(4, 20)
+    assert batch["x"].shape == (20, 4, 3)
+    assert batch["c"].shape == (4, 4)
+    assert batch["xc"].shape == (20, 4, 7)
+    assert batch["y"].shape == (20, 4, 1)
+    assert (batch["x"][:, :, :2] >= 0).all()
+    assert (batch["y"] >= 0).all()
+
+
+def test_run_model_benchmark(tmp_path):
+    benchmark = run_model_benchmark(
+        ["sLSTM", "DplLstmHbv", "NestedNarx"],
+        batch_size=4,
+        seq_len=40,
+        n_hidden=8,
+        warmup_length=10,
+        n_repeat=1,
+    )
+    json_file = os.path.join(tmp_path, "model_benchmark.json")
+    save_model_benchmark(benchmark, json_file)
+    with open(json_file, "r") as f:
+        saved = json.load(f)
+    assert saved["meta"]["batch_size"] == 4
+    for model_name in ["sLSTM", "DplLstmHbv", "NestedNarx"]:
+        result = saved["results"][model_name]
+        assert result["status"] == "ok", result.get("error")
+        assert result["forward_ms"] > 0
+        assert result["backward_ms"] > 0
+        assert result["n_parameters"] > 0
+
+
+def test_run_rnn_benchmark():
+    benchmark = run_rnn_benchmark(
+        batch_size=4, seq_len=20, n_hidden=8, n_repeat=1
+    )
+    assert set(benchmark["results"]) == {"pcLSTM", "sLSTM", "stackedGRU", "sGRU"}
+    for model_name, baseline in [("pcLSTM", "sLSTM"), ("stackedGRU", "sGRU")]:
+        comparison = benchmark["comparison"][model_name]
+        assert comparison["baseline"] == baseline
+        assert comparison["forward_ratio"] > 0
+        assert comparison["backward_ratio"] > 0
@@ -0,0 +1,47 @@
+"""Test funcs for Narx model"""
+
+import torch
+
+from torchhydro.models.narx import Narx
+
+
+def test_narx_layers_registered():
+    model = Narx(4, 1, 8, 2, 3, num_layers=3)
+    assert len(model.narx) == 3
+    assert model.narx[0] is not model.narx[1]
+    assert any(name.startswith("narx.2.") for name in model.state_dict())
+
+
+def test_narx_open_loop_same_as_close_loop_steps():
+    """open loop in one batch is the same as stepping through time without feedback"""
+    torch.manual_seed(0)
+    model = Narx(4, 1, 8, 2, 3, num_layers=2)
+    x = torch.rand(30, 5, 4)
+    out = model(x)
+    assert out.shape == (30, 5, 1)
+    torch.testing.assert_close(out[:3], x[:3, :, -1:])
+    x0 = model.delay_features(x[:, :, :3], 2)
+    expected = torch.stack(
+        [
+            model.forward_close_loop(x0[i : i + 1], x[i : i + 4, :, -1:])[0]
+            for i in range(x0.shape[0])
+        ]
+    )
+    torch.testing.assert_close(out[3:], expected)
+
+
+def test_narx_close_loop():
+    torch.manual_seed(0)
+    model = Narx(4, 1, 8, 2, 2, num_layers=2, close_loop=True)
+    x = torch.rand(20, 5, 4)
+    x_origin = x.clone()
+    out = model(x)
+    # the input is not changed, and the outputs are fed back
+    torch.testing.assert_close(x, x_origin)
+    x_feedback = x.clone()
+    x_feedback[3:, :, -1:] = out[2:-1].detach()
+    model.close_loop = False
+    torch.testing.assert_close(model(x_feedback)[2:], out[2:])
+    model.close_loop = True
+    model.step_mode = "compile"
+    torch.testing.assert_close(model(x), out)
@@ -0,0 +1,48 @@
+"""Test the lazy registries"""
+
+import subprocess
+import sys
+
+import pytest
+
+from torchhydro.registry import LazyDict, LazyImport
+
+
+def test_lazy_dict():
+    lazy_dict = LazyDict({"od": "collections:OrderedDict"})
+    # not imported until it is used
+    assert isinstance(dict.__getitem__(lazy_dict, "od"), LazyImport)
+    import collections
+
+    assert lazy_dict["od"] is collections.OrderedDict
+    assert dict.__getitem__(lazy_dict, "od") is collections.OrderedDict
+    # classes could be registered directly
+    lazy_dict.update({"my_dict": dict})
+    lazy_dict["my_list"] = "builtins:list"
+    assert lazy_dict["my_dict"] is dict
+    assert lazy_dict.get("my_list") is list
+    assert lazy_dict.get("nothing") is None
+    assert list(lazy_dict.keys()) == ["od", "my_dict", "my_list"]
+    with pytest.raises(KeyError):
+        lazy_dict["nothing"]
+
+
+def test_model_dict():
+    from torchhydro.models.model_dict_function import pytorch_model_dict
+    from torchhydro.models.slstm import sLSTM
+
+    assert pytorch_model_dict["sLSTM"] is sLSTM
+
+
+def test_import_torchhydro_is_lazy():
+    code = (
+        "import sys, torchhydro;"
+        "assert 'torchhydro.models' not in sys.modules;"
+        "assert 'torchhydro.datasets.data_sets' not in sys.modules;"
+        "assert torchhydro.models.__name__ == 'torchhydro.models';"
+        "from torchhydro.models.model_dict_function import pytorch_model_dict;"
+        "assert 'torchhydro.models.seq2seq' not in sys.modules;"
+        "pytorch_model_dict['Seq2Seq'];"
+        "assert 'torchhydro.models.seq2seq' in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
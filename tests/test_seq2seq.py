@@ -10,7 +10,7 @@ Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 
 import pytest
 import torch
-from torchhydro.models.seq2seq import GeneralSeq2Seq
+from torchhydro.models.seq2seq import GeneralSeq2Seq, Transformer
 
 import logging
 from torchhydro.trainers.trainer import train_and_evaluate
@@ -59,3 +59,46 @@ def test_forward_with_teacher_forcing(model):
     trgs = torch.randn(3, 15, 2)
     outputs = model(src1, src2, trgs)
     assert outputs.shape == (3, 6, 2)
+
+
+@pytest.fixture
+def transformer():
+    torch.manual_seed(0)
+    return Transformer(
+        n_encoder_inputs=3,
+        n_decoder_inputs=1,
+        n_decoder_output=1,
+        channels=16,
+        nhead=2,
+        num_layers=2,
+        dropout=0.0,
+    )
+
+
+def test_transformer_incremental_same_as_parallel(transformer):
+    transformer.eval()
+    src = torch.randn(12, 4, 3)
+    trg = torch.randn(6, 4, 1)
+    parallel = transformer(src, trg)
+    transformer.decode_mode = "incremental"
+    incremental = transformer(src, trg)
+    assert incremental.shape == (6, 4, 1)
+    assert torch.allclose(incremental, parallel, atol=1e-5)
+
+
+def test_transformer_decode_step(transformer):
+    transformer.eval()
+    src = torch.randn(12, 4, 3)
+    trg = torch.randn(6, 4, 1)
+    with torch.no_grad():
+        parallel = transformer(src, trg)
+        cache = transformer.init_decoding(src)
+        outputs = [transformer.decode_step(trg[t : t + 1], cache) for t in range(6)]
+    assert cache.step == 6
+    assert cache.self_kv[0][0].shape == (4, 2, 6, 8)
+    assert torch.allclose(torch.cat(outputs), parallel, atol=1e-5)
+
+
+def test_transformer_unknown_decode_mode():
+    with pytest.raises(ValueError):
+        Transformer(3, 1, 1, channels=16, nhead=2, num_layers=1, decode_mode="beam")
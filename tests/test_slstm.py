@@ -0,0 +1,55 @@
+"""Test funcs for stacked recurrent models with python cells"""
+
+import pytest
+import torch
+
+from torchhydro.models.slstm import pcLSTM, stackedGRU
+
+
+def _run_cells(model, x):
+    """the sequence calculated by cells step by step"""
+    x = torch.where(torch.isnan(x), torch.full_like(x, 0), x)
+    cells = model.lstm if isinstance(model, pcLSTM) else model.gru
+    out = []
+    ht, ct = None, None
+    for t in range(x.shape[0]):
+        xt = torch.relu(model.linearIn(x[t]))
+        for cell in cells:
+            if isinstance(model, pcLSTM):
+                ht, ct = cell(x=xt, hx=(ht, ct))
+            else:
+                ht = cell(x=xt, hx=ht)
+            xt = ht
+        out.append(model.linearOut(ht))
+    return torch.stack(out)
+
+
+@pytest.mark.parametrize("model_class", [pcLSTM, stackedGRU])
+def test_fused_cells_same_as_cells(model_class):
+    torch.manual_seed(0)
+    model = model_class(5, 2, 8, num_layers=3)
+    cells = model.lstm if model_class is pcLSTM else model.gru
+    # layers have their own weights, which are in the state dict
+    assert len(cells) == 3 and cells[0] is not cells[1]
+    assert any(name.startswith(f"{'lstm' if model_class is pcLSTM else 'gru'}.2.") for name in model.state_dict())
+    x = torch.randn(20, 4, 5)
+    x[3, 1, 2] = float("nan")
+    out = model(x)
+    assert out.shape == (20, 4, 2)
+    torch.testing.assert_close(out, _run_cells(model, x))
+
+
+@pytest.mark.parametrize("model_class", [pcLSTM, stackedGRU])
+def test_fused_cells_compile(model_class):
+    torch.manual_seed(0)
+    model_eager = model_class(5, 2, 8, num_layers=2)
+    model_compile = model_class(5, 2, 8, num_layers=2, step_mode="compile")
+    model_compile.load_state_dict(model_eager.state_dict())
+    x = torch.randn(20, 4, 5)
+    out_eager = model_eager(x)
+    out_compile = model_compile(x)
+    out_eager.sum().backward()
+    out_compile.sum().backward()
+    torch.testing.assert_close(out_compile, out_eager)
+    for p_compile, p_eager in zip(model_compile.parameters(), model_eager.parameters()):
+        torch.testing.assert_close(p_compile.grad, p_eager.grad)
@@ -0,0 +1,72 @@
+"""Test funcs for time loops with gradient checkpointing"""
+import torch
+
+from torchhydro.models.deferred_check import deferred_nan_check, raise_if
+from torchhydro.models.dpl4hbv import DplLstmHbv
+from torchhydro.models.time_checkpoint import run_time_loop
+
+
+def test_run_time_loop():
+    x = torch.rand(10, 3)
+    weight = torch.rand(3, requires_grad=True)
+
+    def step(i, states):
+        y = weight * states[0] + x[i]
+        return (y, 2 * y), (y,)
+
+    (ys, ys2), (y,) = run_time_loop(step, 10, (torch.zeros(3),))
+    (ys_ckpt, ys2_ckpt), (y_ckpt,) = run_time_loop(step, 10, (torch.zeros(3),), 4)
+    assert ys.shape == (10, 3)
+    torch.testing.assert_close(ys_ckpt, ys)
+    torch.testing.assert_close(ys2_ckpt, ys2)
+    torch.testing.assert_close(y_ckpt, ys[-1])
+    torch.testing.assert_close(
+        torch.autograd.grad(ys_ckpt.sum(), weight)[0],
+        torch.autograd.grad(ys.sum(), weight)[0],
+    )
+
+
+def test_pbm_time_chunk(pbm_case):
+    model_class, n_feature, n_param = pbm_case
+    x = torch.rand(40, 3, n_feature) * 10
+    parameters = torch.rand(3, n_param, requires_grad=True)
+    results = []
+    for model in [model_class(), model_class(time_chunk=7)]:
+        q = model(x, parameters)
+        q = q[0] if isinstance(q, tuple) else q
+        results.append((q, torch.autograd.grad(q.sum(), parameters)[0]))
+    (q, grad), (q_ckpt, grad_ckpt) = results
+    torch.testing.assert_close(q_ckpt, q)
+    torch.testing.assert_close(grad_ckpt, grad)
+
+
+def test_dpl_time_chunk():
+    model = DplLstmHbv(5, 14, 16, 10, time_chunk=8)
+    q = model(torch.rand(40, 3, 3) * 10, torch.rand(40, 3, 5))
+    q.sum().backward()
+    assert model.pb_model.time_chunk == 8
+    assert all(p.grad is not None for p in model.dl_model.parameters())
+
+
+def test_time_chunk_deferred_checks(monkeypatch):
+    x = torch.rand(10, 3)
+    weight = torch.rand(3, requires_grad=True)
+
+    def step(i, states):
+        y = weight * states[0] + x[i]
+        raise_if(torch.isnan(y).any(), ValueError("nan"))
+        return (y,), (y,)
+
+    # reading a check on the host calls Tensor.__bool__
+    n_read = []
+    tensor_bool = torch.Tensor.__bool__
+    monkeypatch.setattr(
+        torch.Tensor, "__bool__", lambda t: n_read.append(t) or tensor_bool(t)
+    )
+    with deferred_nan_check():
+        (ys,), _ = run_time_loop(step, 10, (torch.zeros(3),), 4)
+    # chunks calculated again in the backward pass don't read their checks
+    ys.sum().backward()
+    assert not n_read
+    (ys,), _ = run_time_loop(step, 10, (torch.zeros(3),), 4)
+    assert len(n_read) == 10
@@ -1,6 +1,10 @@
 import os
 import pytest
-from torchhydro.trainers.train_utils import read_pth_from_model_loader
+import torch
+from torchhydro.trainers.train_utils import (
+    read_pth_from_model_loader,
+    torch_single_train,
+)
 
 
 def test_read_pth_from_model_loader_specified():
@@ -41,3 +45,51 @@ def test_read_pth_from_model_loader_invalid():
     model_pth_dir = "/path/to/models"
     with pytest.raises(ValueError, match="Invalid load_way"):
         read_pth_from_model_loader(model_loader, model_pth_dir)
+
+
+@pytest.mark.parametrize(
+    "make_opt",
+    [
+        lambda params: torch.optim.SGD(params, lr=0.1),
+        lambda params: torch.optim.Adam(params, lr=0.1, weight_decay=0.01),
+        lambda params: torch.optim.SGD(params, lr=0.1, momentum=0.9),
+        # fused optimizers skip the step by found_inf
+        lambda params: torch.optim.Adam(params, lr=0.1, weight_decay=0.01, fused=True),
+    ],
+)
+@pytest.mark.parametrize("loss_check_steps", [2, 0])
+def test_torch_single_train_deferred_loss_check(loss_check_steps, make_opt):
+    torch.manual_seed(0)
+    data = [(torch.rand(4, 10, 3), torch.rand(4, 10, 1)) for _ in range(5)]
+    # a batch with nan loss is skipped
+    data[2][1][0, 0, 0] = float("nan")
+    losses = []
+    params = []
+    for check_steps in [1, loss_check_steps]:
+        torch.manual_seed(1)
+        model = torch.nn.Linear(3, 1)
+        opt = make_opt(model.parameters())
+        losses.append(
+            torch_single_train(
+                model,
+                opt,
+                torch.nn.MSELoss(),
+                data,
+                which_first_tensor="batch",
+                loss_check_steps=check_steps,
+            )
+        )
+        params.append(torch.cat([p.detach().flatten() for p in model.parameters()]))
+    assert losses[0][1] == losses[1][1] == 4
+    assert losses[0][0] == pytest.approx(losses[1][0])
+    torch.testing.assert_close(params[0], params[1])
+    data[3][1][0, 0, 0] = float("inf")
+    with pytest.raises(ValueError):
+        torch_single_train(
+            model,
+            opt,
+            torch.nn.MSELoss(),
+            data,
+            which_first_tensor="batch",
+            loss_check_steps=loss_check_steps,
+        )
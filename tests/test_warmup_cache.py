@@ -0,0 +1,118 @@
+"""Test funcs for the cache of warmup states in dPL models"""
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset, RandomSampler
+
+from torchhydro.datasets.sampler import RecordedBatchSampler
+from torchhydro.models.dpl4gr4j import Gr4j4Dpl
+from torchhydro.models.dpl4xaj import DplLstmXaj
+from torchhydro.models.warmup_cache import WarmupStateCache, make_warmup_cache
+from torchhydro.trainers.deep_hydro import _get_warmup_cache
+from torchhydro.trainers.train_utils import keyed_batches
+
+
+def _run(model, x, parameters):
+    q = model(x, parameters)
+    return q[0] if isinstance(q, tuple) else q
+
+
+def test_warmup_cache(pbm_case):
+    model_class, n_feature, n_param = pbm_case
+    model = model_class()
+    x = torch.rand(30, 3, n_feature) * 10
+    parameters = torch.rand(3, n_param)
+    q = _run(model, x, parameters)
+    cache = WarmupStateCache()
+    model.warmup_cache = cache
+    # without keys, the cache is not used
+    torch.testing.assert_close(_run(model, x, parameters), q)
+    assert len(cache) == 0
+    cache.set_keys([("basin1", 0), ("basin2", 0), ("basin3", 0)])
+    torch.testing.assert_close(_run(model, x, parameters), q)
+    assert len(cache) == 3
+    # the warmup period is not simulated again when all basins are cached
+    x_new_warmup = x.clone()
+    x_new_warmup[:10] = 0.0
+    torch.testing.assert_close(_run(model, x_new_warmup, parameters), q)
+    # but it is when parameters change
+    parameters_new = torch.rand(3, n_param)
+    torch.testing.assert_close(
+        _run(model, x_new_warmup, parameters_new),
+        _run(model_class(), x_new_warmup, parameters_new),
+    )
+
+
+def test_warmup_cache_not_strict():
+    x = torch.rand(30, 2, 2) * 10
+    parameters = torch.rand(2, 4)
+    model = Gr4j4Dpl(10)
+    model.warmup_cache = WarmupStateCache(strict=False)
+    model.warmup_cache.set_keys([(0, 100), (1, 100)])
+    model(x, parameters)
+    s0, r0 = model.warmup_cache.get(torch.rand(2, 4))
+    assert s0.shape == r0.shape == (2,)
+    model.warmup_cache.clear()
+    assert model.warmup_cache.get(parameters) is None
+    model.warmup_cache.set_keys([0])
+    with pytest.raises(ValueError):
+        model(x, parameters)
+
+
+def test_warmup_cache_max_size():
+    model = Gr4j4Dpl(10)
+    model.warmup_cache = WarmupStateCache(max_size=3)
+    x = torch.rand(30, 2, 2) * 10
+    parameters = torch.rand(2, 4)
+    for keys in [[0, 1], [2, 3]]:
+        model.warmup_cache.set_keys(keys)
+        model(x, parameters)
+    # the least recently used keys are dropped first
+    assert len(model.warmup_cache) == 3
+    model.warmup_cache.set_keys([0, 1])
+    assert model.warmup_cache.get(parameters) is None
+    model.warmup_cache.set_keys([2, 3])
+    assert model.warmup_cache.get(parameters) is not None
+
+
+def test_make_warmup_cache():
+    assert make_warmup_cache(None) is None
+    assert make_warmup_cache(False) is None
+    assert isinstance(make_warmup_cache(True), WarmupStateCache)
+    cache = make_warmup_cache({"strict": False, "max_size": 10})
+    assert not cache.strict and cache.max_size == 10
+    assert make_warmup_cache(cache) is cache
+    with pytest.raises(TypeError):
+        make_warmup_cache("yes")
+    model = DplLstmXaj(5, 15, 8, 10, 10, warmup_cache=True)
+    assert isinstance(model.pb_model.warmup_cache, WarmupStateCache)
+    assert _get_warmup_cache(model) is model.pb_model.warmup_cache
+    assert _get_warmup_cache(DplLstmXaj(5, 15, 8, 10, 10)) is None
+
+
+class _KeyedDataset(Dataset):
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, item):
+        return torch.tensor(item), torch.tensor(item)
+
+    def sample_keys(self, items):
+        return [(item, 0) for item in items]
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_keyed_batches(num_workers):
+    dataset = _KeyedDataset()
+    # batches are shuffled, and fetched ahead by workers
+    batch_sampler = RecordedBatchSampler(RandomSampler(dataset), batch_size=3)
+    loader = DataLoader(dataset, batch_sampler=batch_sampler, num_workers=num_workers)
+    cache = WarmupStateCache()
+    for _ in range(2):
+        n = 0
+        for xs, _ in keyed_batches(loader, cache):
+            assert cache.keys == [(item, 0) for item in xs.tolist()]
+            n += len(xs)
+        assert n == len(dataset)
+        assert cache.keys is None and not batch_sampler.batches
+    assert len(list(keyed_batches(loader))) == 4
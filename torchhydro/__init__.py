@@ -14,14 +14,14 @@ __author__ = """Wenyu Ouyang"""
 __email__ = "wenyuouyang@outlook.com"
 __version__ = '0.0.9'
 
+import importlib
 from pathlib import Path
 import yaml
 import os
 
-from hydroutils import hydro_file
-
-CACHE_DIR = Path(hydro_file.get_cache_dir())
 SETTING_FILE = os.path.join(Path.home(), "hydro_setting.yml")
+# subpackages are imported on first access, so that "import torchhydro" is fast
+_LAZY_SUBPACKAGES = ("configs", "datasets", "models", "trainers", "explainers")
 
 
 def read_setting(setting_path):
@@ -79,16 +79,36 @@ def read_setting(setting_path):
     return setting
 
 
-try:
-    SETTING = read_setting(SETTING_FILE)
-except ValueError as e:
-    print(e)
-except Exception as e:
-    print(f"Unexpected error: {e}")
-
-
-from .configs import *
-from .datasets import *
-from .models import *
-from .trainers import *
-from .explainers import *
+def _read_setting_or_none():
+    try:
+        return read_setting(SETTING_FILE)
+    except ValueError as e:
+        print(e)
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+    return None
+
+
+def __getattr__(name):
+    """lazily get CACHE_DIR, SETTING and subpackages, see PEP 562"""
+    if name == "CACHE_DIR":
+        # hydroutils imports many heavy libraries, so it is imported only when needed
+        from hydroutils import hydro_file
+
+        value = Path(hydro_file.get_cache_dir())
+    elif name == "SETTING":
+        value = _read_setting_or_none()
+        if value is None:
+            raise AttributeError(f"SETTING is not available, check {SETTING_FILE}")
+    elif name in _LAZY_SUBPACKAGES:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(
+        set(globals()) | {"CACHE_DIR", "SETTING"} | set(_LAZY_SUBPACKAGES)
+    )
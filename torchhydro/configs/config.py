@@ -215,7 +215,10 @@ def default_config_file():
             "sampler": None,
             "b_nestedness": False,
             "b_decompose": False,  # whether to decompose the series or not using STL
-            "decomposed_item": ["trend", "season", "residuals"]  # the decomposed item using STL
+            "decomposed_item": ["trend", "season", "residuals"],  # the decomposed item using STL
+            # whether to save normalized data of datasets in CACHE_DIR and reuse them in next runs;
+            # the cache is keyed by data_cfgs, so delete it when source data is updated
+            "b_cache_dataset": False,
         },
         "training_cfgs": {
             "master_addr": "localhost",
@@ -260,6 +263,12 @@ def default_config_file():
             "multi_targets": 1,
             "num_workers": 0,
             "which_first_tensor": "sequence",
+            # how often nan/inf/high loss are checked in training, 1 means every batch;
+            # n > 1 means flags are accumulated on device and checked every n batches, 0 means only at epoch end
+            "loss_check_steps": 1,
+            # whether the warmup cache of a dPL model (see warmup_cache in model_hyperparam) is used in training;
+            # as parameters change in each step, it should be a WarmupStateCache(strict=False), which is cleared each epoch
+            "warmup_cache_in_training": False,
             # for ensemble exp:
             # basically we set kfold/seeds/hyper_params for trianing such as batch_sizes
             "ensemble": False,
@@ -276,6 +285,10 @@ def default_config_file():
                 "early_stopping": None,
                 "kfold_continuous": True,
             },
+            # the number of processes running sub-exps of ensemble concurrently, 1 means one by one
+            "ensemble_workers": 1,
+            # the number of torch threads in each process; None means cpu cores are divided equally
+            "ensemble_threads": None,
         },
         # For evaluation
         "evaluation_cfgs": {
@@ -366,8 +379,11 @@ def cmd(
     stat_dict_file=None,
     num_workers=None,
     which_first_tensor=None,
+    loss_check_steps=None,
     ensemble=0,
     ensemble_items=None,
+    ensemble_workers=None,
+    ensemble_threads=None,
     early_stopping=None,
     patience=None,
     min_time_unit=None,
@@ -375,6 +391,7 @@ def cmd(
     b_nestedness=None,
     close_loop=None,
     b_decompose=None,
+    b_cache_dataset=None,
 ):
     """input args from cmd"""
     parser = argparse.ArgumentParser(
@@ -791,6 +808,13 @@ def cmd(
         default=which_first_tensor,
         type=str,
     )
+    parser.add_argument(
+        "--loss_check_steps",
+        dest="loss_check_steps",
+        help="how often nan/inf/high loss are checked in training; 0 means only at the end of an epoch",
+        default=loss_check_steps,
+        type=int,
+    )
     parser.add_argument(
         "--lr_scheduler",
         dest="lr_scheduler",
@@ -812,6 +836,20 @@ def cmd(
         default=ensemble_items,
         type=json.loads,
     )
+    parser.add_argument(
+        "--ensemble_workers",
+        dest="ensemble_workers",
+        help="the number of processes running sub-exps of ensemble concurrently",
+        default=ensemble_workers,
+        type=int,
+    )
+    parser.add_argument(
+        "--ensemble_threads",
+        dest="ensemble_threads",
+        help="the number of torch threads in each process of ensemble",
+        default=ensemble_threads,
+        type=int,
+    )
     parser.add_argument(
         "--early_stopping",
         dest="early_stopping",
@@ -861,6 +899,13 @@ def cmd(
         default=b_decompose,
         type=bool,
     )
+    parser.add_argument(
+        "--b_cache_dataset",
+        dest="b_cache_dataset",
+        help="whether to cache normalized data of datasets on disk",
+        default=b_cache_dataset,
+        type=bool,
+    )
     # To make pytest work in PyCharm, here we use the following code instead of "args = parser.parse_args()":
     # https://blog.csdn.net/u014742995/article/details/100119905
     args, unknown = parser.parse_known_args()
@@ -1096,12 +1141,18 @@ def update_cfg(cfg_file, new_args):
         cfg_file["training_cfgs"]["num_workers"] = new_args.num_workers
     if new_args.which_first_tensor is not None:
         cfg_file["training_cfgs"]["which_first_tensor"] = new_args.which_first_tensor
+    if new_args.loss_check_steps is not None:
+        cfg_file["training_cfgs"]["loss_check_steps"] = new_args.loss_check_steps
     if new_args.ensemble == 0:
         cfg_file["training_cfgs"]["ensemble"] = False
     else:
         cfg_file["training_cfgs"]["ensemble"] = True
     if new_args.ensemble_items is not None:
         cfg_file["training_cfgs"]["ensemble_items"] = new_args.ensemble_items
+    if new_args.ensemble_workers is not None:
+        cfg_file["training_cfgs"]["ensemble_workers"] = new_args.ensemble_workers
+    if new_args.ensemble_threads is not None:
+        cfg_file["training_cfgs"]["ensemble_threads"] = new_args.ensemble_threads
     if new_args.patience is not None:
         cfg_file["training_cfgs"]["patience"] = new_args.patience
     if new_args.early_stopping is not None:
@@ -1114,6 +1165,8 @@ def update_cfg(cfg_file, new_args):
         cfg_file["evaluation_cfgs"]["close_loop"] = new_args.close_loop
     if new_args.b_decompose is not None:
         cfg_file["data_cfgs"]["b_decompose"] = new_args.b_decompose
+    if new_args.b_cache_dataset is not None:
+        cfg_file["data_cfgs"]["b_cache_dataset"] = new_args.b_cache_dataset
     # print("the updated config:\n", json.dumps(cfg_file, indent=4, ensure_ascii=False))
 
 
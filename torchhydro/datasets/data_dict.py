@@ -8,23 +8,18 @@ FilePath: /torchhydro/torchhydro/datasets/data_dict.py
 Copyright (c) 2021-2022 Wenyu Ouyang. All rights reserved.
 """
 
-from torchhydro.datasets.data_sets import (
-    BaseDataset,
-    BasinSingleFlowDataset,
-    DplDataset,
-    FlexibleDataset,
-    Seq2SeqDataset,
-    TransformerDataset,
-)
-from torchhydro.datasets.narxdataset import NarxDataset, StlDataset
+from torchhydro.registry import LazyDict
 
-datasets_dict = {
-    "StreamflowDataset": BaseDataset,
-    "SingleflowDataset": BasinSingleFlowDataset,
-    "DplDataset": DplDataset,
-    "FlexDataset": FlexibleDataset,
-    "Seq2SeqDataset": Seq2SeqDataset,
-    "TransformerDataset": TransformerDataset,
-    "NarxDataset": NarxDataset,
-    "StlDataset": StlDataset,
-}
+# datasets are imported only when they are used
+datasets_dict = LazyDict(
+    {
+        "StreamflowDataset": "torchhydro.datasets.data_sets:BaseDataset",
+        "SingleflowDataset": "torchhydro.datasets.data_sets:BasinSingleFlowDataset",
+        "DplDataset": "torchhydro.datasets.data_sets:DplDataset",
+        "FlexDataset": "torchhydro.datasets.data_sets:FlexibleDataset",
+        "Seq2SeqDataset": "torchhydro.datasets.data_sets:Seq2SeqDataset",
+        "TransformerDataset": "torchhydro.datasets.data_sets:TransformerDataset",
+        "NarxDataset": "torchhydro.datasets.narxdataset:NarxDataset",
+        "StlDataset": "torchhydro.datasets.narxdataset:StlDataset",
+    }
+)
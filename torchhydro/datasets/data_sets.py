@@ -10,26 +10,25 @@ Copyright (c) 2024-2024 Wenyu Ouyang. All rights reserved.
 
 import logging
 import re
-import sys
 import torch
 import xarray as xr
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from typing import Optional
-from torch.utils.data import Dataset
-from tqdm import tqdm
+from torch.utils.data import Dataset, default_collate
 from hydrodatasource.utils.utils import streamflow_unit_conv
 
 from torchhydro.configs.config import DATE_FORMATS
 from torchhydro.datasets.data_scalers import ScalerHub
-from torchhydro.datasets.data_sources import data_sources_dict
+from torchhydro.datasets.data_sources import get_data_source
+from torchhydro.datasets.data_store import DatasetStore, data_cfgs_hash
 
 from torchhydro.datasets.data_utils import (
+    create_lookup_table,
     warn_if_nan,
     wrap_t_s_dict,
 )
-from hydrodatasource.reader.data_source import SelfMadeHydroDataset
 
 LOGGER = logging.getLogger(__name__)
 
@@ -87,9 +86,37 @@ def detect_date_format(date_str):
     raise ValueError(f"Unknown date format: {date_str}")
 
 
+class SampleBatch(list):
+    """
+    Samples of a batch gathered at once: a list of (xc, y) samples which are views of batch tensors
+
+    As a list of samples, it works with the default collate_fn of DataLoader; batch_collate returns
+    the batch tensors directly rather than stacking the samples again.
+    """
+
+    def __init__(self, *tensors):
+        super().__init__(zip(*tensors))
+        self.batch = list(tensors)
+
+
+def batch_collate(batch):
+    """collate_fn of DataLoader which returns the tensors of a SampleBatch without stacking again"""
+    if isinstance(batch, SampleBatch):
+        return batch.batch
+    return default_collate(batch)
+
+
+def get_collate_fn(dataset):
+    """collate_fn of DataLoader for a dataset; None means the default one"""
+    return batch_collate if getattr(dataset, "fetches_batch", False) else None
+
+
 class BaseDataset(Dataset):
     """Base data set class to load and preprocess data (batch-first) using PyTorch's Dataset"""
 
+    # arrays saved in DatasetStore when data_cfgs["b_cache_dataset"] is True
+    store_keys = ("x", "y", "c", "x_origin", "y_origin", "c_origin")
+
     def __init__(
             self,
             data_cfgs: dict,
@@ -120,7 +147,7 @@ class BaseDataset(Dataset):
         source_name = self.data_cfgs["source_cfgs"]["source_name"]
         source_path = self.data_cfgs["source_cfgs"]["source_path"]
         other_settings = self.data_cfgs["source_cfgs"].get("other_settings", {})
-        return data_sources_dict[source_name](source_path, **other_settings)
+        return get_data_source(source_name, source_path, **other_settings)
 
     @property
     def streamflow_name(self):
@@ -221,6 +248,33 @@ class BaseDataset(Dataset):
             times_ = pd.date_range(start=s_date, end=e_date, freq=time_step)
         return times_
 
+    def sample_keys(self, items) -> list:
+        """
+        (basin id, start time) of the windows of samples, e.g. as keys of WarmupStateCache
+
+        Parameters
+        ----------
+        items
+            indices of samples
+
+        Returns
+        -------
+        list
+            a key for each sample
+        """
+        items = np.asarray(items)
+        if self.train_mode:
+            basins, idxs = self.lookup_table[items].T
+        else:
+            basins, idxs = items, np.zeros_like(items)
+        times = self.times
+        if not isinstance(times, list):
+            times = [times]
+        return [
+            (self.basins[basin], times[basin if len(times) > 1 else 0][idx])
+            for basin, idx in zip(basins, idxs)
+        ]
+
     def __len__(self):
         return self.num_samples if self.train_mode else self.ngrid
 
@@ -248,6 +302,53 @@ class BaseDataset(Dataset):
         xc = np.concatenate((x, c), axis=1)
         return torch.from_numpy(xc).float(), torch.from_numpy(y).float()
 
+    @property
+    def fetches_batch(self):
+        """whether __getitems__ gathers a whole batch at once, see SampleBatch"""
+        return type(self).__getitem__ is BaseDataset.__getitem__
+
+    def __getitems__(self, items: list):
+        """
+        Get all samples of a batch at once; DataLoader calls it instead of __getitem__ (torch>=2.1)
+
+        All windows are gathered by one fancy indexing and c is broadcast once for the batch.
+        The samples work with any collate_fn; with get_collate_fn(dataset), the batch tensors are
+        used directly rather than being stacked again.
+
+        Parameters
+        ----------
+        items
+            indices of samples in a batch
+
+        Returns
+        -------
+        list
+            samples same as __getitem__'s results, as a SampleBatch; for subclasses with their own
+            __getitem__, a list of samples as usual
+        """
+        if not self.fetches_batch:
+            # subclasses organize their samples differently
+            return [self[item] for item in items]
+        items = np.asarray(items)
+        if not self.train_mode:
+            x = self.x[items]
+            y = self.y[items]
+        else:
+            basins, idxs = self.lookup_table[items].T
+            basins = basins[:, None]
+            x_times = idxs[:, None] + np.arange(
+                -self.warmup_length, self.rho + self.horizon
+            )
+            y_times = idxs[:, None] + np.arange(self.rho + self.horizon)
+            x = self.x[basins, x_times]
+            y = self.y[basins, y_times]
+            items = basins[:, 0]
+        if self.c is not None and self.c.shape[-1] > 0:
+            c = self.c[items]
+            c = np.broadcast_to(c[:, None, :], (c.shape[0], x.shape[1], c.shape[1]))
+            x = np.concatenate((x, c), axis=-1)
+        return SampleBatch(torch.from_numpy(x).float(), torch.from_numpy(y).float())
+
     def _pre_load_data(self):
         self.train_mode = self.is_tra_val_te == "train"
         self.t_s_dict = wrap_t_s_dict(self.data_cfgs, self.is_tra_val_te)
@@ -257,12 +358,67 @@ class BaseDataset(Dataset):
 
     def _load_data(self):
         self._pre_load_data()
+        store = self._get_store()
+        if store is not None and store.exists():
+            self._load_from_store(store)
+            return
         self._read_xyc()
         # normalization
         norm_x, norm_y, norm_c = self._normalize()
         self.x, self.y, self.c = self._kill_nan(norm_x, norm_y, norm_c)
         self._trans2nparr()
         self._create_lookup_table()
+        if store is not None:
+            self._save_to_store(store)
+
+    def _get_store(self):
+        """The on-disk store of this dataset; None if caching is not chosen"""
+        if not self.data_cfgs.get("b_cache_dataset", False):
+            return None
+        key = data_cfgs_hash(
+            self.data_cfgs, self.is_tra_val_te, self.__class__.__name__
+        )
+        return DatasetStore(key)
+
+    def _save_to_store(self, store):
+        store.save(
+            {key: getattr(self, key, None) for key in self.store_keys},
+            self.lookup_table,
+            self.target_scaler,
+            stat_dir=self.data_cfgs["test_path"] if self.train_mode else None,
+        )
+        # use the memory-mapped arrays from now on, so that they could be shared
+        self._load_from_store(store)
+
+    def _load_from_store(self, store):
+        """Skip reading and normalizing data; arrays are memory-mapped from the store"""
+        arrays, lookup, self.target_scaler = store.load(
+            data_source=self.data_source,
+            # scalers save statistics in test_path when training, and valid/test read them
+            stat_dir=self.data_cfgs["test_path"] if self.train_mode else None,
+        )
+        for key in self.store_keys:
+            setattr(self, key, arrays.get(key))
+        self.lookup_table = lookup
+        self.num_samples = len(self.lookup_table)
+        self._store = store
+
+    def __getstate__(self):
+        # memory-mapped arrays are reopened instead of pickled, e.g. in DataLoader workers
+        state = self.__dict__.copy()
+        if state.get("_store") is not None:
+            for key in self.store_keys:
+                if isinstance(state.get(key), np.memmap):
+                    state[key] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get("_store") is not None:
+            arrays = self._store.load_arrays()
+            for key in self.store_keys:
+                if key in arrays and getattr(self, key) is None:
+                    setattr(self, key, arrays[key])
 
     def _trans2nparr(self):
         """To make __getitem__ more efficient,
@@ -444,29 +600,16 @@ class BaseDataset(Dataset):
         return x, y, c
 
     def _create_lookup_table(self):
-        lookup = []
-        # list to collect basins ids of basins without a single training sample
-        basin_coordinates = len(self.t_s_dict["sites_id"])
-        rho = self.rho
-        warmup_length = self.warmup_length
-        horizon = self.horizon
-        max_time_length = self.nt
-        for basin in tqdm(range(basin_coordinates), file=sys.stdout, disable=False):
-            if self.is_tra_val_te != "train":
-                lookup.extend(
-                    (basin, f)
-                    for f in range(warmup_length, max_time_length - rho - horizon + 1)
-                )
-            else:
-                # some dataloader load data with warmup period, so leave some periods for it
-                # [warmup_len] -> time_start -> [rho] -> [horizon]
-                nan_array = np.isnan(self.y[basin, :, :])
-                lookup.extend(
-                    (basin, f)
-                    for f in range(warmup_length, max_time_length - rho - horizon + 1)
-                    if not np.all(nan_array[f + rho : f + rho + horizon])
-                )
-        self.lookup_table = dict(enumerate(lookup))
+        # some dataloader load data with warmup period, so leave some periods for it
+        # [warmup_len] -> time_start -> [rho] -> [horizon]
+        self.lookup_table = create_lookup_table(
+            self.y,
+            self.warmup_length,
+            self.rho,
+            self.horizon,
+            self.nt,
+            rm_all_nan=self.is_tra_val_te == "train",
+        )
         self.num_samples = len(self.lookup_table)
 
 
@@ -596,7 +739,7 @@ class FlexibleDataset(BaseDataset):
     def data_source(self):
         source_cfgs = self.data_cfgs["source_cfgs"]
         return {
-            name: data_sources_dict[name](path)
+            name: get_data_source(name, path)
             for name, path in zip(
                 source_cfgs["source_names"], source_cfgs["source_paths"]
             )
@@ -9,7 +9,9 @@ Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
 
 import collections
+import json
 import os
+import threading
 import numpy as np
 import pandas as pd
 import xarray as xr
@@ -17,24 +19,146 @@ import pint_xarray  # noqa but it is used in the code
 from tqdm import tqdm
 
 from hydroutils import hydro_time
-from hydrodataset import (
-    Camels,
-    CamelsCh,
-    CamelsDe,
-    CamelsDk,
-    CamelsSe,
-    CamelsGb,
-    CamelsFr,
-    CamelsInd,
-    CamelsAus,
-    CamelsBr,
-    CamelsCl,
-    CamelsYstl
-)
-from hydrodatasource.reader.data_source import SelfMadeHydroDataset
-
 
 from torchhydro import CACHE_DIR, SETTING
+from torchhydro.registry import LazyDict
+
+
+class HandlePool(object):
+    """
+    A process-wide LRU pool of opened objects, such as data source objects and netcdf datasets
+
+    Opening a data source or a netcdf file parses its metadata, which is slow for large datasets,
+    so objects are reused by train, valid and test datasets and by ensemble members in one process.
+    An object evicted by the LRU policy is just dropped (it is closed when no longer referenced),
+    while invalidate() closes it explicitly, for example, before its file is rewritten.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, opener):
+        """
+        Get the object of key, open it by opener() if it is not in the pool
+
+        Parameters
+        ----------
+        key
+            a hashable key
+        opener
+            a function without arguments returning the object
+
+        Returns
+        -------
+        object
+            the pooled object
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        obj = opener()
+        with self._lock:
+            self._items[key] = obj
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return obj
+
+    def invalidate(self, key=None):
+        """
+        Remove an object (all objects if key is None) from the pool and close it if possible
+
+        Parameters
+        ----------
+        key
+            the key of object
+        """
+        with self._lock:
+            if key is None:
+                objs = list(self._items.values())
+                self._items.clear()
+            else:
+                objs = [self._items.pop(key)] if key in self._items else []
+        for obj in objs:
+            if hasattr(obj, "close"):
+                obj.close()
+
+
+DATA_SOURCE_POOL = HandlePool(maxsize=8)
+TS_XRDATASET_POOL = HandlePool(maxsize=32)
+
+
+def get_data_source(source_name, source_path, **other_settings):
+    """
+    Get a data source object from DATA_SOURCE_POOL, a new one is created if it is not in the pool
+
+    Parameters
+    ----------
+    source_name
+        the key in data_sources_dict
+    source_path
+        the path of data source
+    other_settings
+        other arguments for initializing the data source
+
+    Returns
+    -------
+    object
+        the data source object
+    """
+    source_class = data_sources_dict[source_name]
+    key = (
+        source_class,
+        str(source_path),
+        json.dumps(other_settings, sort_keys=True, default=str),
+    )
+    return DATA_SOURCE_POOL.get(
+        key, lambda: source_class(source_path, **other_settings)
+    )
+
+
+def open_ts_xrdataset(path):
+    """
+    Open a netcdf file via TS_XRDATASET_POOL, so its metadata is parsed only once in a process
+
+    Parameters
+    ----------
+    path
+        the path of netcdf file
+
+    Returns
+    -------
+    xr.Dataset
+        the lazily loaded dataset; don't close it, use invalidate_data_sources instead
+    """
+    path = os.path.abspath(path)
+    return TS_XRDATASET_POOL.get(path, lambda: xr.open_dataset(path))
+
+
+def invalidate_data_sources(path=None):
+    """
+    Remove data source objects and netcdf datasets from pools, e.g. after source data are updated
+
+    Parameters
+    ----------
+    path
+        if not None, only the netcdf dataset of this file is removed;
+        otherwise, all pooled objects are removed
+    """
+    if path is None:
+        DATA_SOURCE_POOL.invalidate()
+        TS_XRDATASET_POOL.invalidate()
+    else:
+        TS_XRDATASET_POOL.invalidate(os.path.abspath(path))
 
 
 class SupData4Camels:
@@ -42,7 +166,7 @@ class SupData4Camels:
     and also a class for reading streamflow data after 2014-12-31"""
 
     def __init__(self, supdata_dir=None) -> None:
-        self.camels = Camels(
+        self.camels = data_sources_dict["camels_us"](
             data_path=os.path.join(
                 SETTING["local_data_path"]["datasets-origin"], "camels", "camels_us"
             )
@@ -142,6 +266,8 @@ class SupData4Camels:
                 "time": times,
             },
         )
+        # the opened old file should be closed before it is rewritten
+        invalidate_data_sources(self.ts_xrdataset_path)
         xr_data.to_netcdf(self.ts_xrdataset_path)
 
     def read_ts_xrdataset(self, gage_id_lst=None, t_range=None, var_lst=None):
@@ -150,7 +276,7 @@ class SupData4Camels:
             self.cache_ts_xrdataset()
         if var_lst is None:
             return None
-        ts = xr.open_dataset(self.ts_xrdataset_path)
+        ts = open_ts_xrdataset(self.ts_xrdataset_path)
         all_vars = ts.data_vars
         if any(var not in ts.variables for var in var_lst):
             raise ValueError(f"var_lst must all be in {all_vars}")
@@ -732,23 +858,25 @@ class Smap4Camels(SupData4Camels):
         return out
 
 
-data_sources_dict = {
-    "camels_us": Camels,
-    "selfmadehydrodataset": SelfMadeHydroDataset,
-    "usgs4camels": SupData4Camels,
-    "modiset4camels": ModisEt4Camels,
-    "nldas4camels": Nldas4Camels,
-    "smap4camels": Smap4Camels,
-    "camels_aus": CamelsAus,
-    "camels_br": CamelsBr,
-    "camels_ch": CamelsCh,
-    "camels_cl": CamelsCl,
-    "camels_de": CamelsDe,
-    "camels_dk": CamelsDk,
-    "camels_fr": CamelsFr,
-    "camels_gb": CamelsGb,
-    "camels_ind": CamelsInd,
-    "camels_se": CamelsSe,
-    "camels_ystl": CamelsYstl,
-
-}
+# readers in hydrodataset and hydrodatasource are imported only when they are used
+data_sources_dict = LazyDict(
+    {
+        "camels_us": "hydrodataset:Camels",
+        "selfmadehydrodataset": "hydrodatasource.reader.data_source:SelfMadeHydroDataset",
+        "usgs4camels": SupData4Camels,
+        "modiset4camels": ModisEt4Camels,
+        "nldas4camels": Nldas4Camels,
+        "smap4camels": Smap4Camels,
+        "camels_aus": "hydrodataset:CamelsAus",
+        "camels_br": "hydrodataset:CamelsBr",
+        "camels_ch": "hydrodataset:CamelsCh",
+        "camels_cl": "hydrodataset:CamelsCl",
+        "camels_de": "hydrodataset:CamelsDe",
+        "camels_dk": "hydrodataset:CamelsDk",
+        "camels_fr": "hydrodataset:CamelsFr",
+        "camels_gb": "hydrodataset:CamelsGb",
+        "camels_ind": "hydrodataset:CamelsInd",
+        "camels_se": "hydrodataset:CamelsSe",
+        "camels_ystl": "hydrodataset:CamelsYstl",
+    }
+)
@@ -0,0 +1,202 @@
+"""A persistent and memory-mapped store for the arrays of a dataset"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle as pkl
+import shutil
+import uuid
+import numpy as np
+
+from torchhydro import CACHE_DIR
+
+# keys in data_cfgs which don't change the data of a dataset
+NOT_HASHED_DATA_CFGS = ["validation_path", "test_path", "batch_size"]
+# statistics files written by scalers in test_path, see data_scalers.py and scalers.py
+STAT_FILE_PATTERNS = ["*_stat.json", "*_scaler.pkl"]
+
+
+def data_cfgs_hash(data_cfgs: dict, is_tra_val_te: str, dataset_name: str) -> str:
+    """
+    A hash key for the data of a dataset
+
+    Parameters
+    ----------
+    data_cfgs
+        configs for reading source data
+    is_tra_val_te
+        train, valid or test
+    dataset_name
+        the name of dataset class, different datasets may process data differently
+
+    Returns
+    -------
+    str
+        a sha1 hex string
+    """
+    cfgs = {k: v for k, v in data_cfgs.items() if k not in NOT_HASHED_DATA_CFGS}
+    cfgs["is_tra_val_te"] = is_tra_val_te
+    cfgs["dataset_name"] = dataset_name
+    cfgs_str = json.dumps(cfgs, sort_keys=True, default=str)
+    return hashlib.sha1(cfgs_str.encode("utf-8")).hexdigest()
+
+
+def _set_scaler_data_source(scaler, data_source):
+    """data source objects hold file handles so they are not saved with the scaler"""
+    if hasattr(scaler, "data_source"):
+        scaler.data_source = data_source
+    if hasattr(scaler, "scaler") and hasattr(scaler.scaler, "data_source"):
+        scaler.scaler.data_source = data_source
+
+
+class DatasetStore(object):
+    """
+    Normalized arrays, lookup table and target scaler of a dataset saved on disk
+
+    Arrays are saved as .npy files and loaded with memory mapping (copy-on-write),
+    so restarting an experiment skips reading and normalizing data, and DataLoader
+    workers share pages of the same files instead of copying arrays.
+    """
+
+    def __init__(self, key: str, store_dir=None):
+        """
+        Parameters
+        ----------
+        key
+            hash key from data_cfgs_hash
+        store_dir
+            the root directory of all stores; default is CACHE_DIR/dataset_store
+        """
+        if store_dir is None:
+            store_dir = CACHE_DIR.joinpath("dataset_store")
+        self.key = key
+        self.store_path = os.path.join(store_dir, key)
+
+    @property
+    def meta_file(self):
+        return os.path.join(self.store_path, "meta.json")
+
+    def exists(self):
+        # a store is moved into store_path only when it is complete, see save
+        return os.path.isfile(self.meta_file)
+
+    def array_file(self, name):
+        return os.path.join(self.store_path, f"{name}.npy")
+
+    def save(self, arrays: dict, lookup_table, target_scaler, stat_dir=None):
+        """
+        Save a dataset into the store
+
+        All files are written into a temporary directory next to store_path, which is then renamed
+        to store_path, so processes sharing the same store (e.g. parallel ensemble sub-experiments)
+        never see a partly written store, and arrays that are memory-mapped by one process are not
+        overwritten by another one. If another process has saved the store first, it is kept.
+
+        Parameters
+        ----------
+        arrays
+            name -> numpy array (or None)
+        lookup_table
+            the lookup table of the dataset
+        target_scaler
+            the scaler used to denormalize outputs
+        stat_dir
+            the directory where scalers saved statistics files; they are saved too
+        """
+        tmp_path = f"{self.store_path}.tmp-{os.getpid()}-{uuid.uuid4().hex}"
+        os.makedirs(tmp_path)
+        try:
+            self._write(tmp_path, arrays, lookup_table, target_scaler, stat_dir)
+            if os.path.isdir(self.store_path) and not self.exists():
+                # a broken store left by an interrupted process
+                shutil.rmtree(self.store_path, ignore_errors=True)
+            try:
+                os.replace(tmp_path, self.store_path)
+            except OSError:
+                # store_path is not empty: another process has saved the same store
+                if not self.exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _write(self, path, arrays, lookup_table, target_scaler, stat_dir):
+        saved = []
+        for name, arr in arrays.items():
+            if arr is None:
+                continue
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(arr))
+            saved.append(name)
+        np.save(os.path.join(path, "lookup_table.npy"), np.asarray(lookup_table))
+        data_source = getattr(target_scaler, "data_source", None)
+        _set_scaler_data_source(target_scaler, None)
+        try:
+            with open(os.path.join(path, "target_scaler.pkl"), "wb") as f:
+                pkl.dump(target_scaler, f)
+        finally:
+            _set_scaler_data_source(target_scaler, data_source)
+        stat_files = []
+        if stat_dir is not None:
+            for pattern in STAT_FILE_PATTERNS:
+                for stat_file in glob.glob(os.path.join(stat_dir, pattern)):
+                    shutil.copy(stat_file, path)
+                    stat_files.append(os.path.basename(stat_file))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"arrays": saved, "stat_files": stat_files}, f)
+
+    def load_arrays(self, mmap_mode="c") -> dict:
+        """
+        Load arrays from the store
+
+        Parameters
+        ----------
+        mmap_mode
+            see np.load; "c" means copy-on-write, so arrays could still be modified in memory
+
+        Returns
+        -------
+        dict
+            name -> memory-mapped array; arrays not saved are None
+        """
+        with open(self.meta_file, "r") as f:
+            meta = json.load(f)
+        return {
+            name: np.load(self.array_file(name), mmap_mode=mmap_mode)
+            for name in meta["arrays"]
+        }
+
+    def load(self, data_source=None, stat_dir=None, mmap_mode="c"):
+        """
+        Load a dataset from the store
+
+        Parameters
+        ----------
+        data_source
+            the data source object attached to the target scaler
+        stat_dir
+            if not None, statistics files are copied to it as scalers do in training
+        mmap_mode
+            see load_arrays
+
+        Returns
+        -------
+        tuple
+            arrays, lookup_table, target_scaler
+        """
+        arrays = self.load_arrays(mmap_mode)
+        lookup_table = np.load(self.array_file("lookup_table"))
+        with open(os.path.join(self.store_path, "target_scaler.pkl"), "rb") as f:
+            target_scaler = pkl.load(f)
+        _set_scaler_data_source(target_scaler, data_source)
+        if stat_dir is not None:
+            with open(self.meta_file, "r") as f:
+                stat_files = json.load(f)["stat_files"]
+            os.makedirs(stat_dir, exist_ok=True)
+            for stat_file in stat_files:
+                shutil.copy(os.path.join(self.store_path, stat_file), stat_dir)
+        return arrays, lookup_table, target_scaler
+
+    def clear(self):
+        """Remove the store, for example, when source data has been updated"""
+        if os.path.isdir(self.store_path):
+            shutil.rmtree(self.store_path)
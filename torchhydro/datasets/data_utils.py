@@ -118,6 +118,59 @@ def wrap_t_s_dict(data_cfgs: dict, is_tra_val_te: str) -> OrderedDict:
     return OrderedDict(sites_id=basins_id, t_final_range=t_range_list)
 
 
+def create_lookup_table(
+    y: np.ndarray,
+    warmup_length: int,
+    rho: int,
+    horizon: int,
+    max_time_length: int,
+    rm_all_nan: bool = True,
+) -> np.ndarray:
+    """
+    Create a lookup table of all samples for a batch-first dataset
+
+    Each sample is a time window: [warmup_len] -> time_start -> [rho] -> [horizon].
+    All basins are handled at once: for each window, the number of all-NaN periods
+    in its [rho, rho + horizon) part is counted with cumulative sums.
+
+    Parameters
+    ----------
+    y
+        target data with shape (basin, time, variable)
+    warmup_length
+        length of warmup periods before time_start
+    rho
+        length of history periods
+    horizon
+        length of forecast periods
+    max_time_length
+        length of longest time series in all basins
+    rm_all_nan
+        if True (generally for training), windows whose forecast periods are all NaN are removed
+
+    Returns
+    -------
+    np.ndarray
+        int32 array with shape (num_samples, 2); each row is (basin index, time_start)
+    """
+    ngrid = y.shape[0]
+    time_starts = np.arange(warmup_length, max_time_length - rho - horizon + 1)
+    valid = np.ones((ngrid, time_starts.size), dtype=bool)
+    if rm_all_nan and time_starts.size > 0:
+        nt_y = y.shape[1]
+        all_nan = np.all(np.isnan(y), axis=2)
+        nan_cumsum = np.zeros((ngrid, nt_y + 1), dtype=np.int64)
+        np.cumsum(all_nan, axis=1, out=nan_cumsum[:, 1:])
+        # windows are cut at the end of y just like slicing does
+        starts = np.clip(time_starts + rho, 0, nt_y)
+        ends = np.clip(time_starts + rho + horizon, 0, nt_y)
+        nan_num = nan_cumsum[:, ends] - nan_cumsum[:, starts]
+        # an empty window is regarded as all NaN
+        valid = nan_num < (ends - starts)
+    basin_idx, time_idx = np.nonzero(valid)
+    return np.stack((basin_idx, time_starts[time_idx]), axis=1).astype(np.int32)
+
+
 def _trans_norm(
     x: xr.DataArray,
     var_lst: list,
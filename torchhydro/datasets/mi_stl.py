@@ -14,7 +14,7 @@ from typing import Dict
 
 from hydroutils import hydro_time
 
-from torchhydro.datasets.data_sources import data_sources_dict
+from torchhydro.datasets.data_sources import get_data_source
 
 
 class STL(object):
@@ -848,6 +848,300 @@ class STL(object):
         self.decomposition()
         return self.trend, self.season, self.residuals
 
+
+class ArraySTL(object):
+    """
+    Seasonal-Trend decomposition using LOESS for many series at once.
+    the same procedure as STL, but every step works on numpy arrays in shape [series, time],
+    so all basins are decomposed together instead of looping over points with python lists.
+    """
+    def __init__(
+        self,
+        cycle_length: int,
+        no: int = 1,
+        ni: int = 1,
+        ns: int = 33,
+        nl: int = 365,
+        nt: int = 421,
+        n_p: int = 365,
+        chunk_size: int = 2 ** 22,
+    ):
+        """
+        initiate an array STL model, parameters are the same as STL.
+        chunk_size: int, the max number of elements of the windows gathered at a time in loess.
+        """
+        self.cycle_length = cycle_length
+        self.no = no
+        self.ni = ni
+        self.ns = ns
+        self.nl = nl
+        self.nt = nt
+        self.n_p = n_p
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def weight_function(u, degree: int = 2):
+        """quadratic/cubic weight function, see STL.weight_function"""
+        u = np.absolute(u)
+        return np.where(u < 1, (1 - u ** degree) ** degree, 0.0)
+
+    @staticmethod
+    def _loess_index(length: int, width: int):
+        """
+        indices of the loess window of every point, in shape [length, width].
+        points out of the series are reflected about the focal point, as STL.loess does at the start and end.
+        """
+        if width % 2 == 0:
+            raise ValueError("the window width of loess should be odd")
+        k = int(width / 2)
+        if length < 2 * k:
+            raise ValueError(
+                f"the series (length {length}) is too short for a loess window of width {width}"
+            )
+        i = np.arange(length)[:, None]
+        index = i + np.arange(-k, k + 1)
+        outside = (index < 0) | (index > length - 1)
+        return np.where(outside, 2 * i - index, index)
+
+    def loess(
+        self,
+        width: int,
+        x,
+        degree: int = 1,
+        rho_weight=None,
+    ):
+        """
+        loess, locally estimated scatterplot smoothing, for all series.
+        Parameters
+        ----------
+        width, int, odd, window width.
+        x, array in shape [series, time], series need to smoothing.
+        degree: int, the number of polynomial degree.
+        rho_weight: array in shape [series, time], robustness weights.
+        Returns
+        -------
+        result, the smoothed series by loess filter.
+        """
+        n_series, length = x.shape
+        k = int(width / 2)
+        index = self._loess_index(length, width)
+        # centered abscissa, the estimate value is the intercept of polynomial
+        t = np.arange(-k, k + 1, dtype=float)
+        power = np.power(t[:, None], np.arange(2 * degree + 1))
+        neighbor_weight = self.weight_function(t / k, 3)
+        p = np.arange(degree + 1)
+        hankel = p[:, None] + p[None, :]
+        if rho_weight is None:
+            # the normal matrix is the same for all windows
+            normal = (neighbor_weight @ power)[hankel]
+            y_weight = neighbor_weight[:, None] * power[:, : degree + 1]
+        result = np.empty(x.shape)
+        chunk = max(1, int(self.chunk_size / (n_series * width)))
+        for start in range(0, length, chunk):
+            index_chunk = index[start : start + chunk]
+            y = x[:, index_chunk]
+            if rho_weight is None:
+                a = np.broadcast_to(normal, y.shape[:2] + normal.shape)
+                b = y @ y_weight
+            else:
+                weight = rho_weight[:, index_chunk] * neighbor_weight
+                a = (weight @ power)[..., hankel]
+                b = (weight * y) @ power[:, : degree + 1]
+            try:
+                coefficient = np.linalg.solve(a, b[..., None])
+            except np.linalg.LinAlgError:
+                raise np.linalg.LinAlgError("Singular matrix")
+            result[:, start : start + chunk] = coefficient[..., 0, 0]
+        return result
+
+    @staticmethod
+    def moving_average_smoothing(width: int, x):
+        """
+        moving average smoothing for all series, see STL.moving_average_smoothing.
+        the window is truncated at the start and end, and the sum in middle is divided by width.
+        """
+        n_series, length = x.shape
+        k = int(width / 2)
+        i = np.arange(length)
+        lower = np.maximum(i - k, 0)
+        upper = np.minimum(i + k + 1, length)
+        n_x = np.where(
+            i < k, i + k + 1, np.where(i > (length - 1) - k, length - i + k, width)
+        )
+        cumsum = np.concatenate(
+            [np.zeros((n_series, 1)), np.cumsum(x, axis=1)], axis=1
+        )
+        return (cumsum[:, upper] - cumsum[:, lower]) / n_x
+
+    def _extend_original_series(self, x):
+        """extend original series with its first and last cycle"""
+        return np.concatenate(
+            [x[:, : self.cycle_length], x, x[:, -self.cycle_length :]], axis=1
+        )
+
+    def _cycle_subseries(self, x):
+        """divide series into cycle subseries, [series, time] -> [series * cycle_length, n_cycle]"""
+        n_series, length = x.shape
+        n_cycle = int(length / self.cycle_length)
+        subseries = x[:, : n_cycle * self.cycle_length].reshape(
+            n_series, n_cycle, self.cycle_length
+        )
+        return subseries.transpose(0, 2, 1).reshape(-1, n_cycle)
+
+    def _recover_series(self, subseries, n_series: int):
+        """extend one point in start and end of cycle subseries separately, and recover series from them"""
+        extend_subseries = np.concatenate(
+            [subseries[:, :1], subseries, subseries[:, -1:]], axis=1
+        )
+        extend_subseries = extend_subseries.reshape(n_series, self.cycle_length, -1)
+        return extend_subseries.transpose(0, 2, 1).reshape(n_series, -1)
+
+    def inner_loop(
+        self,
+        y,
+        extend_y,
+        trend,
+        rho_weight,
+    ):
+        """
+        the inner loop, see STL.inner_loop
+        Parameters
+        ----------
+        y, the original series.
+        extend_y, the extended original series.
+        trend, the trend item of the extended series.
+        rho_weight, robustness weights, calculated by residuals.
+        Returns
+        -------
+        trend and season of the extended series
+        """
+        # 1 detrending
+        y = y - trend[:, self.cycle_length : -self.cycle_length]
+
+        # 2 cycle-subseries smoothing; as STL does, no robustness weights for cycle-subseries
+        subseries = self._cycle_subseries(y)
+        cycle = self.loess(self.ns, subseries, degree=1)
+        cycle_v = self._recover_series(cycle, y.shape[0])
+
+        # 3 low-pass filtering of smoothed cycle-subseries
+        lowf = self.moving_average_smoothing(self.n_p, cycle_v)
+        lowf = self.moving_average_smoothing(self.n_p, lowf)
+        lowf = self.moving_average_smoothing(self.n_p, lowf)
+        lowf = self.moving_average_smoothing(2 * self.n_p, lowf)
+
+        # 4 detrending of smoothed cycle-subseries
+        season = cycle_v - lowf
+
+        # 5 deseasonalizing
+        trend = extend_y - season
+
+        # 6 Trend Smoothing
+        trend = self.loess(self.nt, trend, degree=1, rho_weight=rho_weight)
+
+        return trend, season
+
+    @staticmethod
+    def _converged(trend0, trend1, season0, season1):
+        """the terminal condition of loops in STL, for each series"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terminate_trend = np.max(np.absolute(trend0 - trend1), axis=1) / (
+                np.max(trend0, axis=1) + np.min(trend0, axis=1)
+            )
+            terminate_season = np.max(np.absolute(season0 - season1), axis=1) / (
+                np.max(season0, axis=1) + np.min(season0, axis=1)
+            )
+        return (terminate_trend < 0.01) | (terminate_season < 0.01)
+
+    def outer_loop(self, x, extend_x):
+        """
+        the outer loop of stl, see STL.outer_loop.
+        a series leaves the loops when it converges, and the others go on.
+        Returns
+        -------
+        trend, season and residuals of the extended series
+        """
+        trend = np.zeros(extend_x.shape)
+        season = np.zeros(extend_x.shape)
+        residuals = np.zeros(extend_x.shape)
+        rho_weight = np.ones(extend_x.shape)
+        # indices of series in the outer loop
+        outer = np.arange(x.shape[0])
+        for i in range(self.no):
+            trend_i0 = trend[outer]
+            season_i0 = season[outer]
+            trend_i = trend_i0.copy()
+            season_i = season_i0.copy()
+            # indices (in outer) of series in the inner loop
+            inner = np.arange(outer.size)
+            for j in range(self.ni):
+                series = outer[inner]
+                trend_ij0 = trend_i[inner]
+                season_ij0 = season_i[inner]
+                trend_ij, season_ij = self.inner_loop(
+                    x[series], extend_x[series], trend_ij0, rho_weight[series]
+                )
+                trend_i[inner] = trend_ij
+                season_i[inner] = season_ij
+                if self.ni > 1:
+                    inner = inner[
+                        ~self._converged(trend_ij0, trend_ij, season_ij0, season_ij)
+                    ]
+                    if inner.size == 0:
+                        break
+            trend[outer] = trend_i
+            season[outer] = season_i
+            residuals[outer] = extend_x[outer] - trend_i - season_i
+            abs_residuals = np.absolute(residuals[outer])
+            h = 6 * np.median(abs_residuals, axis=1, keepdims=True)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rho_weight[outer] = self.weight_function(abs_residuals / h, 2)
+
+            if self.no > 1:
+                outer = outer[~self._converged(trend_i0, trend_i, season_i0, season_i)]
+                if outer.size == 0:
+                    break
+
+        return trend, season, residuals
+
+    def season_post_smoothing(self, season):
+        """post-smoothing of the seasonal"""
+        ns = 11
+        return self.loess(ns, season, degree=2)
+
+    def decompose(self, x):
+        """
+        decomposition function.
+        Parameters
+        ----------
+        x, array in shape [series, time] or [time], the length of time should be a multiple of cycle_length.
+        Returns
+        -------
+        trend, season and residuals item, in the same shape as x.
+        """
+        x = np.asarray(x, dtype=float)
+        one_series = x.ndim == 1
+        if one_series:
+            x = x[None, :]
+        if x.shape[1] % self.cycle_length != 0:
+            raise ValueError(
+                f"the length of series {x.shape[1]} is not a multiple of cycle_length {self.cycle_length}"
+            )
+        extend_x = self._extend_original_series(x)
+        trend_, season_, residuals_ = self.outer_loop(x, extend_x)
+        post_season_ = self.season_post_smoothing(season_)
+        post_residuals_ = extend_x - trend_ - post_season_
+        trend = np.around(trend_[:, self.cycle_length : -self.cycle_length], 2)
+        post_season = np.around(
+            post_season_[:, self.cycle_length : -self.cycle_length], 2
+        )
+        post_residuals = np.around(
+            post_residuals_[:, self.cycle_length : -self.cycle_length], 2
+        )
+        if one_series:
+            return trend[0], post_season[0], post_residuals[0]
+        return trend, post_season, post_residuals
+
+
 class MutualInformation(object):
     """mutual information"""
     def __init__(self):
@@ -1047,7 +1341,7 @@ class Decomposition(object):
         source_name = self.data_cfgs["source_cfgs"]["source_name"]
         source_path = self.data_cfgs["source_cfgs"]["source_path"]
         other_settings = self.data_cfgs["source_cfgs"].get("other_settings", {})
-        return data_sources_dict[source_name](source_path, **other_settings)
+        return get_data_source(source_name, source_path, **other_settings)
 
     def _read_xyc_specified_time(self, time_range):
         """Read x, y, c data from data source with specified time range
@@ -1129,20 +1423,8 @@ class Decomposition(object):
 
         [time, basin, streamflow] -> [time, basin, trend|season|residuals]
         """
-        trend = []
-        season = []
-        residuals = []
-        stl = STL(frequency=1, cycle_length=365, result_dir=self.result_dir)
-        for i in range(self.n_basin):
-            data = self.y_origin.streamflow.values[i].tolist()
-            trend_, season_, residuals_ = stl.decompose(data)
-            trend.append(trend_[:])
-            season.append(season_[:])
-            residuals.append(residuals_[:])
-
-        trend = np.array(trend)
-        season = np.array(season)
-        residuals = np.array(residuals)
+        stl = ArraySTL(cycle_length=365)
+        trend, season, residuals = stl.decompose(self.y_origin.streamflow.values)
         trend_DataArray = xr.DataArray(trend, dims=['basin', 'time'], coords={'basin': self.basin, 'time': self.time}, name = 'trend', attrs=self.attrs)
         season_DataArray = xr.DataArray(season, dims=['basin', 'time'], coords={'basin': self.basin, 'time': self.time}, name = 'season', attrs=self.attrs)
         residuals_DataArray = xr.DataArray(residuals, dims=['basin', 'time'], coords={'basin': self.basin, 'time': self.time}, name = 'residuals', attrs=self.attrs)
@@ -6,21 +6,20 @@ LastEditors: Lili Yu
 Description: narx model dataset
 """
 
-import sys
 import re
 import numpy as np
 import torch
 import pandas as pd
-from tqdm import tqdm
 from datetime import datetime, timedelta
 
 from hydrodatasource.utils.utils import streamflow_unit_conv
 from torchhydro.configs.config import DATE_FORMATS
 from torchhydro.datasets.data_sets import BaseDataset
 from torchhydro.datasets.data_utils import (
+    create_lookup_table,
     wrap_t_s_dict,
 )
-from torchhydro.models.basintree import BasinTree
+from torchhydro.models.basintree import BasinGraphIndex, BasinTree
 from torchhydro.datasets.data_scalers import ScalerHub
 
 def detect_date_format(date_str):
@@ -121,7 +120,11 @@ class NarxDataset(BaseDataset):
             raise ValueError("Error: naxrdataset needs nestedness information.")
         else:
             nestedness_info = self.data_source.read_nestedness_csv()
-            basin_tree_ = BasinTree(nestedness_info, self.basins)
+            graph_index = None
+            if self.data_cfgs.get("b_cache_dataset", False):
+                # the basin graph index is saved with dataset stores, and shared by datasets of a same region
+                graph_index = BasinGraphIndex.cached(nestedness_info)
+            basin_tree_ = BasinTree(nestedness_info, self.basins, graph_index)
             self.data_educed_model = basin_tree_.get_basin_trees()
             self.basin_list = self.data_educed_model["basin_list"]
 
@@ -269,29 +272,16 @@ class NarxDataset(BaseDataset):
         -------
 
         """
-        lookup = []
-        # list to collect basins ids of basins without a single training sample
-        basin_coordinates = len(self.basin_list)
-        rho = self.rho  # forcast_history
-        warmup_length = self.warmup_length
-        horizon = self.horizon  # forcast_length
-        max_time_length = self.nt  # length of longest time series in all basins
-        for basin in tqdm(range(basin_coordinates), file=sys.stdout, disable=False):
-            if self.is_tra_val_te != "train":  # validate and test period
-                lookup.extend(
-                    (basin, f)
-                    for f in range(warmup_length, max_time_length - rho - horizon + 1)
-                )
-            else:  # train period
-                # some dataloader load data with warmup period, so leave some periods for it
-                # [warmup_len] -> time_start -> [rho] -> [horizon]
-                nan_array = np.isnan(self.y[basin, :, :])  # nan value
-                lookup.extend(
-                    (basin, f)
-                    for f in range(warmup_length, max_time_length - rho - horizon + 1)
-                    if not np.all(nan_array[f + rho : f + rho + horizon])
-                )
-        self.lookup_table = dict(enumerate(lookup))
+        # some dataloader load data with warmup period, so leave some periods for it
+        # [warmup_len] -> time_start -> [rho] -> [horizon]
+        self.lookup_table = create_lookup_table(
+            self.y,
+            self.warmup_length,
+            self.rho,  # forcast_history
+            self.horizon,  # forcast_length
+            self.nt,  # length of longest time series in all basins
+            rm_all_nan=self.is_tra_val_te == "train",
+        )
         self.num_samples = len(self.lookup_table)
 
 
@@ -8,9 +8,9 @@ FilePath: \torchhydro\torchhydro\datasets\sampler.py
 Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
 
-from collections import defaultdict
+from collections import defaultdict, deque
 import numpy as np
-from torch.utils.data import RandomSampler, Sampler
+from torch.utils.data import BatchSampler, RandomSampler, Sampler
 from torchhydro.datasets.data_sets import BaseDataset
 from typing import Iterator, Optional
 import torch
@@ -134,6 +134,25 @@ class BasinBatchSampler(Sampler[int]):
         return self.num_samples
 
 
+class RecordedBatchSampler(BatchSampler):
+    """
+    A BatchSampler which records its batches, so the items of each batch from a DataLoader are known
+
+    DataLoader draws batches in order, even with workers fetching ahead, so the oldest recorded batch
+    is the one just yielded by the DataLoader; pop it by batches.popleft(), see keyed_batches in train_utils.
+    """
+
+    def __init__(self, sampler, batch_size: int, drop_last: bool = False) -> None:
+        super().__init__(sampler, batch_size, drop_last)
+        self.batches = deque()
+
+    def __iter__(self):
+        self.batches.clear()
+        for batch in super().__iter__():
+            self.batches.append(batch)
+            yield batch
+
+
 def fl_sample_basin(dataset: BaseDataset):
     """
     Sample one basin data as a client from a dataset for federated learning
@@ -153,7 +172,7 @@ def fl_sample_basin(dataset: BaseDataset):
     num_users = len(basins)
     # set group for basins
     basin_groups = defaultdict(list)
-    for idx, (basin, date) in lookup_table.items():
+    for idx, (basin, date) in enumerate(lookup_table):
         basin_groups[basin].append(idx)
 
     # one user is one basin
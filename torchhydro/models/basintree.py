@@ -8,10 +8,21 @@ LastEditors: Lili Yu
 Description: generate basin tree.
 """
 
+import hashlib
+import os
+import numpy as np
 import torch
 import pandas as pd
 from pandas import DataFrame as df
 
+# columns of nestedness information used by the basin graph
+NESTEDNESS_COLUMNS = [
+    "nes_n_nested_within",
+    "nes_n_station_ds",
+    "nes_station_nested_within",
+    "nes_next_station_ds",
+]
+
 
 class Node:
     """
@@ -159,6 +170,159 @@ class Basin:
             self.device = None
 
 
+class BasinGraphIndex:
+    """
+    the basin network of a region in arrays, built once in near-linear time and saved as a npz file.
+    basins are numbered by their positions in the nestedness information.
+        downstream: the next downstream basin of each basin, -1 for outlets.
+        direct_upstream_offsets, direct_upstream: basins directly upstream of basin i are
+            direct_upstream[direct_upstream_offsets[i]: direct_upstream_offsets[i + 1]].
+        upstream_offsets, upstream: all basins nested within basin i, in the order of nes_station_nested_within.
+        level: the number of links from a basin to its outlet, 0 for outlets.
+        topo_order, level_offsets: basins from outlets to upstream, basins of level l are
+            topo_order[level_offsets[l]: level_offsets[l + 1]].
+    """
+    array_names = (
+        "basin_ids",
+        "downstream",
+        "direct_upstream_offsets",
+        "direct_upstream",
+        "upstream_offsets",
+        "upstream",
+        "level",
+        "topo_order",
+        "level_offsets",
+    )
+
+    def __init__(self, **arrays):
+        for name in self.array_names:
+            setattr(self, name, arrays[name])
+        self.n_basin = len(self.basin_ids)
+        self.position = {basin_id: i for i, basin_id in enumerate(self.basin_ids.tolist())}
+
+    @classmethod
+    def from_nestedness(cls, nestednessinfo: df):
+        """build the index from nestedness information, see BasinTree."""
+        basin_ids = np.asarray(nestednessinfo.index.values).astype(str)
+        n_basin = len(basin_ids)
+        position = {basin_id: i for i, basin_id in enumerate(basin_ids.tolist())}
+
+        def _position(basin_id):
+            try:
+                return position[str(basin_id)]
+            except KeyError:
+                raise ValueError(f"basin {basin_id} is not in the nestedness information.")
+
+        downstream = np.array(
+            [-1 if _is_missing(basin_ds) else _position(basin_ds)
+             for basin_ds in nestednessinfo["nes_next_station_ds"].tolist()],
+            dtype=np.int64,
+        )
+        # adjacency arrays of direct upstream basins, grouped by their downstream basin
+        n_outlet = int((downstream < 0).sum())
+        direct_upstream = np.argsort(downstream, kind="stable")[n_outlet:]
+        direct_upstream_offsets = np.zeros(n_basin + 1, dtype=np.int64)
+        direct_upstream_offsets[1:] = np.cumsum(np.bincount(downstream[downstream >= 0], minlength=n_basin))
+
+        # level by level from outlets to upstream
+        level = np.full(n_basin, -1, dtype=np.int64)
+        frontier = np.flatnonzero(downstream < 0)
+        topo_order = []
+        n_level = []
+        while frontier.size > 0:
+            level[frontier] = len(n_level)
+            topo_order.append(frontier)
+            n_level.append(frontier.size)
+            starts = direct_upstream_offsets[frontier]
+            lengths = direct_upstream_offsets[frontier + 1] - starts
+            shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            frontier = direct_upstream[np.arange(lengths.sum()) + shift]
+        if (level < 0).any():
+            raise ValueError("There are loops in the downstream links of nestedness information.")
+        topo_order = np.concatenate(topo_order) if topo_order else np.zeros(0, dtype=np.int64)
+        level_offsets = np.concatenate([[0], np.cumsum(n_level)]).astype(np.int64)
+
+        # all upstream basins, in the order of nes_station_nested_within
+        upstream = []
+        upstream_offsets = np.zeros(n_basin + 1, dtype=np.int64)
+        for i, basin_us in enumerate(nestednessinfo["nes_station_nested_within"].tolist()):
+            if not _is_missing(basin_us):
+                upstream.extend(_position(basin_id) for basin_id in basin_us.split(","))
+            upstream_offsets[i + 1] = len(upstream)
+        upstream = np.array(upstream, dtype=np.int64)
+
+        return cls(
+            basin_ids=basin_ids,
+            downstream=downstream,
+            direct_upstream_offsets=direct_upstream_offsets,
+            direct_upstream=direct_upstream,
+            upstream_offsets=upstream_offsets,
+            upstream=upstream,
+            level=level,
+            topo_order=topo_order,
+            level_offsets=level_offsets,
+        )
+
+    @classmethod
+    def load(cls, file):
+        """load an index saved by save"""
+        with np.load(file) as arrays:
+            return cls(**{name: arrays[name] for name in cls.array_names})
+
+    def save(self, file):
+        """save the index into a npz file"""
+        np.savez(file, **{name: getattr(self, name) for name in self.array_names})
+
+    @classmethod
+    def cached(cls, nestednessinfo: df, cache_dir=None):
+        """
+        load the index of nestedness information from cache_dir, or build it and save it there.
+
+        Parameters
+        ----------
+        nestednessinfo
+            nestedness information, the file name is given by a hash of it.
+        cache_dir
+            the directory of index files, default is CACHE_DIR/dataset_store, the same as DatasetStore.
+        """
+        if cache_dir is None:
+            from torchhydro import CACHE_DIR
+
+            cache_dir = CACHE_DIR.joinpath("dataset_store")
+        key = hashlib.sha1(
+            pd.util.hash_pandas_object(nestednessinfo[NESTEDNESS_COLUMNS].astype(str), index=True).values.tobytes()
+        ).hexdigest()
+        index_file = os.path.join(cache_dir, f"basin_graph_{key}.npz")
+        if os.path.isfile(index_file):
+            return cls.load(index_file)
+        index = cls.from_nestedness(nestednessinfo)
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, so a broken file won't be used
+        tmp_file = f"{index_file}.{os.getpid()}.tmp.npz"
+        index.save(tmp_file)
+        os.replace(tmp_file, index_file)
+        return index
+
+    def upstream_of(self, i: int) -> np.ndarray:
+        """positions of all basins nested within basin i"""
+        return self.upstream[self.upstream_offsets[i]: self.upstream_offsets[i + 1]]
+
+    def covered_by(self, positions) -> np.ndarray:
+        """whether each basin is upstream of one of the basins at positions, in one pass from outlets to upstream."""
+        selected = np.zeros(self.n_basin, dtype=bool)
+        selected[np.asarray(positions, dtype=np.int64)] = True
+        covered = np.zeros(self.n_basin, dtype=bool)
+        for i in range(1, len(self.level_offsets) - 1):
+            basins = self.topo_order[self.level_offsets[i]: self.level_offsets[i + 1]]
+            basin_ds = self.downstream[basins]
+            covered[basins] = covered[basin_ds] | selected[basin_ds]
+        return covered
+
+
+def _is_missing(basin_id):
+    return basin_id is None or pd.isna(basin_id)
+
+
 class BasinTree:
     """
     generate the basin tree through catchment nestedness information
@@ -169,6 +333,7 @@ class BasinTree:
         self,
         nestednessinfo: df = None,
         basin_id_list: list = None,
+        graph_index: BasinGraphIndex = None,
     ):
         """
         Initialize the basin tree of the whole region.
@@ -177,8 +342,13 @@ class BasinTree:
         ----------
         nestednessinfo
         basin_id_list: basins chose to forecasting.
+        graph_index: the index of the basin network built from nestednessinfo, see BasinGraphIndex.cached;
+            it is built here if not given.
         """
         # whole region
+        if graph_index is None:
+            graph_index = BasinGraphIndex.from_nestedness(nestednessinfo)
+        self.graph_index = graph_index
         self.nestedness = nestednessinfo
         self.basins = nestednessinfo.index.values
         self.n_basin = len(self.basins)
@@ -210,57 +380,29 @@ class BasinTree:
         -------
 
         """
-        self.nestedness = pd.concat([
-                self.nestedness,
-                pd.DataFrame(columns=[
-                    "type_single_river",
-                    "type_leaf",
-                    "type_limb",
-                    "type_river_tree_root",
-                    "basin_type"
-                ])],
-            axis=1,
-            sort=False
+        nes_n_nested_within = self.nestedness["nes_n_nested_within"].to_numpy()
+        nes_n_station_ds = self.nestedness["nes_n_station_ds"].to_numpy()
+        type_single_river = (nes_n_nested_within == 0) & (nes_n_station_ds == 0)
+        type_leaf = (nes_n_nested_within == 0) & (nes_n_station_ds > 0)
+        type_limb = (nes_n_nested_within > 0) & (nes_n_station_ds > 0)
+        type_river_tree_root = (nes_n_nested_within > 0) & (nes_n_station_ds == 0)
+        basin_type = np.select(
+            [type_single_river, type_leaf, type_limb, type_river_tree_root],
+            ["single_river", "leaf", "limb", "river_tree_root"],
+            default="",
         )
-
-        type_single_river = [False]*self.n_basin
-        n_single_river = 0
-        type_leaf = [False]*self.n_basin
-        n_leaf = 0
-        type_limb = [False]*self.n_basin
-        n_limb = 0
-        type_river_tree_root = [False]*self.n_basin
-        n_river_tree_root = 0
-        basin_type = [""]*self.n_basin
-
-        for i in range(self.n_basin):
-            nes_n_nested_within = self.nestedness.at[self.basins[i], "nes_n_nested_within"]
-            nes_n_station_ds = self.nestedness.at[self.basins[i], "nes_n_station_ds"]
-            if nes_n_nested_within == 0 and nes_n_station_ds == 0:
-                type_single_river[i] = True
-                n_single_river = n_single_river + 1
-                basin_type[i] = "single_river"
-            if nes_n_nested_within == 0 and nes_n_station_ds > 0:
-                type_leaf[i] = True
-                n_leaf = n_leaf + 1
-                basin_type[i] = "leaf"
-            if nes_n_nested_within > 0 and nes_n_station_ds > 0:
-                type_limb[i] = True
-                n_limb = n_limb + 1
-                basin_type[i] = "limb"
-            if nes_n_nested_within > 0 and nes_n_station_ds == 0:
-                type_river_tree_root[i] = True
-                n_river_tree_root = n_river_tree_root + 1
-                basin_type[i] = "river_tree_root"
-        self.nestedness['type_single_river'] = type_single_river
-        self.nestedness['type_leaf'] = type_leaf
-        self.nestedness['type_limb'] = type_limb
-        self.nestedness['type_river_tree_root'] = type_river_tree_root
-        self.nestedness['basin_type'] = basin_type
-        self.n_single_river = n_single_river
-        self.n_leaf = n_leaf
-        self.n_limb = n_limb
-        self.n_river_tree_root = n_river_tree_root
+        self.nestedness = self.nestedness.assign(
+            type_single_river=type_single_river,
+            type_leaf=type_leaf,
+            type_limb=type_limb,
+            type_river_tree_root=type_river_tree_root,
+            basin_type=basin_type.astype(object),
+        )
+        self.basin_type = dict(zip(self.graph_index.basin_ids.tolist(), basin_type.tolist()))
+        self.n_single_river = int(type_single_river.sum())
+        self.n_leaf = int(type_leaf.sum())
+        self.n_limb = int(type_limb.sum())
+        self.n_river_tree_root = int(type_river_tree_root.sum())
 
     def single_river(
         self,
@@ -303,14 +445,13 @@ class BasinTree:
         return basin_us, basin_ds
 
     def get_basin_type(self, basin_id: str = None):
-        basin_type = self.nestedness.at[basin_id, "basin_type"]
-        return basin_type
+        return self.basin_type[basin_id]
 
     def get_upstream_basin(self, basin_id: str = None):
-        basin_us = self.nestedness.at[basin_id, "nes_station_nested_within"]
-        if not basin_us == None:
-            basin_us = basin_us.split(",")
-        return basin_us
+        basin_us = self.graph_index.upstream_of(self.graph_index.position[basin_id])
+        if basin_us.size == 0:
+            return None
+        return self.graph_index.basin_ids[basin_us].tolist()
 
     def get_downstream_basin(self, basin_id: str = None):
         basin_ds = self.nestedness.at[basin_id, "nes_next_station_ds"]
@@ -330,75 +471,41 @@ class BasinTree:
         -------
 
         """
-        basin_us = self.get_upstream_basin(basin_id)
-        basin = [basin_id] + basin_us
+        index = self.graph_index
+        root = index.position[basin_id]
+        basin_index = np.concatenate([[root], index.upstream_of(root)]).astype(np.int64)
+        basin = index.basin_ids[basin_index].tolist()
         n_basin = len(basin)
 
+        # basin order, the number of basins from the root basin along the downstream links.
+        order = index.level[basin_index] - index.level[root] + 1
+        if (order[1:] < 2).any():
+            raise ValueError(f"The upstream basins of {basin_id} dismatch with their downstream links.")
+        max_order = int(order.max())
+
         # generate basin object, containing the basin node.
         basin_object = []
         for i in range(n_basin):
-            basin_id = basin[i]
-            basin_i = self.generate_basin_object(basin_id)
+            basin_i = self.generate_basin_object(basin[i])
+            basin_i.set_basin_order(int(order[i]))
+            basin_i.set_max_order_of_tree(max_order)
+            basin_i.refresh_cal_order()
             basin_object.append(basin_i)
 
-        # basin order
-        basin_object[0].set_basin_order(1)
-        max_order = 1
-        order = [1]*n_basin
-        for i in range(1, n_basin):
-            basin_i = basin[i]
-            order_i = 2
-            while True:
-                basin_ds = self.get_downstream_basin(basin_i)
-                if basin_ds == basin[0]:
-                    basin_object[i].set_basin_order(order_i)
-                    order[i] = order_i
-                    if order_i > max_order:
-                        max_order = order_i
-                    break
-                else:
-                    order_i = order_i + 1
-                    basin_i = basin_ds
-
         # upstream basin of directly linking to this basin.
+        position_in_tree = {j: i for i, j in enumerate(basin_index.tolist())}
         for i in range(n_basin):
-            basin_object[i].set_max_order_of_tree(max_order)
-            basin_object[i].refresh_cal_order()
-
-            basin_i = basin[i]
-            basin_ds = self.get_downstream_basin(basin_i)
-            basin_ds_index = self._get_basin_index(basin_ds, basin)
+            basin_ds_index = position_in_tree.get(int(index.downstream[basin_index[i]]), -1)
             if basin_ds_index >= 0:
                 basin_object[basin_ds_index].node_us.add_basin_us(basin[i])
                 basin_object[i].set_node_ds(basin_object[basin_ds_index].node_us)
 
-        # sort along order
-        basin_tree_ = []
-        basin_list_ = []
-        order_list = []
-        n_basin_per_order = [0]*max_order
-        order_index = list(range(n_basin))
-        for i in range(n_basin):
-            for j in range(n_basin-1-i):
-                if order[j] > order[j+1]:
-                    temp_order = order[j+1]
-                    order[j+1] = order[j]
-                    order[j] = temp_order
-                    temp_order_index = order_index[j+1]
-                    order_index[j+1] = order_index[j]
-                    order_index[j] = temp_order_index
-        k = 1
-        j = 0
-        for i in range(n_basin):
-            basin_tree_.append(basin_object[order_index[i]])
-            basin_list_.append(basin_object[order_index[i]].basin_id)
-            order_list.append(basin_object[order_index[i]].basin_order)
-            if basin_object[order_index[i]].basin_order == k:
-                n_basin_per_order[j] = n_basin_per_order[j] + 1
-            else:
-                k = basin_object[order_index[i]].basin_order
-                j = j + 1
-                n_basin_per_order[j] = n_basin_per_order[j] + 1
+        # sort along order, basins with a same order keep their order in nes_station_nested_within.
+        order_index = np.argsort(order, kind="stable").tolist()
+        basin_tree_ = [basin_object[i] for i in order_index]
+        basin_list_ = [basin[i] for i in order_index]
+        order_list = [int(order[i]) for i in order_index]
+        n_basin_per_order = np.bincount(order - 1, minlength=max_order).tolist()
 
         # group by order
         basin_tree = [[]]*max_order
@@ -492,37 +599,11 @@ class BasinTree:
             if basin_type == "river_tree_root":
                 river_tree_root.append(basin_id_list[i])
 
-        # figure out the root basin among basin_id_list
-        for i in range(len(river_tree_root)):
-            # upstream basin of river_tree_root
-            river_tree_root_us = self.get_upstream_basin(river_tree_root[i])
-            # checking whether the leafs and limbs are contained or not, if true, remove it from its list
-            leaf_in = []
-            for j in range(len(leaf)):
-                if leaf[j] in river_tree_root_us:
-                    leaf_in.append(j)
-            for j in range(len(leaf_in)):
-                del leaf[leaf_in[j]]
-            limb_in = []
-            for j in range(len(limb)):
-                if limb[j] in river_tree_root_us:
-                    limb_in.append(j)
-            for j in range(len(limb_in)):
-                del limb[limb_in[j]]
-        # checking whether a limb are contained in upstream of another limb , if true, remove it from limb list
-        while True:
-            if len(limb) <= 1:
-                break
-            i = 0
-            lim_us = self.get_upstream_basin(limb[i])
-            limb_in = []
-            for j in range(1, len(limb)):
-                if limb[j] in lim_us:
-                    limb_in.append(j)
-            if len(limb_in) == 0:
-                break
-            for j in range(len(limb_in)):
-                del limb[limb_in[j]]
+        # leafs and limbs in the upstream of another limb or river_tree_root are calculated in its tree
+        position = self.graph_index.position
+        covered = self.graph_index.covered_by([position[basin_id] for basin_id in limb + river_tree_root])
+        leaf = [basin_id for basin_id in leaf if not covered[position[basin_id]]]
+        limb = [basin_id for basin_id in limb if not covered[position[basin_id]]]
         root_basin = limb + river_tree_root
 
         # the remaining are single basin
@@ -557,9 +638,9 @@ class BasinTree:
             n_basin_per_order_i = []
             basin_tree_i, basin_list_i, basin_list__i, order_list_i, max_order_i, n_basin_per_order_i = self.basin_tree_and_order(basin_i)
             basin_trees.append(basin_tree_i)
-            basin_list = basin_list + basin_list__i  # use of dataset
+            basin_list.extend(basin_list__i)  # use of dataset
             basin_list_array.append(basin_list_i)  # use of nestednarx model
-            order_list = order_list + order_list_i[:]  #
+            order_list.extend(order_list_i)  #
             n_basin_per_order_list[i] = n_basin_per_order_i[:]
             if max_order_i > max_order:
                 max_order = max_order_i
@@ -584,8 +665,10 @@ class BasinTree:
         basin_trees.append([single_basin_object])
         basin_list = basin_list + single_basin
         basin_list_array.append([single_basin])
-        order_list = order_list + order_list_i
+        order_list = order_list + single_basin_order
         n_basin_per_order_list[-1] = [n_single_basin]
+        if n_root_basin == 0:
+            n_basin_per_order = [0]
         n_basin_per_order[0] = n_basin_per_order[0] + n_single_basin
 
         self.nested_model["basin_trees"] = basin_trees
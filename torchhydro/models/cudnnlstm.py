@@ -20,6 +20,30 @@ from torchhydro.models.ann import SimpleAnn
 from torchhydro.models.dropout import DropMask, create_mask
 
 
+def native_lstm(input, hx, cx, weight, training=False):
+    """
+    one-layer LSTM by the native kernel of nn.LSTM (oneDNN on CPU), used where cuDNN is not available
+
+    Parameters
+    ----------
+    input
+        [seq_len, batch, input_size]
+    hx, cx
+        initial states, [1, batch, hidden_size]
+    weight
+        [w_ih, w_hh, b_ih, b_hh] with gates in the order of i, f, g, o, the same as CudnnLstm and LstmCellTied;
+        dropout masks should have been applied on them
+    training
+        whether in training mode
+
+    Returns
+    -------
+    tuple
+        output, hy, cy
+    """
+    return torch._VF.lstm(input, (hx, cx), weight, True, 1, 0.0, training, False, False)
+
+
 class LstmCellTied(nn.Module):
     """
     LSTM with dropout implemented by Kuai Fang: https://github.com/mhpi/hydroDL/blob/release/hydroDL/model/rnn.py
@@ -121,7 +145,12 @@ class LstmCellTied(nn.Module):
 
 
 class CpuLstmModel(nn.Module):
-    """Cpu version of CudnnLstmModel"""
+    """
+    Cpu version of CudnnLstmModel
+
+    the weights are in LstmCellTied, with the same names as CudnnLstmModel, so checkpoints of them could be
+    loaded by each other; the sequence is calculated by native_lstm rather than LstmCellTied step by step.
+    """
 
     def __init__(self, *, n_input_features, n_output_features, n_hidden_states, dr=0.5):
         super(CpuLstmModel, self).__init__()
@@ -142,32 +171,29 @@ class CpuLstmModel(nn.Module):
         self.gpu = -1
 
     def forward(self, x, do_drop_mc=False):
-        # x0 = F.relu(self.linearIn(x))
-        # outLSTM, (hn, cn) = self.lstm(x0, do_drop_mc=do_drop_mc)
-        # out = self.linearOut(outLSTM)
-        # return out
-        nt, ngrid, nx = x.shape
-        yt = torch.zeros(ngrid, 1)
-        out = torch.zeros(nt, ngrid, self.ny)
-        ht = None
-        ct = None
-        reset_mask = True
-        for t in range(nt):
-            xt = x[t, :, :]
-            xt = torch.where(torch.isnan(xt), torch.full_like(xt, 0), xt)
-            x0 = F.relu(self.linearIn(xt))
-            ht, ct = self.lstm(x0, hidden=(ht, ct), do_reset_mask=reset_mask)
-            yt = self.linearOut(ht)
-            reset_mask = False
-            out[t, :, :] = yt
-        return out
+        x = torch.where(torch.isnan(x), torch.full_like(x, 0), x)
+        x0 = F.relu(self.linearIn(x))
+        lstm = self.lstm
+        w_ih, w_hh = lstm.w_ih, lstm.w_hh
+        if lstm.dr > 0 and (do_drop_mc is True or self.training is True):
+            # the same weight masks for all time steps, newly generated for each batch in training, as drW of LstmCellTied
+            if self.training is True or not hasattr(lstm, "mask_w_ih"):
+                lstm.mask_w_ih = create_mask(lstm.w_ih, lstm.dr)
+                lstm.mask_w_hh = create_mask(lstm.w_hh, lstm.dr)
+            w_ih = DropMask.apply(w_ih, lstm.mask_w_ih, True)
+            w_hh = DropMask.apply(w_hh, lstm.mask_w_hh, True)
+        h0 = x0.new_zeros(1, x0.shape[1], self.hiddenSize)
+        out_lstm, hn, cn = native_lstm(
+            x0, h0, h0, [w_ih, w_hh, lstm.b_ih, lstm.b_hh], self.training
+        )
+        return self.linearOut(out_lstm)
 
 
 class CudnnLstm(nn.Module):
     """
     LSTM with dropout implemented by Kuai Fang: https://github.com/mhpi/hydroDL/blob/release/hydroDL/model/rnn.py
 
-    Only run in GPU; the CPU version is LstmCellTied in this file
+    cuDNN is used in GPU; in CPU, the same weights with the same dropout masks are given to native_lstm
     """
 
     def __init__(self, *, input_size, hidden_size, dr=0.5):
@@ -274,7 +300,9 @@ class CudnnLstm(nn.Module):
             ]
         else:
             weight = [self.w_ih, self.w_hh, self.b_ih, self.b_hh]
-        if torch.__version__ < "1.8":
+        if not input.is_cuda:
+            output, hy, cy = native_lstm(input, hx, cx, weight, self.training)
+        elif torch.__version__ < "1.8":
             output, hy, cy, reserve, new_weight_buf = torch._cudnn_rnn(
                 input,
                 weight,
@@ -328,7 +356,7 @@ class CudnnLstmModel(nn.Module):
         """
         An LSTM model writen by Kuai Fang from this paper: https://doi.org/10.1002/2017GL075619
 
-        only gpu version
+        cuDNN is used in GPU, and the native kernel of nn.LSTM in CPU, see CudnnLstm
 
         Parameters
         ----------
@@ -0,0 +1,86 @@
+"""NaN checks of dPL models which could be deferred to the end of a forward pass"""
+
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import torch
+from torch import Tensor
+
+# checks which are deferred to the end of a forward pass, see deferred_nan_check
+_DEFERRED_CHECKS = ContextVar("deferred_checks", default=None)
+
+
+def raise_if(condition: Tensor, error: Exception):
+    """
+    Raise an error if a check (such as torch.isnan(x).any()) is True
+
+    Reading the check needs a sync between the host and the device; in a deferred_nan_check context,
+    the check is only recorded on the device and reported at the end of the context.
+
+    Parameters
+    ----------
+    condition
+        a bool tensor with one element
+    error
+        the error raised when condition is True
+    """
+    deferred_checks = _DEFERRED_CHECKS.get()
+    if deferred_checks is None:
+        if condition:
+            raise error
+    else:
+        deferred_checks.append((condition, error))
+
+
+def is_deferred() -> bool:
+    """whether NaN checks are deferred now, i.e. in a deferred_nan_check context"""
+    return _DEFERRED_CHECKS.get() is not None
+
+
+@contextmanager
+def deferred_nan_check(report: bool = True):
+    """
+    A context where the NaN checks of dPL helpers are deferred, which is the "fast" mode of dPL models
+
+    The checks in time loops, such as in calculate_prcp_runoff, stall the loop each period for reading
+    the check from the device. In this context, all checks are kept on the device and read once at the
+    end of the context, and the error of the first failed check is raised then.
+
+    Values are not masked on the device: as any failed check raises its error at the end, the outputs
+    of a forward pass with NaN are never used.
+
+    Parameters
+    ----------
+    report
+        if False, the checks are dropped at the end rather than read, e.g. when time chunks are
+        calculated again in the backward pass, whose checks have been reported in the forward pass
+    """
+    if _DEFERRED_CHECKS.get() is not None:
+        # nested contexts are reported by the outermost one
+        yield
+        return
+    deferred_checks = []
+    token = _DEFERRED_CHECKS.set(deferred_checks)
+    try:
+        yield
+    finally:
+        _DEFERRED_CHECKS.reset(token)
+    if report and deferred_checks:
+        conditions = torch.stack([condition for condition, _ in deferred_checks])
+        failed = torch.nonzero(conditions).flatten().tolist()
+        if failed:
+            raise deferred_checks[failed[0]][1]
+
+
+def fast_mode_forward(forward):
+    """Run the forward method of a dPL model in deferred_nan_check when its fast_mode is True"""
+
+    @functools.wraps(forward)
+    def wrapper(self, *args, **kwargs):
+        if not self.fast_mode:
+            return forward(self, *args, **kwargs)
+        with deferred_nan_check():
+            return forward(self, *args, **kwargs)
+
+    return wrapper
@@ -2,6 +2,7 @@
 Simulates streamflow over time using the model logic from GR4J as implemented in PyTorch.
 This function can be used to offer up the functionality of GR4J with added gradient information.
 """
+import math
 from typing import Tuple, Optional, Union
 
 import torch
@@ -11,8 +12,11 @@ from torch.nn import functional as F
 
 from torchhydro.models.simple_lstm import SimpleLSTM # type: ignore
 from torchhydro.models.ann import SimpleAnn
+from torchhydro.models.deferred_check import fast_mode_forward
 from torchhydro.models.dpl4xaj import ann_pbm, lstm_pbm
 from torchhydro.models.kernel_conv import uh_conv
+from torchhydro.models.time_checkpoint import run_time_loop
+from torchhydro.models.warmup_cache import make_warmup_cache
 
 
 def calculate_precip_store(s, precip_net, x1):
@@ -97,68 +101,69 @@ def production(
     return current_runoff, s_update
 
 
-def uh_gr4j(x4):
+def uh_gr4j(x4, max_x4: Optional[float] = None):
     """
-    Generate the convolution kernel for the convolution operation in routing module of GR4J
+    Generate the convolution kernels for the convolution operation in routing module of GR4J
+
+    The UH1 of a basin has ceil(x4) ordinates and its UH2 has ceil(2x4) ordinates, so the kernels
+    of all basins are ragged; we put them in one tensor and set the ordinates beyond each basin's
+    length to 0, then all basins could be convolved in one call without any per-basin loop.
 
     Parameters
     ----------
     x4
         the dim of x4 is [batch]
+    max_x4
+        the upper bound of x4 (such as the upper limit of its scale), used to decide the length of
+        kernels without reading x4 back from the device; by default, the max value of x4 is used
 
     Returns
     -------
-    list
-        UH1s and UH2s for all basins
+    tuple
+        UH1s and UH2s for all basins, the dims are [ceil(max_x4), batch, 1] and [ceil(2max_x4), batch, 1]
     """
-    gr4j_device = x4.device
-    uh1_ordinates = []
-    uh2_ordinates = []
-    for i in range(len(x4)):
-        # for SH1, the pieces are: 0, 0<t<x4, t>=x4
-        uh1_ordinates_t1 = torch.arange(
-            0.0, torch.ceil(x4[i]).detach().cpu().numpy().item()
-        ).to(gr4j_device)
-        uh1_ordinates_t = torch.arange(
-            1.0, torch.ceil(x4[i] + 1.0).detach().cpu().numpy().item()
-        ).to(gr4j_device)
-        # for SH2, the pieces are: 0, 0<t<=x4, x4<t<2x4, t>=2x4
-        uh2_ords_t1_seq_x4 = torch.arange(
-            0.0, torch.floor(x4[i] + 1).detach().cpu().numpy().item()
-        ).to(gr4j_device)
-        uh2_ords_t1_larger_x4 = torch.arange(
-            torch.floor(x4[i] + 1).detach().cpu().numpy().item(),
-            torch.ceil(2 * x4[i]).detach().cpu().numpy().item(),
-        ).to(gr4j_device)
-        uh2_ords_t_seq_x4 = torch.arange(
-            1.0, torch.floor(x4[i] + 1).detach().cpu().numpy().item()
-        ).to(gr4j_device)
-        uh2_ords_t_larger_x4 = torch.arange(
-            torch.floor(x4[i] + 1).detach().cpu().numpy().item(),
-            torch.ceil(2 * x4[i] + 1.0).detach().cpu().numpy().item(),
-        ).to(gr4j_device)
-        s_curve1t1 = (uh1_ordinates_t1 / x4[i]) ** 2.5
-        s_curve21t1 = 0.5 * (uh2_ords_t1_seq_x4 / x4[i]) ** 2.5
-        s_curve22t1 = 1.0 - 0.5 * (2 - uh2_ords_t1_larger_x4 / x4[i]) ** 2.5
-        s_curve2t1 = torch.cat([s_curve21t1, s_curve22t1])
-        # t1 cannot be larger than x4, but t can, so we should set (uh1_ordinates_t / x4[i]) <=1
-        # we don't use torch.clamp, because it seems we have to use mask, or we will get nan for grad. More details
-        # could be seen here: https://github.com/waterDLut/hydro-dl-basic/tree/dev/3-more-knowledge/5-grad-problem.ipynb
-        uh1_x4 = uh1_ordinates_t / x4[i]
-        limit_uh1_x4 = 1 - F.relu(1 - uh1_x4)
-        limit_uh2_smaller_x4 = uh2_ords_t_seq_x4 / x4[i]
-        uh2_larger_x4 = 2 - uh2_ords_t_larger_x4 / x4[i]
-        limit_uh2_larger_x4 = F.relu(uh2_larger_x4)
-        s_curve1t = limit_uh1_x4 ** 2.5
-        s_curve21t = 0.5 * limit_uh2_smaller_x4 ** 2.5
-        s_curve22t = 1.0 - 0.5 * limit_uh2_larger_x4 ** 2.5
-        s_curve2t = torch.cat([s_curve21t, s_curve22t])
-        uh1_ordinate = s_curve1t - s_curve1t1
-        uh2_ordinate = s_curve2t - s_curve2t1
-        uh1_ordinates.append(uh1_ordinate)
-        uh2_ordinates.append(uh2_ordinate)
-
-    return uh1_ordinates, uh2_ordinates
+    if max_x4 is None:
+        max_x4 = x4.detach().max().item()
+    len_uh1 = max(math.ceil(max_x4), 1)
+    len_uh2 = max(math.ceil(2 * max_x4), 1)
+    # t is the end and t1 = t - 1 is the beginning of each period; the dims are [len_uh, batch]
+    uh1_ordinates_t = torch.arange(
+        1.0, len_uh1 + 1.0, dtype=x4.dtype, device=x4.device
+    ).unsqueeze(1)
+    uh2_ordinates_t = torch.arange(
+        1.0, len_uh2 + 1.0, dtype=x4.dtype, device=x4.device
+    ).unsqueeze(1)
+    uh1_ordinates_t1 = uh1_ordinates_t - 1.0
+    uh2_ordinates_t1 = uh2_ordinates_t - 1.0
+    # a basin has ordinates whose beginning is smaller than x4 for UH1 and 2x4 for UH2
+    uh1_mask = uh1_ordinates_t1 < x4
+    uh2_mask = uh2_ordinates_t1 < 2 * x4
+    # for SH1, the pieces are: 0, 0<t<x4, t>=x4
+    # t1 cannot be larger than x4 in valid ordinates, but t can, so we should set (uh1_ordinates_t / x4) <=1
+    # we don't use torch.clamp, because it seems we have to use mask, or we will get nan for grad. More details
+    # could be seen here: https://github.com/waterDLut/hydro-dl-basic/tree/dev/3-more-knowledge/5-grad-problem.ipynb
+    s_curve1t1 = (uh1_ordinates_t1 / x4) ** 2.5
+    s_curve1t = (1 - F.relu(1 - uh1_ordinates_t / x4)) ** 2.5
+    # for SH2, the pieces are: 0, 0<t<=x4, x4<t<2x4, t>=2x4;
+    # for an integer t, t<=x4 is same as t<floor(x4+1) which is used to split the ordinates of a basin.
+    # relu is also used for t1 as the masked ordinates may have t1>2x4, which would give nan for grad
+    s_curve2t1 = torch.where(
+        uh2_ordinates_t1 <= x4,
+        0.5 * (uh2_ordinates_t1 / x4) ** 2.5,
+        1.0 - 0.5 * F.relu(2 - uh2_ordinates_t1 / x4) ** 2.5,
+    )
+    s_curve2t = torch.where(
+        uh2_ordinates_t <= x4,
+        0.5 * (uh2_ordinates_t / x4) ** 2.5,
+        1.0 - 0.5 * F.relu(2 - uh2_ordinates_t / x4) ** 2.5,
+    )
+    uh1_ordinates = torch.where(
+        uh1_mask, s_curve1t - s_curve1t1, torch.zeros_like(s_curve1t)
+    )
+    uh2_ordinates = torch.where(
+        uh2_mask, s_curve2t - s_curve2t1, torch.zeros_like(s_curve2t)
+    )
+    return uh1_ordinates.unsqueeze(2), uh2_ordinates.unsqueeze(2)
 
 
 def routing(q9: Tensor, q1: Tensor, x2, x3, r_level: Optional[Tensor] = None):
@@ -207,12 +212,14 @@ class Gr4j4Dpl(nn.Module):
     the nn.Module style GR4J model
     """
 
-    def __init__(self, warmup_length: int):
+    def __init__(self, warmup_length: int, time_chunk: Optional[int] = None):
         """
         Parameters
         ----------
         warmup_length
             length of warmup period
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods, see run_time_loop
         """
         super(Gr4j4Dpl, self).__init__()
         self.params_names = ["X1", "X2", "X3", "X4"]
@@ -221,7 +228,10 @@ class Gr4j4Dpl(nn.Module):
         self.x3_scale = [20.0, 300.0]
         self.x4_scale = [1.1, 2.9]
         self.warmup_length = warmup_length
+        self.time_chunk = time_chunk
         self.feature_size = 2
+        # a WarmupStateCache could be set to reuse initial states of warmup periods
+        self.warmup_cache = None
 
     def forward(self, p_and_e, parameters, return_state=False):
         gr4j_device = p_and_e.device
@@ -234,41 +244,43 @@ class Gr4j4Dpl(nn.Module):
         if warmup_length > 0:
             # set no_grad for warmup periods
             with torch.no_grad():
-                p_and_e_warmup = p_and_e[0:warmup_length, :, :]
-                cal_init = Gr4j4Dpl(0)
-                if cal_init.warmup_length > 0:
-                    raise RuntimeError("Please set init model's warmup length to 0!!!")
-                _, s0, r0 = cal_init(p_and_e_warmup, parameters, return_state=True)
+
+                def run_warmup():
+                    p_and_e_warmup = p_and_e[0:warmup_length, :, :]
+                    cal_init = Gr4j4Dpl(0)
+                    if cal_init.warmup_length > 0:
+                        raise RuntimeError("Please set init model's warmup length to 0!!!")
+                    return cal_init(p_and_e_warmup, parameters, return_state=True)[1:]
+
+                if self.warmup_cache is None:
+                    s0, r0 = run_warmup()
+                else:
+                    s0, r0 = self.warmup_cache.warmup(parameters, run_warmup)
         else:
             # use detach func to make wu0 no_grad as it is an initial value
             s0 = 0.5 * x1.detach()
             r0 = 0.5 * x3.detach()
         inputs = p_and_e[warmup_length:, :, :]
-        streamflow_ = torch.full(inputs.shape[:2], 0.0).to(gr4j_device)
-        prs = torch.full(inputs.shape[:2], 0.0).to(gr4j_device)
-        for i in range(inputs.shape[0]):
-            if i == 0:
-                pr, s = production(inputs[i, :, :], x1, s0)
-            else:
-                pr, s = production(inputs[i, :, :], x1, s)
-            prs[i, :] = pr
+
+        def production_period(i, states):
+            pr, s = production(inputs[i, :, :], x1, states[0])
+            return (pr,), (s,)
+
+        (prs,), (s,) = run_time_loop(
+            production_period, inputs.shape[0], (s0,), self.time_chunk
+        )
         prs_x = torch.unsqueeze(prs, dim=2)
-        conv_q9, conv_q1 = uh_gr4j(x4)
-        q9 = torch.full([inputs.shape[0], inputs.shape[1], 1], 0.0).to(gr4j_device)
-        q1 = torch.full([inputs.shape[0], inputs.shape[1], 1], 0.0).to(gr4j_device)
-        for j in range(inputs.shape[1]):
-            q9[:, j : j + 1, :] = uh_conv(
-                prs_x[:, j : j + 1, :], conv_q9[j].reshape(-1, 1, 1)
-            )
-            q1[:, j : j + 1, :] = uh_conv(
-                prs_x[:, j : j + 1, :], conv_q1[j].reshape(-1, 1, 1)
-            )
-        for i in range(inputs.shape[0]):
-            if i == 0:
-                q, r = routing(q9[i, :, 0], q1[i, :, 0], x2, x3, r0)
-            else:
-                q, r = routing(q9[i, :, 0], q1[i, :, 0], x2, x3, r)
-            streamflow_[i, :] = q
+        conv_q9, conv_q1 = uh_gr4j(x4, self.x4_scale[1])
+        q9 = uh_conv(prs_x, conv_q9)
+        q1 = uh_conv(prs_x, conv_q1)
+
+        def routing_period(i, states):
+            q, r = routing(q9[i, :, 0], q1[i, :, 0], x2, x3, states[0])
+            return (q,), (r,)
+
+        (streamflow_,), (r,) = run_time_loop(
+            routing_period, inputs.shape[0], (r0,), self.time_chunk
+        )
         streamflow = torch.unsqueeze(streamflow_, dim=2)
         if return_state:
             return streamflow, s, r
@@ -284,6 +296,9 @@ class DplLstmGr4j(nn.Module):
         warmup_length,
         param_limit_func="sigmoid",
         param_test_way="final",
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model: LSTM -> Param -> Gr4j
@@ -309,15 +324,27 @@ class DplLstmGr4j(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplLstmGr4j, self).__init__()
         self.dl_model = SimpleLSTM(
             n_input_features, n_output_features, n_hidden_states
         )
-        self.pb_model = Gr4j4Dpl(warmup_length)
+        self.pb_model = Gr4j4Dpl(warmup_length, time_chunk=time_chunk)
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -350,6 +377,10 @@ class DplAnnGr4j(nn.Module):
         warmup_length: int,
         param_limit_func="sigmoid",
         param_test_way="final",
+        param_dedup=False,
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model only with attributes as DL model's input: ANN -> Param -> Gr4j
@@ -375,13 +406,30 @@ class DplAnnGr4j(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        param_dedup
+            if True, the ANN is run only once for each unique input in a batch, such as repeated
+            attributes of windows from the same basin; it is off in training when the ANN
+            has dropout, as each window draws its own dropout mask; by default False
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplAnnGr4j, self).__init__()
         self.dl_model = SimpleAnn(n_input_features, n_output_features, n_hidden_states)
-        self.pb_model = Gr4j4Dpl(warmup_length)
+        self.pb_model = Gr4j4Dpl(warmup_length, time_chunk=time_chunk)
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
+        self.param_dedup = param_dedup
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -401,5 +449,12 @@ class DplAnnGr4j(nn.Module):
         torch.Tensor
             one time forward result
         """
-        q = ann_pbm(self.dl_model, self.pb_model, self.param_func, x, z)
+        q = ann_pbm(
+            self.dl_model,
+            self.pb_model,
+            self.param_func,
+            x,
+            z,
+            self.param_dedup,
+        )
         return q
@@ -1,17 +1,19 @@
 from typing import Union
 
 import torch
-import numpy as np
 from torch import nn
 
 from torchhydro.models.ann import SimpleAnn
+from torchhydro.models.deferred_check import fast_mode_forward
 from torchhydro.models.dpl4xaj import ann_pbm, lstm_pbm, SimpleLSTM
-from torchhydro.models.kernel_conv import uh_conv, uh_gamma
+from torchhydro.models.kernel_conv import linear_recursion, uh_conv, uh_gamma
+from torchhydro.models.time_checkpoint import run_time_loop
+from torchhydro.models.warmup_cache import make_warmup_cache
 
 class Hbv4Dpl(torch.nn.Module):
     """HBV Model Pytorch version"""
 
-    def __init__(self, warmup_length, kernel_size=15):
+    def __init__(self, warmup_length, kernel_size=15, log_state=False, time_chunk=None):
         """Initiate a HBV instance
 
         Parameters
@@ -20,6 +22,11 @@ class Hbv4Dpl(torch.nn.Module):
             _description_
         kernel_size : int, optional
             conv kernel for unit hydrograph, by default 15
+        log_state : bool, optional
+            if True, the soil states of all periods are recorded in self.state_trace when running the model,
+            which is used for displaying; by default False, so that nothing is recorded during training
+        time_chunk : int, optional
+            if given, gradient checkpointing is used for every time_chunk periods, see run_time_loop
         """
         super(Hbv4Dpl, self).__init__()
         self.name = "HBV"
@@ -41,6 +48,12 @@ class Hbv4Dpl(torch.nn.Module):
         ]
         self.warmup_length = warmup_length
         self.kernel_size = kernel_size
+        self.log_state = log_state
+        self.time_chunk = time_chunk
+        # a dict of the soil states of the last run, each of which is a [time, basin] tensor; see forward
+        self.state_trace = None
+        # a WarmupStateCache could be set to reuse initial states of warmup periods
+        self.warmup_cache = None
         # there are 3 input vars in HBV: P, PET and TEMPERATURE
         self.feature_size = 3
 
@@ -87,6 +100,9 @@ class Hbv4Dpl(torch.nn.Module):
             slz = lower zone storage (mm)
             snowpack = snow depth (mm)
             et_act = actual evaporation (mm)
+            when self.log_state is True, the traces of soil states are also recorded in self.state_trace:
+            "sm" is soil storage (mm) before the soil routine, "ps" is rain and meltwater to soil (mm),
+            "swet" is the ratio of soil storage to FC and "re" is recharge (mm)
         """
         hbv_device = x.device
         precision = 1e-5
@@ -94,16 +110,25 @@ class Hbv4Dpl(torch.nn.Module):
         # Initialization
         if buffer_time > 0:
             with torch.no_grad():
-                x_init = x[0:buffer_time, :, :]
-                warmup_length = 0
-                init_model = Hbv4Dpl(warmup_length)
-                if init_model.warmup_length > 0:
-                    raise RuntimeError(
-                        "Please set warmup_length as 0 when initializing HBV model"
+
+                def run_warmup():
+                    x_init = x[0:buffer_time, :, :]
+                    warmup_length = 0
+                    init_model = Hbv4Dpl(warmup_length)
+                    if init_model.warmup_length > 0:
+                        raise RuntimeError(
+                            "Please set warmup_length as 0 when initializing HBV model"
+                        )
+                    return init_model(
+                        x_init, parameters, out_state=True, rout_opt=False
+                    )[1:]
+
+                if self.warmup_cache is None:
+                    snowpack, meltwater, sm, suz, slz = run_warmup()
+                else:
+                    snowpack, meltwater, sm, suz, slz = self.warmup_cache.warmup(
+                        parameters, run_warmup
                     )
-                _, snowpack, meltwater, sm, suz, slz = init_model(
-                    x_init, parameters, out_state=True, rout_opt=False
-                )
         else:
 
             # Without buff time, initialize state variables with zeros
@@ -184,16 +209,8 @@ class Hbv4Dpl(torch.nn.Module):
         # Apply correction factor to precipitation
         # p_all = parPCORR.repeat(n_step, 1) * p_all
 
-        # Initialize time series of model variables
-        q_sim = (torch.zeros(p_all.size(), dtype=torch.float32) + 0.001).to(hbv_device)
-        # # Debug for the state variables
-        # SMlog = np.zeros(p_all.size())
-        log_sm = np.zeros(p_all.size())
-        log_ps = np.zeros(p_all.size())
-        log_swet = np.zeros(p_all.size())
-        log_re = np.zeros(p_all.size())
-
-        for i in range(n_step):
+        def hbv_period(i, states):
+            snowpack, meltwater, sm, suz = states
             # Separate precipitation into liquid and solid components
             precip = p_all[i, :]
             tempre = t_all[i, :]
@@ -230,11 +247,16 @@ class Hbv4Dpl(torch.nn.Module):
             soil_wetness = torch.clamp(soil_wetness, min=0.0, max=1.0)
             recharge = (rain + to_soil) * soil_wetness
 
-            # log for displaying
-            log_sm[i, :] = sm.detach().cpu().numpy()
-            log_ps[i, :] = (rain + to_soil).detach().cpu().numpy()
-            log_swet[i, :] = (sm / par_fc).detach().cpu().numpy()
-            log_re[i, :] = recharge.detach().cpu().numpy()
+            if self.log_state:
+                # log for displaying; the logs are kept on the device, so there is no sync in the loop
+                logs = (
+                    sm.detach(),
+                    (rain + to_soil).detach(),
+                    (sm / par_fc).detach(),
+                    recharge.detach(),
+                )
+            else:
+                logs = ()
 
             sm = sm + rain + to_soil - recharge
             excess = sm - par_fc
@@ -259,13 +281,19 @@ class Hbv4Dpl(torch.nn.Module):
             suz = suz - q0
             q1 = par_k1 * suz
             suz = suz - q1
-            slz = slz + perc
-            q2 = par_k2 * slz
-            slz = slz - q2
-            q_sim[i, :] = q0 + q1 + q2
+            return (q0 + q1, perc, *logs), (snowpack, meltwater, sm, suz)
 
-            # # for debug state variables
-            # SMlog[t,:] = sm.detach().cpu().numpy()
+        (q_sim, percs, *logs), (snowpack, meltwater, sm, suz) = run_time_loop(
+            hbv_period, n_step, (snowpack, meltwater, sm, suz), self.time_chunk
+        )
+        # the lower zone is a linear reservoir only fed by percolation, so it is
+        # calculated for all periods at once: slz[t] = (1 - k2) * (slz[t-1] + perc[t])
+        slzs = linear_recursion(1 - par_k2, (1 - par_k2) * percs, slz)
+        slzs_before_release = torch.cat([slz.unsqueeze(0), slzs[:-1]]) + percs
+        q_sim = q_sim + par_k2 * slzs_before_release
+        slz = slzs[-1]
+        if self.log_state:
+            self.state_trace = dict(zip(["sm", "ps", "swet", "re"], logs))
 
         if rout_opt is True:  # routing
             temp_a = parasca_lst[-2][0] + parameters[:, -2] * (
@@ -294,6 +322,10 @@ class DplLstmHbv(nn.Module):
         warmup_length,
         param_limit_func="sigmoid",
         param_test_way="final",
+        log_state=False,
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model: LSTM -> Param -> XAJ
@@ -318,15 +350,31 @@ class DplLstmHbv(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        log_state
+            if True, the soil states are recorded in self.pb_model.state_trace, by default False
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplLstmHbv, self).__init__()
         self.dl_model = SimpleLSTM(
             n_input_features, n_output_features, n_hidden_states
         )
-        self.pb_model = Hbv4Dpl(warmup_length)
+        self.pb_model = Hbv4Dpl(
+            warmup_length, log_state=log_state, time_chunk=time_chunk
+        )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -358,6 +406,11 @@ class DplAnnHbv(nn.Module):
         warmup_length: int,
         param_limit_func="sigmoid",
         param_test_way="final",
+        log_state=False,
+        param_dedup=False,
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model only with attributes as DL model's input: ANN -> Param -> Gr4j
@@ -383,13 +436,34 @@ class DplAnnHbv(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        param_dedup
+            if True, the ANN is run only once for each unique input in a batch, such as repeated
+            attributes of windows from the same basin; it is off in training when the ANN
+            has dropout, as each window draws its own dropout mask; by default False
+        log_state
+            if True, the soil states are recorded in self.pb_model.state_trace, by default False
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplAnnHbv, self).__init__()
         self.dl_model = SimpleAnn(n_input_features, n_output_features, n_hidden_states)
-        self.pb_model = Hbv4Dpl(warmup_length)
+        self.pb_model = Hbv4Dpl(
+            warmup_length, log_state=log_state, time_chunk=time_chunk
+        )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
+        self.param_dedup = param_dedup
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -409,4 +483,11 @@ class DplAnnHbv(nn.Module):
         torch.Tensor
             one time forward result
         """
-        return ann_pbm(self.dl_model, self.pb_model, self.param_func, x, z)
+        return ann_pbm(
+            self.dl_model,
+            self.pb_model,
+            self.param_func,
+            x,
+            z,
+            self.param_dedup,
+        )
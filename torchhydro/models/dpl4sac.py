@@ -3,7 +3,6 @@ Author: https://gitea.com/shouz
 LastEditors:
 """
 
-import numpy as np
 import torch
 from torch import nn
 from torch import Tensor
@@ -11,6 +10,66 @@ from torch.nn import functional as F
 from torchhydro.configs.model_config import MODEL_PARAM_DICT, MODEL_PARAM_TEST_WAY
 from torchhydro.models.simple_lstm import SimpleLSTM
 from torchhydro.models.ann import SimpleAnn
+from torchhydro.models.deferred_check import fast_mode_forward, raise_if
+from torchhydro.models.dpl4xaj import dedup_ann_forward
+from torchhydro.models.kernel_conv import linear_recursion
+from torchhydro.models.time_checkpoint import run_time_loop
+from torchhydro.models.warmup_cache import make_warmup_cache
+
+
+def muskingum_routing(inflow, inflow0, ke, xe, mq, rivernumber, dt):
+    """
+    Muskingum routing through the river sections of all basins
+
+    The outflow of a river section is a first-order linear recursion in time, so each section is routed
+    for all time steps and basins at once, and the sections are routed one by one from upstream to
+    downstream. Basins may have different numbers of river sections: the mq of basins with fewer
+    sections is padded, and the padded sections just pass their inflow through.
+
+    Parameters
+    ----------
+    inflow
+        the inflow of the most upstream section, time|basin
+    inflow0
+        the inflow at the start of the first time step, basin
+    ke
+        the confluence duration in riverway, hourly, basin
+    xe
+        the flow weight coefficient of riverway confluence, basin
+    mq
+        the outflow of each river section at the start of the first time step, basin|rivernumber
+    rivernumber
+        the number of river sections of each basin, basin
+    dt
+        half of the time step, hour
+
+    Returns
+    -------
+    tuple
+        the outflow of the most downstream section (time|basin) and
+        the outflow of each river section at the end of the last time step (basin|rivernumber)
+    """
+    ko = ke * 24.0 / torch.clamp(rivernumber, min=1)  # KE is hourly coefficient, need convert to daily.
+    c1 = torch.clamp(ko * (1.0 - xe) + dt, min=0.0)
+    c2 = torch.clamp((-ko * xe + dt) / c1, min=0.0)
+    c3 = torch.clamp((ko * (1.0 - xe) - dt) / c1, min=0.0)
+    c1_ = (ko * xe + dt) / c1
+    outflow = inflow
+    outflow0 = inflow0
+    mq_ = []
+    for k in range(mq.shape[1]):
+        routed = rivernumber > k
+        # the inflow of this section at the start of each time step
+        inflow_start = torch.cat([outflow0.unsqueeze(0), outflow[:-1]])
+        outflow0 = torch.where(routed, mq[:, k], outflow0)
+        outflow = linear_recursion(
+            torch.where(routed, c3, torch.zeros_like(c3)),
+            torch.where(routed, c1_, torch.zeros_like(c1_)) * inflow_start
+            + torch.where(routed, c2, torch.ones_like(c2)) * outflow,
+            mq[:, k],
+        )
+        mq_.append(outflow[-1])
+    return outflow, torch.stack(mq_, dim=1)
 
 
 class Sac4Dpl(nn.Module):
@@ -21,6 +80,7 @@ class Sac4Dpl(nn.Module):
         self,
         warmup_length: int,
         source_book="HF",
+        time_chunk=None,
     ):
         """
         Initiate a Sacramento model instance.
@@ -29,6 +89,8 @@ class Sac4Dpl(nn.Module):
         warmup_length
             the length of warmup periods
             sac needs a warmup period to generate reasonable initial state values
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods, see run_time_loop
         """
         super(Sac4Dpl, self).__init__()
         self.name = "Sacramento"
@@ -60,6 +122,9 @@ class Sac4Dpl(nn.Module):
         self.feature_size = 2  # there are 2 input variables in Sac, P and PET.
         self.hydrodt = 1  # one day
         self.source_book = source_book
+        self.time_chunk = time_chunk
+        # a WarmupStateCache could be set to reuse initial states of warmup periods
+        self.warmup_cache = None
 
     def forward(
         self,
@@ -107,21 +172,29 @@ class Sac4Dpl(nn.Module):
         n_basin, n_para = parameters.size()
 
         rsnpb = 1  # river sections number per basin
-        rivernumber = np.full(n_basin, rsnpb)  # set only one river section.   basin|river_section
-        mq = torch.full((n_basin, rsnpb),0.0).detach()  # Muskingum routing space   basin|rivernumber   note: the column number of mp must equle to the column number of rivernumber
+        rivernumber = torch.full((n_basin,), rsnpb, device=sac_device)  # set only one river section.   basin|river_section
+        mq = torch.full((n_basin, rsnpb), 0.0, device=sac_device)  # Muskingum routing space   basin|rivernumber   note: the column number of mp must equle to the column number of rivernumber
         if self.warmup_length > 0:  # if warmup_length>0, use warmup to calculate initial state.
             # set no_grad for warmup periods
             with torch.no_grad():
-                p_and_e_warmup = p_and_e[0:self.warmup_length, :, :]  # time|basin|p_and_e
-                cal_init_sac4dpl = Sac4Dpl(
-                    # warmup_length must be 0 here
-                    warmup_length=0,
-                )
-                if cal_init_sac4dpl.warmup_length > 0:
-                    raise RuntimeError("Please set init model's warmup length to 0!!!")
-                _, _, auztw, alztw, uztw, uzfw, lztw, lzfs, lzfp, qs, qi, qgs, qgp, mq = cal_init_sac4dpl(  # note: parameter should be the parameters before de-normalizing.
-                    p_and_e_warmup, parameters, return_state=True
-                )
+
+                def run_warmup():
+                    p_and_e_warmup = p_and_e[0:self.warmup_length, :, :]  # time|basin|p_and_e
+                    cal_init_sac4dpl = Sac4Dpl(
+                        # warmup_length must be 0 here
+                        warmup_length=0,
+                    )
+                    if cal_init_sac4dpl.warmup_length > 0:
+                        raise RuntimeError("Please set init model's warmup length to 0!!!")
+                    return cal_init_sac4dpl(  # note: parameter should be the parameters before de-normalizing.
+                        p_and_e_warmup, parameters, return_state=True
+                    )[2:]
+
+                if self.warmup_cache is None:
+                    states = run_warmup()
+                else:
+                    states = self.warmup_cache.warmup(parameters, run_warmup)
+                auztw, alztw, uztw, uzfw, lztw, lzfs, lzfp, qs, qi, qgs, qgp, mq = states
         else:  # if no, set a small value directly.
             auztw = (torch.zeros(n_basin, dtype=torch.float32) + 0.01).to(sac_device)
             alztw = (torch.zeros(n_basin, dtype=torch.float32) + 0.01).to(sac_device)
@@ -138,7 +211,7 @@ class Sac4Dpl(nn.Module):
             qi = (torch.zeros(n_basin, dtype=torch.float32) + 0.01).to(sac_device)
             qgs = (torch.zeros(n_basin, dtype=torch.float32) + 0.01).to(sac_device)
             qgp = (torch.zeros(n_basin, dtype=torch.float32) + 0.01).to(sac_device)
-            mq = torch.full((n_basin, rsnpb), 0.01).detach()
+            mq = torch.full((n_basin, rsnpb), 0.01, device=sac_device)
 
         # parameters
         kc = self.kc_scale[0] + parameters[:, 0] * (self.kc_scale[1] - self.kc_scale[0])
@@ -166,17 +239,9 @@ class Sac4Dpl(nn.Module):
         prcp = p_and_e[self.warmup_length:, :, 0]  # time|basin
         pet = p_and_e[self.warmup_length:, :, 1]  # time|basin
         n_step, n_basin = prcp.size()
-        e_sim_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        q_sim_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        roimp_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        adsur_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        ars_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        rs_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        ri_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        rgs_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
-        rgp_ = torch.full((n_step, n_basin), 0.0).to(sac_device)
         # generate runoff
-        for i in range(n_step):  # https://zhuanlan.zhihu.com/p/490501696
+        def generate_runoff(i, states):  # https://zhuanlan.zhihu.com/p/490501696
+            auztw, alztw, uztw, uzfw, lztw, lzfs, lzfp = states
             p = torch.clamp(prcp[i, :], min=0.0)
             e = torch.nan_to_num(pet[i, :], nan=0.0, posinf=0.0, neginf=0.0)
             e = torch.clamp(e, min=0.0)
@@ -266,19 +331,37 @@ class Sac4Dpl(nn.Module):
             lzfp = torch.where(ltr < ratio, lp - torch.clamp((lztw - lt2) - ls, min=0.0), lp2)
 
             # save
-            e_sim_[i] = et
-            roimp_[i] = roimp
-            adsur_[i] = adsur_adimp
-            ars_[i] = ars_adimp
-            rs_[i] = rs
-            ri_[i] = ri
-            rgs_[i] = rgs
-            rgp_[i] = rgp
+            return (et, roimp, adsur_adimp, ars_adimp, rs, ri, rgs, rgp), (
+                auztw,
+                alztw,
+                uztw,
+                uzfw,
+                lztw,
+                lzfs,
+                lzfp,
+            )
+
+        (e_sim_, roimp_, adsur_, ars_, rs_, ri_, rgs_, rgp_), (
+            auztw,
+            alztw,
+            uztw,
+            uzfw,
+            lztw,
+            lzfs,
+            lzfp,
+        ) = run_time_loop(
+            generate_runoff,
+            n_step,
+            (auztw, alztw, uztw, uzfw, lztw, lzfs, lzfp),
+            self.time_chunk,
+        )
 
         # routing
-        u = parea * 1000  # daily coefficient, no need conversion.
-        for i in range(n_step):
-            q_sim_0 = (qs + qi + qgs + qgp).detach()
+        u = (1 - pctim - adimp) * 1000  # daily coefficient, no need conversion.
+        q_sim_0 = qs + qi + qgs + qgp
+
+        def slope_routing(i, states):
+            qs, qi, qgs, qgp = states
             # routing
             parea = 1 - pctim - adimp
             parea = torch.clamp(parea, min=0.0)
@@ -290,29 +373,15 @@ class Sac4Dpl(nn.Module):
             qgs = torch.clamp(qgs, min=0.0)
             qgp = cgp * qgp + (1 - cgp) * rgp_[i] * u
             qgp = torch.clamp(qgp, min=0.0)
-            q_sim_[i] = (qs + qi + qgs + qgp)  # time|basin
-
-            # river routing, use the Muskingum routing method
-            ke_ = torch.full(ke.size(), 0.0).detach()
-            for j in range(n_basin):
-                if rivernumber[j] > 0:
-                    dt = self.hydrodt * 24.0 / 2.0
-                    xo = xe[j].detach()
-                    ke_[j] = (ke[j] * 24.0).detach()  # KE is hourly coefficient, need convert to daily.
-                    ko = (ke_[j] / rivernumber[j]).detach()
-                    c1 = (max(ko * (1.0 - xo) + dt, 0.0))
-                    c2 = (max((-ko * xo + dt) / c1, 0.0))
-                    c3 = max((ko * (1.0 - xo) - dt) / c1, 0.0)
-                    c1_ = ((ko * xo + dt) / c1).detach()
-                    i1 = q_sim_0[j].detach()  # flow at the start of timestep, inflow.
-                    i2 = q_sim_[i][j].detach()  # flow at the end of timestep, outflow.
-                    for k in range(rivernumber[j]):
-                        q_sim_0[j] = mq[j, k]  # basin|rivernumber
-                        i2_ = (c1_ * i1 + c2 * i2 + c3 * q_sim_0[j]).detach()
-                        mq[j, k] = i2_
-                        i1 = q_sim_0[j].detach()
-                        i2 = i2_.detach()
-                q_sim_[i][j] = i2
+            return (qs + qi + qgs + qgp,), (qs, qi, qgs, qgp)  # time|basin
+
+        (q_sim_,), (qs, qi, qgs, qgp) = run_time_loop(
+            slope_routing, n_step, (qs, qi, qgs, qgp), self.time_chunk
+        )
+
+        # river routing, use the Muskingum routing method
+        dt = self.hydrodt * 24.0 / 2.0
+        q_sim_, mq = muskingum_routing(q_sim_, q_sim_0, ke, xe, mq, rivernumber, dt)
 
         # seq, batch, feature
         e_sim = torch.unsqueeze(e_sim_, dim=-1)  # add a dimension
@@ -334,6 +403,10 @@ class DplAnnSac(nn.Module):
         param_limit_func="clamp",
         param_test_way="final",
         source_book="HF",
+        param_dedup=False,
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model only with attributes as DL model's input: ANN -> Param -> SAC
@@ -359,16 +432,34 @@ class DplAnnSac(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        param_dedup
+            if True, the ANN is run only once for each unique input in a batch, such as repeated
+            attributes of windows from the same basin; it is off in training when the ANN
+            has dropout, as each window draws its own dropout mask; by default False
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplAnnSac, self).__init__()
         self.dl_model = SimpleAnn(n_input_features, n_output_features, n_hidden_states)
         self.pb_model = Sac4Dpl(
             warmup_length,
             source_book=source_book,
+            time_chunk=time_chunk,
         )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
+        self.param_dedup = param_dedup
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -387,7 +478,14 @@ class DplAnnSac(nn.Module):
         torch.Tensor
             one time forward result
         """
-        gen = self.dl_model(z)
+        if z.dim() == 3 and self.param_test_way != MODEL_PARAM_TEST_WAY["time_varying"]:
+            # just get one-period values, here we use the final period's values;
+            # the ANN works on each period separately, so only the final period is calculated
+            z = z[-1]
+        if self.param_dedup:
+            gen = dedup_ann_forward(self.dl_model, z)
+        else:
+            gen = self.dl_model(z)
         # if torch.isnan(gen).any():
         #     raise ValueError("Error: NaN values detected. Check your data firstly!!!")
         # we set all params' values in [0, 1] and will scale them when forwarding
@@ -399,10 +497,6 @@ class DplAnnSac(nn.Module):
             raise NotImplementedError(
                 "We don't provide this way to limit parameters' range!! Please choose sigmoid or clamp"
             )
-        # just get one-period values, here we use the final period's values,
-        # when the MODEL_PARAM_TEST_WAY is not time_varing, we use the last period's values.
-        if self.param_test_way != MODEL_PARAM_TEST_WAY["time_varying"]:
-            params = params[-1, :, :]
         # Please put p in the first location and pet in the second
         q, e = self.pb_model(x[:, :, : self.pb_model.feature_size], params)
         # return torch.cat([q, e], dim=-1)
@@ -422,6 +516,9 @@ class DplLstmSac(nn.Module):
         param_limit_func="clamp",
         param_test_way="final",
         source_book="HF",
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model: LSTM + benefit -> Param -> SAC
@@ -448,16 +545,29 @@ class DplLstmSac(nn.Module):
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
             but remember these ways are only for non-variable parameters
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplLstmSac, self).__init__()
         self.dl_model = SimpleLSTM(n_input_features, n_output_features, n_hidden_states)     #
         self.pb_model = Sac4Dpl(
             warmup_length,
             source_book=source_book,
+            time_chunk=time_chunk,
         )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -479,8 +589,10 @@ class DplLstmSac(nn.Module):
             one time forward result
         """
         gen = self.dl_model(z)  # todo: nan values when lack of evaporation.
-        if torch.isnan(gen).any():
-            raise ValueError("Error: NaN values detected. Check your data firstly!!!")
+        raise_if(
+            torch.isnan(gen).any(),
+            ValueError("Error: NaN values detected. Check your data firstly!!!"),
+        )
         # we set all params' values in [0, 1] and will scale them when forwarding
         if self.param_func == "sigmoid":
             params = F.sigmoid(gen)
@@ -16,8 +16,13 @@ from torch import nn
 from torch import Tensor
 from torch.nn import functional as F
 from torchhydro.configs.model_config import MODEL_PARAM_DICT, MODEL_PARAM_TEST_WAY
+from torchhydro.models.kernel_conv import linear_recursion
+from torchhydro.models.time_checkpoint import run_time_loop
 from torchhydro.models.simple_lstm import SimpleLSTM
 from torchhydro.models.ann import SimpleAnn
+from torchhydro.models.deferred_check import fast_mode_forward, raise_if
+from torchhydro.models.dpl4xaj import dedup_ann_forward
+from torchhydro.models.warmup_cache import make_warmup_cache
 
 
 class Tank4Dpl(nn.Module):
@@ -28,6 +33,7 @@ class Tank4Dpl(nn.Module):
         self,
         warmup_length: int,
         source_book="HF",
+        time_chunk=None,
     ):
         """
         Initiate a Tank model instance.
@@ -38,6 +44,8 @@ class Tank4Dpl(nn.Module):
             tank needs a warmup period to generate reasonable initial state values
         source_book
             "Hydrological Forecasting (4-th version)" written by Prof. Weimin Bao.
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods, see run_time_loop
         """
         super(Tank4Dpl, self).__init__()
         self.name = "Tank"
@@ -68,6 +76,9 @@ class Tank4Dpl(nn.Module):
         self.feature_size = 2  # there are 2 input variables in Tank, precipitation and evaporation.
         self.hydrodt = 1  # one day
         self.source_book = source_book
+        self.time_chunk = time_chunk
+        # a WarmupStateCache could be set to reuse initial states of warmup periods
+        self.warmup_cache = None
 
     def forward(
         self,
@@ -114,16 +125,25 @@ class Tank4Dpl(nn.Module):
         if self.warmup_length > 0:  # if warmup_length>0, use warmup to calculate initial state.
             # set no_grad for warmup periods
             with torch.no_grad():
-                p_and_e_warmup = p_and_e[0:self.warmup_length, :, :]  # time|basin|p_and_e
-                cal_init_tank4dpl = Tank4Dpl(
-                    # warmup_length must be 0 here
-                    warmup_length=0,
-                )
-                if cal_init_tank4dpl.warmup_length > 0:
-                    raise RuntimeError("Please set init model's warmup length to 0!!!")
-                _, _, xf, xp, x2, xs, x3, x4, x5, qs = cal_init_tank4dpl(
-                    p_and_e_warmup, parameters, return_state=True
-                )
+
+                def run_warmup():
+                    p_and_e_warmup = p_and_e[0:self.warmup_length, :, :]  # time|basin|p_and_e
+                    cal_init_tank4dpl = Tank4Dpl(
+                        # warmup_length must be 0 here
+                        warmup_length=0,
+                    )
+                    if cal_init_tank4dpl.warmup_length > 0:
+                        raise RuntimeError("Please set init model's warmup length to 0!!!")
+                    return cal_init_tank4dpl(
+                        p_and_e_warmup, parameters, return_state=True
+                    )[2:]
+
+                if self.warmup_cache is None:
+                    xf, xp, x2, xs, x3, x4, x5, qs = run_warmup()
+                else:
+                    xf, xp, x2, xs, x3, x4, x5, qs = self.warmup_cache.warmup(
+                        parameters, run_warmup
+                    )
         else:  # if no, set a small value directly.
             xf = (torch.zeros(n_basin, dtype=torch.float32) + 0.01).to(tank_device)
             xp = (torch.zeros(n_basin, dtype=torch.float32) + 0.01).to(tank_device)
@@ -159,14 +179,9 @@ class Tank4Dpl(nn.Module):
         prcp = torch.clamp(p_and_e[self.warmup_length:, :, 0], min=0.0)  # time|basin
         pet = torch.clamp(p_and_e[self.warmup_length:, :, 1], min=0.0)  # time|basin
         n_step, n_basin = prcp.size()
-        e_sim_ = torch.full((n_step, n_basin), 0.0).to(tank_device)
-        q_sim_ = torch.full((n_step, n_basin), 0.0).to(tank_device)
-        rs_ = torch.full((n_step, n_basin), 0.0).to(tank_device)
-        ri_ = torch.full((n_step, n_basin), 0.0).to(tank_device)
-        rgs_ = torch.full((n_step, n_basin), 0.0).to(tank_device)
-        rgd_ = torch.full((n_step, n_basin), 0.0).to(tank_device)
         # generate runoff
-        for i in range(n_step):
+        def generate_runoff(i, states):
+            xf, xp, x2, xs, x3 = states
             p = prcp[i, :]
             e = pet[i, :]
             # evaporation
@@ -224,22 +239,25 @@ class Tank4Dpl(nn.Module):
             x3 = x3 - (f3 + rgs)  # update the shallow groundwater
             x3 = torch.clamp(x3, min=0.0)
 
-            # deep groundwater    x4 generate the deep layer groundwater runoff
-            x4 = x4 + f3
-            rgd = d1 * x4
-            x4 = x4 - rgd
-            x4 = torch.clamp(x4, min=0.0)
-
             # save
-            e_sim_[i] = et
-            rs_[i] = rs
-            ri_[i] = ri
-            rgs_[i] = rgs
-            rgd_[i] = rgd
+            return (et, rs, ri, rgs, f3), (xf, xp, x2, xs, x3)
+
+        (e_sim_, rs_, ri_, rgs_, f3_), (xf, xp, x2, xs, x3) = run_time_loop(
+            generate_runoff, n_step, (xf, xp, x2, xs, x3), self.time_chunk
+        )
+
+        # deep groundwater    x4 generate the deep layer groundwater runoff
+        # x4 is a linear reservoir only fed by f3 (>= 0), so it is calculated for all periods at once:
+        # x4[t] = (1 - d1) * (x4[t-1] + f3[t]), rgd[t] = d1 * (x4[t-1] + f3[t])
+        x4s = linear_recursion(1 - d1, (1 - d1) * f3_, x4)
+        rgd_ = d1 * (torch.cat([x4.unsqueeze(0), x4s[:-1]]) + f3_)
+        x4 = x4s[-1]
 
         # routing
         u = self.hydrodt / 1000.0  # unit conversion
-        for i in range(n_step):
+
+        def routing_period(i, states):
+            x5, qs = states
             k0 = torch.where(x5 >= h, 1 / (e1 + e2), 1 / e1)
             c0 = torch.where(x5 >= h, e2 * h / (e1 + e2), 0)
             k1 = 1 / e1
@@ -255,7 +273,11 @@ class Tank4Dpl(nn.Module):
             q1 = torch.clamp(q1, min=0.0)
             x5 = k1 * q1 + c1
             qs = q1
-            q_sim_[i] = q1
+            return (q1,), (x5, qs)
+
+        (q_sim_,), (x5, qs) = run_time_loop(
+            routing_period, n_step, (x5, qs), self.time_chunk
+        )
 
         # seq, batch, feature
         e_sim = torch.unsqueeze(e_sim_, dim=-1)  # add a dimension
@@ -277,6 +299,10 @@ class DplAnnTank(nn.Module):
         param_limit_func="clamp",
         param_test_way="final",
         source_book="HF",
+        param_dedup=False,
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model only with attributes as DL model's input: ANN -> Param -> TANK
@@ -302,15 +328,34 @@ class DplAnnTank(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        param_dedup
+            if True, the ANN is run only once for each unique input in a batch, such as repeated
+            attributes of windows from the same basin; it is off in training when the ANN
+            has dropout, as each window draws its own dropout mask; by default False
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
+        super(DplAnnTank, self).__init__()
         self.dl_model = SimpleAnn(n_input_features, n_output_features, n_hidden_states)
         self.pb_model = Tank4Dpl(
             warmup_length,
             source_book=source_book,
+            time_chunk=time_chunk,
         )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
+        self.param_dedup = param_dedup
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -330,9 +375,18 @@ class DplAnnTank(nn.Module):
         torch.Tensor
             one time forward result
         """
-        gen = self.dl_model(z)
-        if torch.isnan(gen).any():
-            raise ValueError("Error: NaN values detected. Check your data firstly!!!")
+        if z.dim() == 3 and self.param_test_way != MODEL_PARAM_TEST_WAY["time_varying"]:
+            # just get one-period values, here we use the final period's values;
+            # the ANN works on each period separately, so only the final period is calculated
+            z = z[-1]
+        if self.param_dedup:
+            gen = dedup_ann_forward(self.dl_model, z)
+        else:
+            gen = self.dl_model(z)
+        raise_if(
+            torch.isnan(gen).any(),
+            ValueError("Error: NaN values detected. Check your data firstly!!!"),
+        )
         # we set all params' values in [0, 1] and will scale them when forwarding
         if self.param_func == "sigmoid":
             params = F.sigmoid(gen)
@@ -342,10 +396,6 @@ class DplAnnTank(nn.Module):
             raise NotImplementedError(
                 "We don't provide this way to limit parameters' range!! Please choose sigmoid or clamp"
             )
-        # just get one-period values, here we use the final period's values,
-        # when the MODEL_PARAM_TEST_WAY is not time_varing, we use the last period's values.
-        if self.param_test_way != MODEL_PARAM_TEST_WAY["time_varying"]:
-            params = params[-1, :, :]
         # Please put p in the first location and pet in the second
         q, e = self.pb_model(x[:, :, : self.pb_model.feature_size], params)
         # return torch.cat([q, e], dim=-1)
@@ -364,6 +414,9 @@ class DplLstmTank(nn.Module):
         param_limit_func="clamp",
         param_test_way="final",
         source_book="HF",
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model: LSTM -> Param -> TANK
@@ -390,16 +443,29 @@ class DplLstmTank(nn.Module):
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
             but remember these ways are only for non-variable parameters
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplLstmTank, self).__init__()
         self.dl_model = SimpleLSTM(n_input_features, n_output_features, n_hidden_states)       #
         self.pb_model = Tank4Dpl(
             warmup_length,
             source_book=source_book,
+            time_chunk=time_chunk,
         )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -421,8 +487,10 @@ class DplLstmTank(nn.Module):
             one time forward result
         """
         gen = self.dl_model(z)
-        if torch.isnan(gen).any():
-            raise ValueError("Error: NaN values detected. Check your data firstly!!!")
+        raise_if(
+            torch.isnan(gen).any(),
+            ValueError("Error: NaN values detected. Check your data firstly!!!"),
+        )
         # we set all params' values in [0, 1] and will scale them when forwarding
         if self.param_func == "sigmoid":
             params = F.sigmoid(gen)
@@ -16,13 +16,16 @@ from torch.nn import functional as F
 
 from torchhydro.configs.model_config import MODEL_PARAM_DICT
 from torchhydro.models.ann import SimpleAnn
-from torchhydro.models.kernel_conv import KernelConv
+from torchhydro.models.deferred_check import fast_mode_forward, raise_if
+from torchhydro.models.kernel_conv import KernelConv, linear_reservoir_routing
 from torchhydro.models.simple_lstm import SimpleLSTM
+from torchhydro.models.step_mode import get_step
+from torchhydro.models.time_checkpoint import run_time_loop
+from torchhydro.models.warmup_cache import make_warmup_cache
 
 
 PRECISION = 1e-5
 
-
 def calculate_evap(
     lm, c, wu0, wl0, prcp, pet
 ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
@@ -101,10 +104,12 @@ def calculate_prcp_runoff(b, im, wm, w0, pe):
     """
     wmm = wm * (1 + b)
     a = wmm * (1 - (1 - w0 / wm) ** (1 / (1 + b)))
-    if any(torch.isnan(a)):
-        raise ValueError(
+    raise_if(
+        torch.isnan(a).any(),
+        ValueError(
             "Error: NaN values detected. Try set clamp function or check your data!!!"
-        )
+        ),
+    )
     r_cal = torch.where(
         pe > 0.0,
         torch.where(
@@ -115,10 +120,12 @@ def calculate_prcp_runoff(b, im, wm, w0, pe):
         ),
         torch.full(pe.size(), 0.0).to(pe.device),
     )
-    if any(torch.isnan(r_cal)):
-        raise ValueError(
+    raise_if(
+        torch.isnan(r_cal).any(),
+        ValueError(
             "Error: NaN values detected. Try set clamp function or check your data!!!"
-        )
+        ),
+    )
     r = torch.clamp(r_cal, min=0.0)
     r_im_cal = pe * im
     r_im = torch.clamp(r_im_cal, min=0.0)
@@ -352,14 +359,18 @@ def xaj_sources(
     fr = torch.clone(fr0)
     fr_mask = r > 0.0
     fr[fr_mask] = r[fr_mask] / pe[fr_mask]
-    if any(torch.isnan(fr)):
-        raise ValueError(
+    raise_if(
+        torch.isnan(fr).any(),
+        ValueError(
             "Error: NaN values detected. Try set clamp function or check your data!!!"
-        )
-    if any(fr == 0.0):
-        raise ArithmeticError(
+        ),
+    )
+    raise_if(
+        (fr == 0.0).any(),
+        ArithmeticError(
             "Please check fr's value, fr==0.0 will cause error in the next step!"
-        )
+        ),
+    )
     ss = torch.clone(s0)
     s = torch.clone(s0)
 
@@ -368,10 +379,12 @@ def xaj_sources(
     if book == "HF":
         ss = torch.clamp(ss, max=sm - PRECISION)
         au = ms * (1.0 - (1.0 - ss / sm) ** (1.0 / (1.0 + ex)))
-        if any(torch.isnan(au)):
-            raise ValueError(
+        raise_if(
+            torch.isnan(au).any(),
+            ValueError(
                 "Error: NaN values detected. Try set clamp function or check your data!!!"
-            )
+            ),
+        )
 
         rs = torch.full_like(r, 0.0, device=xaj_device)
         rs[fr_mask] = torch.where(
@@ -412,10 +425,12 @@ def xaj_sources(
         smf = smmf / (1 + ex)
         ss = torch.clamp(ss, max=smf - PRECISION)
         au = smmf * (1 - (1 - ss / smf) ** (1 / (1 + ex)))
-        if torch.isnan(au).any():
-            raise ArithmeticError(
+        raise_if(
+            torch.isnan(au).any(),
+            ArithmeticError(
                 "Error: NaN values detected. Try set clip function or check your data!!!"
-            )
+            ),
+        )
         rs = torch.full_like(r, 0.0, device=xaj_device)
         rs[fr_mask] = torch.where(
             pe[fr_mask] + au[fr_mask] < smmf[fr_mask],
@@ -522,8 +537,10 @@ def xaj_sources5mm(
     pen = pe / n
     kss_d = (1 - (1 - (ki + kg)) ** (1 / n)) / (1 + kg / ki)
     kg_d = kss_d * kg / ki
-    if torch.isnan(kss_d).any() or torch.isnan(kg_d).any():
-        raise ValueError("Error: NaN values detected. Check your parameters setting!!!")
+    raise_if(
+        torch.isnan(kss_d).any() | torch.isnan(kg_d).any(),
+        ValueError("Error: NaN values detected. Check your parameters setting!!!"),
+    )
     # kss_d = ki
     # kg_d = kg
 
@@ -553,10 +570,12 @@ def xaj_sources5mm(
             # ms = smm
             ss_d = torch.clamp(ss_d, max=sm - PRECISION)
             au = smm * (1.0 - (1.0 - ss_d / sm) ** (1.0 / (1.0 + ex)))
-            if torch.isnan(au).any():
-                raise ValueError(
+            raise_if(
+                torch.isnan(au).any(),
+                ValueError(
                     "Error: NaN values detected. Try set clip function or check your data!!!"
-                )
+                ),
+            )
             rs_j = torch.full_like(rn, 0.0, device=xaj_device)
             rs_j[fr_mask] = torch.where(
                 pen[fr_mask] + au[fr_mask] < smm[fr_mask],
@@ -588,10 +607,12 @@ def xaj_sources5mm(
             smf = smmf / (1 + ex)
             ss_d = torch.clamp(ss_d, max=smf - PRECISION)
             au = smmf * (1 - (1 - ss_d / smf) ** (1 / (1 + ex)))
-            if torch.isnan(au).any():
-                raise ValueError(
+            raise_if(
+                torch.isnan(au).any(),
+                ValueError(
                     "Error: NaN values detected. Try set clip function or check your data!!!"
-                )
+                ),
+            )
             rs_j = torch.full(rn.size(), 0.0).to(xaj_device)
             rs_j[fr_mask] = torch.where(
                 pen[fr_mask] + au[fr_mask] < smmf[fr_mask],
@@ -659,6 +680,72 @@ def linear_reservoir(x, weight, last_y: Optional[Tensor] = None):
     return weight * last_y + weight1 * x
 
 
+def xaj_step(
+    p_and_e,
+    k,
+    b,
+    im,
+    um,
+    lm,
+    dm,
+    c,
+    sm,
+    ex,
+    ki,
+    kg,
+    wu0,
+    wl0,
+    wd0,
+    s0,
+    fr0,
+    source_type: str = "sources",
+    source_book: str = "HF",
+) -> tuple:
+    """
+    One time step of XAJ: runoff generation and dividing sources
+
+    All inputs are 1-dim [basin] tensors except p_and_e, which is [basin, 2].
+
+    Parameters
+    ----------
+    p_and_e
+        precipitation and potential evapotranspiration of this period
+    k, b, im, um, lm, dm, c, sm, ex, ki, kg
+        parameters of XAJ model, see Xaj4Dpl
+    wu0, wl0, wd0
+        soil moisture of upper, lower and deep layer of last period
+    s0
+        free water storage of last period
+    fr0
+        runoff area of last period
+    source_type
+        "sources" or "sources5mm"
+    source_book
+        "HF" or "EH"
+
+    Returns
+    -------
+    tuple
+        (rim, rs, ri, rg, e), (wu, wl, wd, s, fr);
+        rs, ri and rg have been corrected by the impervious ratio
+    """
+    (r, rim, e, pe), (wu, wl, wd) = xaj_generation(
+        p_and_e, k, b, im, um, lm, dm, c, wu0, wl0, wd0
+    )
+    if source_type == "sources":
+        (rs, ri, rg), (s, fr) = xaj_sources(
+            pe, r, sm, ex, ki, kg, s0, fr0, book=source_book
+        )
+    elif source_type == "sources5mm":
+        (rs, ri, rg), (s, fr) = xaj_sources5mm(
+            pe, r, sm, ex, ki, kg, s0, fr0, book=source_book
+        )
+    else:
+        raise NotImplementedError("No such divide-sources method")
+    # impevious part is pe * im, so for non-imprvious part, the result should be corrected
+    return (rim, rs * (1 - im), ri * (1 - im), rg * (1 - im), e), (wu, wl, wd, s, fr)
+
+
 class Xaj4Dpl(nn.Module):
     """
     XAJ model for Differential Parameter learning
@@ -670,6 +757,8 @@ class Xaj4Dpl(nn.Module):
         warmup_length: int,
         source_book="HF",
         source_type="sources",
+        step_mode="eager",
+        time_chunk=None,
     ):
         """
         Parameters
@@ -679,6 +768,14 @@ class Xaj4Dpl(nn.Module):
         warmup_length
             the length of warmup periods;
             XAJ needs a warmup period to generate reasonable initial state values
+        source_book
+            "HF" or "EH", see xaj_sources
+        source_type
+            "sources" or "sources5mm"
+        step_mode
+            how to run each time step; "eager" or "compile", see get_step
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods, see run_time_loop
         """
         super(Xaj4Dpl, self).__init__()
         self.params_names = MODEL_PARAM_DICT["xaj_mz"]["param_name"]
@@ -704,6 +801,11 @@ class Xaj4Dpl(nn.Module):
         self.feature_size = 2
         self.source_book = source_book
         self.source_type = source_type
+        self.step_mode = step_mode
+        self.xaj_step = get_step(xaj_step, step_mode)
+        self.time_chunk = time_chunk
+        # a WarmupStateCache could be set to reuse initial states of warmup periods
+        self.warmup_cache = None
 
     def forward(self, p_and_e, parameters, return_state=False):
         """
@@ -767,15 +869,28 @@ class Xaj4Dpl(nn.Module):
         if warmup_length > 0:
             # set no_grad for warmup periods
             with torch.no_grad():
-                p_and_e_warmup = p_and_e[0:warmup_length, :, :]
-                cal_init_xaj4dpl = Xaj4Dpl(
-                    self.kernel_size, 0, self.source_book, self.source_type
-                )
-                if cal_init_xaj4dpl.warmup_length > 0:
-                    raise RuntimeError("Please set init model's warmup length to 0!!!")
-                _, _, *w0, s0, fr0, qi0, qg0 = cal_init_xaj4dpl(
-                    p_and_e_warmup, parameters, return_state=True
-                )
+
+                def run_warmup():
+                    p_and_e_warmup = p_and_e[0:warmup_length, :, :]
+                    cal_init_xaj4dpl = Xaj4Dpl(
+                        self.kernel_size,
+                        0,
+                        self.source_book,
+                        self.source_type,
+                        self.step_mode,
+                    )
+                    if cal_init_xaj4dpl.warmup_length > 0:
+                        raise RuntimeError("Please set init model's warmup length to 0!!!")
+                    return cal_init_xaj4dpl(
+                        p_and_e_warmup, parameters, return_state=True
+                    )[2:]
+
+                if self.warmup_cache is None:
+                    *w0, s0, fr0, qi0, qg0 = run_warmup()
+                else:
+                    *w0, s0, fr0, qi0, qg0 = self.warmup_cache.warmup(
+                        parameters, run_warmup
+                    )
         else:
             # use detach func to make wu0 no_grad as it is an initial value
             w0 = (0.5 * (um.detach()), 0.5 * (lm.detach()), 0.5 * (dm.detach()))
@@ -785,50 +900,34 @@ class Xaj4Dpl(nn.Module):
             qg0 = torch.full(cg.size(), 0.1).to(xaj_device)
 
         inputs = p_and_e[warmup_length:, :, :]   # [时间|批次划分|特征（降雨蒸发）]
-        runoff_ims_ = torch.full(inputs.shape[:2], 0.0).to(xaj_device)
-        rss_ = torch.full(inputs.shape[:2], 0.0).to(xaj_device)
-        ris_ = torch.full(inputs.shape[:2], 0.0).to(xaj_device)
-        rgs_ = torch.full(inputs.shape[:2], 0.0).to(xaj_device)
-        es_ = torch.full(inputs.shape[:2], 0.0).to(xaj_device)
-        for i in range(inputs.shape[0]):
-            if i == 0:
-                (r, rim, e, pe), w = xaj_generation(
-                    inputs[i, :, :], k, b, im, um, lm, dm, c, *w0
-                )
-                if self.source_type == "sources":
-                    (rs, ri, rg), (s, fr) = xaj_sources(
-                        pe, r, sm, ex, ki, kg, s0, fr0, book=self.source_book
-                    )
-                elif self.source_type == "sources5mm":
-                    (rs, ri, rg), (s, fr) = xaj_sources5mm(
-                        pe, r, sm, ex, ki, kg, s0, fr0, book=self.source_book
-                    )
-                else:
-                    raise NotImplementedError("No such divide-sources method")
-            else:
-                (r, rim, e, pe), w = xaj_generation(  # generate runoff
-                    inputs[i, :, :], k, b, im, um, lm, dm, c, *w
-                )
-                if self.source_type == "sources":  # divide water source
-                    (rs, ri, rg), (s, fr) = xaj_sources(
-                        pe, r, sm, ex, ki, kg, s, fr, book=self.source_book
-                    )
-                elif self.source_type == "sources5mm":
-                    (rs, ri, rg), (s, fr) = xaj_sources5mm(
-                        pe, r, sm, ex, ki, kg, s, fr, book=self.source_book
-                    )
-                else:
-                    raise NotImplementedError("No such divide-sources method")
-            # impevious part is pe * im
-            runoff_ims_[i, :] = rim
-            # so for non-imprvious part, the result should be corrected
-            rss_[i, :] = rs * (1 - im)
-            ris_[i, :] = ri * (1 - im)
-            rgs_[i, :] = rg * (1 - im)
-            es_[i, :] = e
-            # rss_[i, :] = 0.7 * r
-            # ris_[i, :] = 0.2 * r
-            # rgs_[i, :] = 0.1 * r
+
+        def xaj_period(i, states):
+            wu, wl, wd, s, fr = states
+            return self.xaj_step(
+                inputs[i, :, :],
+                k,
+                b,
+                im,
+                um,
+                lm,
+                dm,
+                c,
+                sm,
+                ex,
+                ki,
+                kg,
+                wu,
+                wl,
+                wd,
+                s,
+                fr,
+                source_type=self.source_type,
+                source_book=self.source_book,
+            )
+
+        (runoff_ims_, rss_, ris_, rgs_, es_), (wu, wl, wd, s, fr) = run_time_loop(
+            xaj_period, inputs.shape[0], (*w0, s0, fr0), self.time_chunk
+        )
         # seq, batch, feature
         runoff_im = torch.unsqueeze(runoff_ims_, dim=2)
         rss = torch.unsqueeze(rss_, dim=2)
@@ -837,20 +936,16 @@ class Xaj4Dpl(nn.Module):
         # slop routing
         conv_uh = KernelConv(a, theta, self.kernel_size)
         qs_ = conv_uh(runoff_im + rss)
-        qs = torch.full(inputs.shape[:2], 0.0).to(xaj_device)
-        for i in range(inputs.shape[0]):
-            if i == 0:
-                qi = linear_reservoir(ris_[i], ci, qi0)
-                qg = linear_reservoir(rgs_[i], cg, qg0)
-            else:
-                qi = linear_reservoir(ris_[i], ci, qi)
-                qg = linear_reservoir(rgs_[i], cg, qg)
-            qs[i, :] = qs_[i, :, 0] + qi + qg
+        # interflow and groundwater routing with linear reservoirs for all periods at once
+        qis = linear_reservoir_routing(ris_, ci, qi0)
+        qgs = linear_reservoir_routing(rgs_, cg, qg0)
+        qs = qs_[:, :, 0] + qis + qgs
+        qi, qg = qis[-1], qgs[-1]
 
         # seq, batch, feature
         q_sim = torch.unsqueeze(qs, dim=2)
         if return_state:
-            return q_sim, es, *w, s, fr, qi, qg
+            return q_sim, es, wu, wl, wd, s, fr, qi, qg
         return q_sim, es
 
 
@@ -866,6 +961,10 @@ class DplLstmXaj(nn.Module):
         param_test_way="final",
         source_book="HF",
         source_type="sources",
+        step_mode="eager",
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model: LSTM -> Param -> XAJ
@@ -893,15 +992,34 @@ class DplLstmXaj(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        step_mode
+            how XAJ runs each time step; "eager" (default) or "compile" (torch.compile)
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplLstmXaj, self).__init__()
         self.dl_model = SimpleLSTM(n_input_features, n_output_features, n_hidden_states)
         self.pb_model = Xaj4Dpl(
-            kernel_size, warmup_length, source_book=source_book, source_type=source_type
+            kernel_size,
+            warmup_length,
+            source_book=source_book,
+            source_type=source_type,
+            step_mode=step_mode,
+            time_chunk=time_chunk,
         )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -937,6 +1055,11 @@ class DplAnnXaj(nn.Module):
         param_test_way="final",
         source_book="HF",
         source_type="sources",
+        step_mode="eager",
+        param_dedup=False,
+        time_chunk=None,
+        fast_mode=False,
+        warmup_cache=None,
     ):
         """
         Differential Parameter learning model only with attributes as DL model's input: ANN -> Param -> Gr4j
@@ -964,17 +1087,41 @@ class DplAnnXaj(nn.Module):
             1. "final" -- use the final period's parameter for each period
             2. "mean_time" -- Mean values of all periods' parameters is used
             3. "mean_basin" -- Mean values of all basins' final periods' parameters is used
+        step_mode
+            how XAJ runs each time step; "eager" (default) or "compile" (torch.compile)
+        param_dedup
+            if True, the ANN is run only once for each unique input in a batch, such as repeated
+            attributes of windows from the same basin; it is off in training when the ANN
+            has dropout, as each window draws its own dropout mask; by default False
+        time_chunk
+            if given, gradient checkpointing is used for every time_chunk periods of the physics-based
+            model, which saves memory for long sequences at the cost of recalculation; by default None
+        fast_mode
+            if True, NaN checks are reported once at the end of forward rather than in each period,
+            so that the time loop doesn't wait for the device; by default False
+        warmup_cache
+            True, kwargs of WarmupStateCache or a WarmupStateCache to reuse initial states of warmup
+            periods when the same windows are evaluated again, see make_warmup_cache; by default None
         """
         super(DplAnnXaj, self).__init__()
         self.dl_model = SimpleAnn(
             n_input_features, n_output_features, n_hidden_states, dr
         )
         self.pb_model = Xaj4Dpl(
-            kernel_size, warmup_length, source_book=source_book, source_type=source_type
+            kernel_size,
+            warmup_length,
+            source_book=source_book,
+            source_type=source_type,
+            step_mode=step_mode,
+            time_chunk=time_chunk,
         )
+        self.pb_model.warmup_cache = make_warmup_cache(warmup_cache)
         self.param_func = param_limit_func
         self.param_test_way = param_test_way
+        self.fast_mode = fast_mode
+        self.param_dedup = param_dedup
 
+    @fast_mode_forward
     def forward(self, x, z):
         """
         Differential parameter learning
@@ -994,7 +1141,14 @@ class DplAnnXaj(nn.Module):
         torch.Tensor
             one time forward result
         """
-        q, e = ann_pbm(self.dl_model, self.pb_model, self.param_func, x, z)
+        q, e = ann_pbm(
+            self.dl_model,
+            self.pb_model,
+            self.param_func,
+            x,
+            z,
+            self.param_dedup,
+        )
         return torch.cat([q, e], dim=-1)
 
 
@@ -1024,8 +1178,10 @@ def lstm_pbm(dl_model, pb_model, param_func, x, z):
             one time forward result
     """
     gen = dl_model(z)
-    if torch.isnan(gen).any():
-        raise ValueError("Error: NaN values detected. Check your data firstly!!!")
+    raise_if(
+        torch.isnan(gen).any(),
+        ValueError("Error: NaN values detected. Check your data firstly!!!"),
+    )
     # we set all params' values in [0, 1] and will scale them when forwarding
     if param_func == "sigmoid":
         params_ = F.sigmoid(gen)
@@ -1040,7 +1196,40 @@ def lstm_pbm(dl_model, pb_model, param_func, x, z):
     return pb_model(x[:, :, : pb_model.feature_size], params)
 
 
-def ann_pbm(dl_model, pb_model, param_func, x, z):
+def dedup_ann_forward(dl_model, z):
+    """
+    Run an ANN only once for each unique input and broadcast the outputs
+
+    The ANN works on each input (the last dim of z) separately; when parameters only depend on
+    attributes, a batch with many windows from the same basin has many repeated inputs.
+    In training with active dropout, each input should draw its own dropout mask, so the ANN
+    runs on all inputs as usual then.
+
+    Parameters
+    ----------
+    dl_model
+        ann model
+    z
+        normalized data used for DL model; [..., feature]
+
+    Returns
+    -------
+    torch.Tensor
+        the outputs of dl_model, same as dl_model(z)
+    """
+    if dl_model.training and any(
+        isinstance(module, nn.Dropout) and module.p > 0
+        for module in dl_model.modules()
+    ):
+        return dl_model(z)
+    z_unique, inverse = torch.unique(
+        z.reshape(-1, z.shape[-1]), dim=0, return_inverse=True
+    )
+    gen = dl_model(z_unique)[inverse]
+    return gen.reshape(*z.shape[:-1], gen.shape[-1])
+
+
+def ann_pbm(dl_model, pb_model, param_func, x, z, param_dedup=False):
     """
     Differential parameter learning
 
@@ -1059,15 +1248,20 @@ def ann_pbm(dl_model, pb_model, param_func, x, z):
         not normalized data used for physical model; a sequence-first 3-dim tensor. [sequence, batch, feature]
     z
         normalized data used for DL model; a 2-dim tensor. [batch, feature]
+    param_dedup
+        if True, the ANN is run only once for each unique row of z, except in training with
+        dropout, see dedup_ann_forward
 
     Returns
     -------
     torch.Tensor
         one time forward result
     """
-    gen = dl_model(z)
-    if torch.isnan(gen).any():
-        raise ValueError("Error: NaN values detected. Check your data firstly!!!")
+    gen = dedup_ann_forward(dl_model, z) if param_dedup else dl_model(z)
+    raise_if(
+        torch.isnan(gen).any(),
+        ValueError("Error: NaN values detected. Check your data firstly!!!"),
+    )
     # we set all params' values in [0, 1] and will scale them when forwarding
     if param_func == "sigmoid":
         params = F.sigmoid(gen)
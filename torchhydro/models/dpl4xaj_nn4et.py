@@ -14,11 +14,10 @@ from torch.nn import functional as F
 
 from torchhydro.configs.model_config import MODEL_PARAM_DICT, MODEL_PARAM_TEST_WAY
 from torchhydro.models.ann import SimpleAnn
-from torchhydro.models.kernel_conv import KernelConv
+from torchhydro.models.kernel_conv import KernelConv, linear_reservoir_routing
 from torchhydro.models.simple_lstm import SimpleLSTM
 from torchhydro.models.dpl4xaj import (
     calculate_prcp_runoff,
-    linear_reservoir,
     xaj_sources,
     xaj_sources5mm,
 )
@@ -483,15 +482,11 @@ class Xaj4DplWithNnModule(nn.Module):
         conv_uh = KernelConv(a, theta, self.kernel_size)
         qs_ = conv_uh(runoff_im + rss)   # surface routing
 
-        qs = torch.full(inputs.shape[:2], 0.0).to(xaj_device)
-        for i in range(inputs.shape[0]):  # interflow and groundwater routing use the linear reservoir
-            if i == 0:
-                qi = linear_reservoir(ris_[i], ci, qi0)
-                qg = linear_reservoir(rgs_[i], cg, qg0)
-            else:
-                qi = linear_reservoir(ris_[i], ci, qi)  # the variables range
-                qg = linear_reservoir(rgs_[i], cg, qg)
-            qs[i, :] = qs_[i, :, 0] + qi + qg
+        # interflow and groundwater routing use the linear reservoir, for all periods at once
+        qis = linear_reservoir_routing(ris_, ci, qi0)
+        qgs = linear_reservoir_routing(rgs_, cg, qg0)
+        qs = qs_[:, :, 0] + qis + qgs
+        qi, qg = qis[-1], qgs[-1]
         # seq, batch, feature
         q_sim = torch.unsqueeze(qs, dim=2)
         if return_state:
@@ -1,10 +1,12 @@
+import math
+
 import torch.nn as nn
 import torch
 from torch.nn import functional as F
 
 
 class KernelConv(nn.Module):
-    def __init__(self, a, theta, kernel_size):
+    def __init__(self, a, theta, kernel_size, backend="auto"):
         """
         The convolution kernel for the convolution operation in routing module
 
@@ -19,8 +21,11 @@ class KernelConv(nn.Module):
             timescale parameter
         kernel_size
             the size of conv kernel
+        backend
+            "direct", "fft" or "auto", see uh_conv
         """
         super(KernelConv, self).__init__()
+        self.backend = backend
         self.a = a
         self.theta = theta
         routa = self.a.repeat(kernel_size, 1).unsqueeze(-1)
@@ -41,23 +46,10 @@ class KernelConv(nn.Module):
         torch.Tensor
             convolution
         """
-        # dim: permute from [len_uh, batch, feature] to [batch, feature, len_uh]
-        uh = self.uh_gamma.permute(1, 2, 0)
-        # the dim of conv kernel in F.conv1d is out_channels, in_channels (feature)/groups, width (seq)
-        # the dim of inputs in F.conv1d are batch, in_channels (feature) and width (seq),
-        # each element in a batch should has its own conv kernel,
-        # hence set groups = batch_size and permute input's batch-dim to channel-dim to make "groups" work
-        inputs = x.permute(2, 1, 0)
-        batch_size = x.shape[1]
-        # conv1d in NN is different from the general convolution: it is lack of a flip
-        outputs = F.conv1d(
-            inputs, torch.flip(uh, [2]), groups=batch_size, padding=uh.shape[-1] - 1
-        )
-        # permute from [feature, batch, seq] to [seq, batch, feature]
-        return outputs[:, :, : -(uh.shape[-1] - 1)].permute(2, 1, 0)
+        return uh_conv(x, self.uh_gamma, backend=self.backend)
 
 
-def uh_conv(x, uh_made) -> torch.Tensor:
+def uh_conv(x, uh_made, backend="auto") -> torch.Tensor:
     """
     Function for 1d-convolution calculation
 
@@ -67,12 +59,24 @@ def uh_conv(x, uh_made) -> torch.Tensor:
         x is a sequence-first variable, so the dim of x is [seq, batch, feature]
     uh_made
         unit hydrograph from uh_gamma or other unit-hydrograph method
+    backend
+        "direct" -- F.conv1d with one group per basin, cost is O(seq * len_uh);
+        "fft" -- convolution via real FFTs, cost is O(seq * log(seq)) whatever len_uh is;
+        "auto" -- "fft" when the unit hydrograph is long enough for it to be faster, else "direct"
 
     Returns
     -------
     torch.Tensor
         convolution, [seq, batch, feature]; the length of seq is same as x's
     """
+    if backend == "auto":
+        backend = "fft" if _fft_is_faster(x.shape[0], uh_made.shape[0]) else "direct"
+    if backend == "fft":
+        return _uh_conv_fft(x, uh_made)
+    if backend != "direct":
+        raise NotImplementedError(
+            f"No such backend {backend} for uh_conv, please choose direct, fft or auto"
+        )
     uh = uh_made.permute(1, 2, 0)
     # the dim of conv kernel in F.conv1d is out_channels, in_channels (feature)/groups, width (seq)
     # the dim of inputs in F.conv1d are batch, in_channels (feature) and width (seq),
@@ -88,6 +92,22 @@ def uh_conv(x, uh_made) -> torch.Tensor:
     return outputs[:, :, : x.shape[0]].permute(2, 1, 0)
 
 
+def _fft_is_faster(n_step, len_uh):
+    # direct convolution costs ~ n_step * len_uh and FFT ~ n_fft * log2(n_fft) with a larger
+    # constant; the factor 4 comes from timing both on CPU for daily and hourly sequences
+    return len_uh > 4 * math.log2(n_step + len_uh - 1)
+
+
+def _uh_conv_fft(x, uh_made):
+    """causal convolution of x and unit hydrographs (both sequence-first) via real FFTs"""
+    n_step = x.shape[0]
+    # zero-padding to the full length of linear convolution, so there is no circular aliasing
+    n_fft = n_step + uh_made.shape[0] - 1
+    x_f = torch.fft.rfft(x, n=n_fft, dim=0)
+    uh_f = torch.fft.rfft(uh_made, n=n_fft, dim=0)
+    return torch.fft.irfft(x_f * uh_f, n=n_fft, dim=0)[:n_step]
+
+
 def uh_gamma(a, theta, len_uh=10):
     """
     A simple two-parameter Gamma distribution as a unit-hydrograph to route instantaneous runoff from a hydrologic model
@@ -128,3 +148,67 @@ def uh_gamma(a, theta, len_uh=10):
     w = 1 / denominator * (t ** (aa - 1)) * (torch.exp(-t / theta))
     w = w / w.sum(0)  # scale to 1 for each UH
     return w
+
+
+def linear_recursion(a, b, y0=None) -> torch.Tensor:
+    """
+    Evaluate the first-order linear recursion y[t] = a[t] * y[t-1] + b[t] for all time steps at once
+
+    Recessions of linear reservoirs are such recursions. Rather than one python step per time step,
+    a parallel prefix (Hillis-Steele) scan is used: it composes the affine maps y -> a[t] * y + b[t]
+    in log2(seq) vectorized steps for all basins. Only products of a are formed, so it is as stable
+    as the loop, and gradients are exact as all operations are differentiable.
+
+    Parameters
+    ----------
+    a
+        the coefficients, [seq, batch] or [batch] for time-invariant ones
+    b
+        the inputs, [seq, batch]
+    y0
+        the value before the first time step, [batch]; 0 if None
+
+    Returns
+    -------
+    torch.Tensor
+        y, [seq, batch]
+    """
+    acc_a = a.expand_as(b) if a.dim() < b.dim() else a
+    acc_b = b
+    n_step = b.shape[0]
+    offset = 1
+    while offset < n_step:
+        # compose each step with the one which is offset steps earlier
+        acc_b = torch.cat(
+            [acc_b[:offset], acc_a[offset:] * acc_b[:-offset] + acc_b[offset:]]
+        )
+        acc_a = torch.cat([acc_a[:offset], acc_a[offset:] * acc_a[:-offset]])
+        offset *= 2
+    if y0 is None:
+        return acc_b
+    return acc_a * y0 + acc_b
+
+
+def linear_reservoir_routing(x, weight, y0=None) -> torch.Tensor:
+    """
+    Outflows of a linear reservoir for a whole sequence: y[t] = weight * y[t-1] + (1 - weight) * x[t]
+
+    It gives the same results as calling linear_reservoir in dpl4xaj step by step.
+
+    Parameters
+    ----------
+    x
+        the inflow, [seq, batch]
+    weight
+        the coefficient of linear reservoir, [batch]
+    y0
+        the outflow before the first time step, [batch]; 0.001 if None, same as linear_reservoir
+
+    Returns
+    -------
+    torch.Tensor
+        the outflow, [seq, batch]
+    """
+    if y0 is None:
+        y0 = torch.full(weight.size(), 0.001).to(x.device)
+    return linear_recursion(weight, (1 - weight) * x, y0)
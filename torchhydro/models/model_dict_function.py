@@ -8,23 +8,6 @@ FilePath: \torchhydro\torchhydro\models\model_dict_function.py
 Copyright (c) 2021-2022 Wenyu Ouyang. All rights reserved.
 """
 
-from torchhydro.models.dpl4hbv import DplLstmHbv, DplAnnHbv
-from torchhydro.models.cudnnlstm import (
-    CudnnLstmModel,
-    LinearCudnnLstmModel,
-    CNN1dLCmodel,
-    CudnnLstmModelLstmKernel,
-    CudnnLstmModelMultiOutput,
-    CpuLstmModel,
-)
-
-from torchhydro.models.simple_lstm import SimpleLSTMForecast
-from torchhydro.models.seq2seq import (
-    GeneralSeq2Seq,
-    DataEnhancedModel,
-    DataFusionModel,
-    Transformer,
-)
 from torch.optim import Adam, SGD, Adadelta
 from torchhydro.models.crits import (
     RMSELoss,
@@ -39,66 +22,51 @@ from torchhydro.models.crits import (
     MAELoss,
     QuantileLoss,
 )
-from torchhydro.models.dpl4xaj import DplLstmXaj, DplAnnXaj
-from torchhydro.models.dpl4xaj_nn4et import DplLstmNnModuleXaj
-from torchhydro.models.spplstm import SPP_LSTM_Model, SPP_LSTM_Model_2
-from torchhydro.models.dpl4hbv import DplLstmHbv, DplAnnHbv
-from torchhydro.models.dpl4gr4j import DplLstmGr4j, DplAnnGr4j
-from torchhydro.models.dpl4sac import DplAnnSac, DplLstmSac
-from torchhydro.models.dpl4tank import DplAnnTank, DplLstmTank
-from torchhydro.models.narx import Narx, NestedNarx
-from torchhydro.models.slstm import (
-    sLSTM,
-    pcLSTM,
-    biLSTM,
-    sGRU,
-    stackedGRU,
-    CpuGruModel,
-    CudnnGruModel,
-    CudnnGruModelGruKernel,
-    CudnnGruModelMultiOutput,
-)
+from torchhydro.registry import LazyDict
 
 """
 Utility dictionaries to map a string to a class.
 """
-pytorch_model_dict = {
-    "KuaiLSTM": CudnnLstmModel,
-    "CpuLSTM": CpuLstmModel,
-    "KaiLSTM": LinearCudnnLstmModel,
-    "DapengCNNLSTM": CNN1dLCmodel,
-    "LSTMKernel": CudnnLstmModelLstmKernel,
-    "KuaiLSTMMultiOut": CudnnLstmModelMultiOutput,
-    "DplLstmXaj": DplLstmXaj,
-    "DplAttrXaj": DplAnnXaj,
-    "SPPLSTM": SPP_LSTM_Model,
-    "SimpleLSTMForecast": SimpleLSTMForecast,
-    "SPPLSTM2": SPP_LSTM_Model_2,
-    "Seq2Seq": GeneralSeq2Seq,
-    "DataEnhanced": DataEnhancedModel,
-    "DataFusion": DataFusionModel,
-    "Transformer": Transformer,
-    "DplNnModuleXaj": DplLstmNnModuleXaj,
-    "DplLstmHbv": DplLstmHbv,
-    "DplAnnHbv": DplAnnHbv,
-    "DplLstmGr4j": DplLstmGr4j,
-    "DplAnnGr4j": DplAnnGr4j,
-    "DplAnnSac": DplAnnSac,
-    "DplLstmSac": DplLstmSac,
-    "DplAnnTank": DplAnnTank,
-    "DplLstmTank": DplLstmTank,
-    "Narx": Narx,
-    "NestedNarx": NestedNarx,
-    "sLSTM": sLSTM,
-    "pcLSTM": pcLSTM,
-    "biLSTM": biLSTM,
-    "sGRU": sGRU,
-    "stackedGRU": stackedGRU,
-    "CpuGruModel": CpuGruModel,
-    "CudnnGruModel": CudnnGruModel,
-    "CudnnGruModelGruKernel": CudnnGruModelGruKernel,
-    "CudnnGruModelMultiOutput": CudnnGruModelMultiOutput,
-}
+# models are imported only when they are used, e.g. "torchhydro.models.dpl4xaj:DplLstmXaj"
+pytorch_model_dict = LazyDict(
+    {
+        "KuaiLSTM": "torchhydro.models.cudnnlstm:CudnnLstmModel",
+        "CpuLSTM": "torchhydro.models.cudnnlstm:CpuLstmModel",
+        "KaiLSTM": "torchhydro.models.cudnnlstm:LinearCudnnLstmModel",
+        "DapengCNNLSTM": "torchhydro.models.cudnnlstm:CNN1dLCmodel",
+        "LSTMKernel": "torchhydro.models.cudnnlstm:CudnnLstmModelLstmKernel",
+        "KuaiLSTMMultiOut": "torchhydro.models.cudnnlstm:CudnnLstmModelMultiOutput",
+        "DplLstmXaj": "torchhydro.models.dpl4xaj:DplLstmXaj",
+        "DplAttrXaj": "torchhydro.models.dpl4xaj:DplAnnXaj",
+        "SPPLSTM": "torchhydro.models.spplstm:SPP_LSTM_Model",
+        "SimpleLSTMForecast": "torchhydro.models.simple_lstm:SimpleLSTMForecast",
+        "SPPLSTM2": "torchhydro.models.spplstm:SPP_LSTM_Model_2",
+        "Seq2Seq": "torchhydro.models.seq2seq:GeneralSeq2Seq",
+        "DataEnhanced": "torchhydro.models.seq2seq:DataEnhancedModel",
+        "DataFusion": "torchhydro.models.seq2seq:DataFusionModel",
+        "Transformer": "torchhydro.models.seq2seq:Transformer",
+        "DplNnModuleXaj": "torchhydro.models.dpl4xaj_nn4et:DplLstmNnModuleXaj",
+        "DplLstmHbv": "torchhydro.models.dpl4hbv:DplLstmHbv",
+        "DplAnnHbv": "torchhydro.models.dpl4hbv:DplAnnHbv",
+        "DplLstmGr4j": "torchhydro.models.dpl4gr4j:DplLstmGr4j",
+        "DplAnnGr4j": "torchhydro.models.dpl4gr4j:DplAnnGr4j",
+        "DplAnnSac": "torchhydro.models.dpl4sac:DplAnnSac",
+        "DplLstmSac": "torchhydro.models.dpl4sac:DplLstmSac",
+        "DplAnnTank": "torchhydro.models.dpl4tank:DplAnnTank",
+        "DplLstmTank": "torchhydro.models.dpl4tank:DplLstmTank",
+        "Narx": "torchhydro.models.narx:Narx",
+        "NestedNarx": "torchhydro.models.narx:NestedNarx",
+        "sLSTM": "torchhydro.models.slstm:sLSTM",
+        "pcLSTM": "torchhydro.models.slstm:pcLSTM",
+        "biLSTM": "torchhydro.models.slstm:biLSTM",
+        "sGRU": "torchhydro.models.slstm:sGRU",
+        "stackedGRU": "torchhydro.models.slstm:stackedGRU",
+        "CpuGruModel": "torchhydro.models.slstm:CpuGruModel",
+        "CudnnGruModel": "torchhydro.models.slstm:CudnnGruModel",
+        "CudnnGruModelGruKernel": "torchhydro.models.slstm:CudnnGruModelGruKernel",
+        "CudnnGruModelMultiOutput": "torchhydro.models.slstm:CudnnGruModelMultiOutput",
+    }
+)
 
 pytorch_criterion_dict = {
     "RMSE": RMSELoss,
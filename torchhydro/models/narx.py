@@ -11,6 +11,8 @@ import torch
 import torch.nn as nn
 from torch.nn import functional as F
 
+from torchhydro.models.step_mode import get_step
+
 
 class Narx(nn.Module):
     """
@@ -26,6 +28,7 @@ class Narx(nn.Module):
         feedback_delay: int,
         num_layers: int = 10,
         close_loop: bool = False,
+        step_mode: str = "eager",
     ):
         """
         Initialize the Narx model instance.
@@ -39,6 +42,8 @@ class Narx(nn.Module):
         feedback_delay: int, the maximum feedback delay time-step.
         num_layers: int, the number of recurrent layers.
         close_loop: bool, whether to close the loop when feeding in.      open loop for training, close loop for forecasting.
+        step_mode: str, how a close loop runs each time step, "eager" (default) or "compile" (torch.compile).
+            open loop doesn't need it, as all time steps are calculated together.
         """
         super(Narx, self).__init__()
         self.nx = n_input_features
@@ -50,18 +55,45 @@ class Narx(nn.Module):
         self.max_delay = max(self.input_delay, self.feedback_delay)
         self.close_loop = close_loop
         in_features = (self.nx-self.ny) * (self.input_delay + 1) + self.ny * (self.feedback_delay + 1)
+        self.step_mode = step_mode
         self.linearIn = nn.Linear(in_features, self.hidden_size)
-        self.narx = [
+        # one cell for each layer, registered so that they are trained, saved and moved with the model
+        self.narx = nn.ModuleList(
+            [
                 nn.RNNCell(
                     input_size=self.hidden_size,
                     hidden_size=self.hidden_size,
                 )
-        ] * self.num_layers
+                for _ in range(self.num_layers)
+            ]
+        )
         self.linearOut = nn.Linear(self.hidden_size, self.ny)
 
     def close_loop(self):
         self.close_loop = True
 
+    def delay_features(self, data, delay):
+        """
+        delayed features of all time steps from max_delay on, built at once by unfold.
+
+        Parameters
+        ----------
+        data
+            [time, basin, feature]
+        delay
+            the maximum delay time-step.
+
+        Returns
+        -------
+        torch.Tensor
+            [time - max_delay, basin, feature * (delay + 1)], for time step t: data(t-1), data(t-delay), ..., data(t-1).
+        """
+        nt = data.shape[0]
+        # window k is data[k: k + delay], the delayed data of time step k + delay
+        windows = data[(self.max_delay - delay): (nt - 1)].unfold(0, delay, 1)  # (time, basin, feature, delay)
+        windows = windows.permute(0, 1, 3, 2)
+        return torch.cat([windows[:, :, -1, :], windows.flatten(2)], dim=-1)
+
     def forward(self, x):
         """
         forward propagation function
@@ -77,34 +109,69 @@ class Narx(nn.Module):
             the output sequence of model.
         """
         nt, ngrid, nx = x.shape  # (time, basins, features(forcing, streamflow))  nx = self.nx + self.ny
-        out = torch.zeros(nt, ngrid, self.ny)  # (time, basins, output_features)
-        for t in range(self.max_delay):
-            out[t, :, :] = x[t, :, -self.ny:]
-        for t in range(self.max_delay, nt):
-            x0 = x[(t - self.input_delay): t, :, :(self.nx - self.ny)]
-            x0_t = x0[-1, :, :]
-            for i in range(self.input_delay):
-                x0_i = x0[i, :, :]
-                x0_t = torch.cat((x0_t, x0_i), dim=-1)
-            y0 = x[(t-self.feedback_delay):t, :, -self.ny:]
-            y0_t = y0[-1, :, :]
-            for i in range(self.feedback_delay):
-                y0i = y0[i, :, :]
-                y0_t = torch.cat((y0_t, y0i), dim=-1)
-            xt = torch.cat([x0_t, y0_t], dim=-1)  # (basins, features)  single step, no time dimension.
-            x_l = F.relu(self.linearIn(xt))
-            h_t = None
-            for i in range(self.num_layers):
-                if i == 0:
-                    h_t = self.narx[i](x_l)
-                else:
-                    h_t = self.narx[i](h_t)  # single step  #
-            yt = self.linearOut(h_t)  # (basins, output_features) single step output value, e.g. streamflow
-            out[t, :, :] = yt
-            if self.close_loop:
-                if t < (nt-1):
-                    x[t+1, :, -self.ny:] = yt
-        return out
+        out_delay = x[:self.max_delay, :, -self.ny:]  # (time, basins, output_features)
+        if nt <= self.max_delay:
+            return out_delay.clone()
+        x0 = self.delay_features(x[:, :, :(self.nx - self.ny)], self.input_delay)
+        if self.close_loop:
+            out = self.forward_close_loop(x0, x[:, :, -self.ny:])
+        else:
+            # the hidden states of cells start from zero in each time step, so all time steps are in one batch.
+            y0 = self.delay_features(x[:, :, -self.ny:], self.feedback_delay)
+            xt = torch.cat([x0, y0], dim=-1).flatten(0, 1)  # (time * basins, features)
+            out = narx_step(xt, self.linearIn, self.narx, self.linearOut).unflatten(0, (nt - self.max_delay, ngrid))
+        return torch.cat([out_delay, out], dim=0)
+
+    def forward_close_loop(self, x0, y):
+        """
+        close loop, the output of each time step is fed back as the target of next time step.
+
+        Parameters
+        ----------
+        x0
+            delayed forcing features from max_delay on, see delay_features.
+        y
+            the target features, [time, basin, output_features]; it is not changed.
+
+        Returns
+        -------
+        torch.Tensor
+            outputs from max_delay on, [time - max_delay, basin, output_features]
+        """
+        step = get_step(narx_step, self.step_mode)
+        y = list(y.unbind(0))
+        out = []
+        for i in range(x0.shape[0]):
+            t = i + self.max_delay
+            y0 = y[(t - self.feedback_delay): t]
+            xt = torch.cat([x0[i], y0[-1]] + y0, dim=-1)  # (basins, features)  single step, no time dimension.
+            yt = step(xt, self.linearIn, self.narx, self.linearOut)  # (basins, output_features) single step output value
+            out.append(yt)
+            if t < (len(y) - 1):
+                y[t + 1] = yt
+        return torch.stack(out)
+
+
+def narx_step(xt, linear_in, cells, linear_out):
+    """
+    one time step of Narx; the first dim of xt could be basins or (time * basins) in open loop.
+
+    Parameters
+    ----------
+    xt
+        delayed features, [batch, features]
+    linear_in, cells, linear_out
+        the input layer, recurrent cells and output layer of Narx
+
+    Returns
+    -------
+    torch.Tensor
+        [batch, output_features]
+    """
+    h_t = F.relu(linear_in(xt))
+    for cell in cells:
+        h_t = cell(h_t)
+    return linear_out(h_t)
 
 
 class NestedNarx(nn.Module):
@@ -121,9 +188,17 @@ class NestedNarx(nn.Module):
             num_layers: int = 10,
             close_loop: bool = False,
             nested_model: dict = None,
+            level_parallel: bool = False,
+            step_mode: str = "eager",
         ):
         """Initialize NestedNarx model
 
+        Parameters
+        ----------
+        nested_model: dict, basin trees and their orders, see BasinTree.get_basin_trees.
+        level_parallel: bool, whether to run basins with a same order of all basintrees in one batched Narx call,
+            rather than one basin by one basin. the outputs are the same.
+        step_mode: str, how the close loop of Narx runs each time step, see Narx.
         """
         super(NestedNarx, self).__init__()
         self.dl_model = Narx(
@@ -134,6 +209,7 @@ class NestedNarx(nn.Module):
             feedback_delay,
             num_layers,
             close_loop,
+            step_mode,
         )
         self.nx = n_input_features
         self.ny = n_output_features
@@ -149,7 +225,10 @@ class NestedNarx(nn.Module):
         self.n_basintrees = len(self.basin_trees)
         self.device = None
         self.b_set_device = False
+        self.level_parallel = level_parallel
         self.set_dl_model()
+        if self.level_parallel:
+            self.set_levels()
 
     def set_dl_model(self):
         """set dl model into each basin"""
@@ -160,6 +239,46 @@ class NestedNarx(nn.Module):
                 for k in range(n_basin_j):  # per order
                     self.basin_trees[i][j][k].set_model(self.dl_model)
 
+    def set_levels(self):
+        """
+        index basins by order for level-parallel calculation.
+        the index of a basin is its position in the basin dimension of input data.
+        """
+        index_basin = {}
+        index_node = {}
+        m = 0
+        for i in range(self.n_basintrees):  # basintrees
+            n_order_i = len(self.basin_trees[i])
+            for j in range(n_order_i):  # order
+                n_basin_j = len(self.basin_trees[i][j])
+                for k in range(n_basin_j):  # per order
+                    index_basin[(i, j, k)] = m
+                    index_node[id(self.basin_trees[i][j][k].node_us)] = m
+                    m = m + 1
+        # basins of each order, and their downstream basins
+        max_order = max(len(self.n_basin_per_order_list[i]) for i in range(self.n_basintrees))
+        level_index = [[] for _ in range(max_order)]
+        level_index_ds = [[] for _ in range(max_order)]
+        # the basin order of output, the same as the sequential calculation
+        out_index = []
+        for i in range(self.n_basintrees):  # basintrees
+            max_order_i = len(self.n_basin_per_order_list[i])
+            for j in range(max_order_i - 1, -1, -1):  # order
+                n_basin_j = self.n_basin_per_order_list[i][j]
+                for k in range(n_basin_j-1, -1, -1):  # per order
+                    level_index[j].append(index_basin[(i, j, k)])
+                    if j > 0:
+                        node_ds = self.basin_trees[i][j][k].node_ds
+                        level_index_ds[j].append(index_node[id(node_ds)])
+                    out_index.append(index_basin[(i, j, k)])
+        # calculate from the most upstream order
+        self.level_index = [torch.tensor(index) for index in level_index[::-1] if len(index) > 0]
+        self.level_index_ds = [
+            torch.tensor(index_ds) for index, index_ds in zip(level_index[::-1], level_index_ds[::-1]) if len(index) > 0
+        ]
+        position = torch.cat(self.level_index).argsort()
+        self.out_index = position[torch.tensor(out_index)]
+
     def set_device(self):
         """set device into each basin"""
         for i in range(self.n_basintrees):  # basintrees
@@ -231,6 +350,8 @@ class NestedNarx(nn.Module):
         n_t, n_basin, n_feature = x.size()  # split in basin dimension.  self.basin_list    n_feature = self.nx + self.ny
         if n_basin != len(self.basin_list):
             raise ValueError("The dimension of input data x dismatch with basintree, please check both.")
+        elif self.level_parallel:
+            return self.forward_level_parallel(x)
         else:
             # remove data in basin before calculation.
             self.remove_memory()
@@ -261,6 +382,29 @@ class NestedNarx(nn.Module):
 
             return out
 
+    def forward_level_parallel(self, x):
+        """
+        calculate basins order by order, basins with a same order in all basintrees are in one batch.
+        the inflow from upstream basins is summed up into one feature by index_add, it is between forcing and target
+        as the sequential calculation does. Narx takes forcing from the front and feedback from the end of features.
+        x
+            input data.  [time, basin, (prcp,pet,streamflow)]
+        """
+        n_t, n_basin, n_feature = x.size()
+        inflow = torch.zeros(n_t, n_basin, 1, device=x.device)
+        out = []
+        for index, index_ds in zip(self.level_index, self.level_index_ds):
+            index = index.to(x.device)
+            input_x = torch.cat(
+                [x[:, index, :self.nx], inflow[:, index].to(x.dtype), x[:, index, -self.ny:]], dim=-1
+            )
+            output_y = self.dl_model(input_x)[:, :, -1:].to(x.device)
+            out.append(output_y)
+            if index_ds.numel() > 0:
+                inflow = inflow.index_add(1, index_ds.to(x.device), output_y.to(inflow.dtype))
+        out = torch.cat(out, dim=1)
+        return out[:, self.out_index.to(x.device), :]
+
 
 # ============================= test session starts ==============================
 # platform linux -- Python 3.13.3, pytest-8.3.5, pluggy-1.5.0
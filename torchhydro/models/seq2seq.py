@@ -266,8 +266,40 @@ class Transformer(nn.Module):
         num_layers=8,
         dropout=0.1,
         prec_window=0,
+        decode_mode="parallel",
     ):
+        """Transformer for forecasting
+
+        Parameters
+        ----------
+        n_encoder_inputs : int
+            the number of input features of the encoder
+        n_decoder_inputs : int
+            the number of input features of the decoder
+        n_decoder_output : int
+            the number of output features
+        channels : int, optional
+            the dimension of the model, by default 256
+        num_embeddings : int, optional
+            the max length of positional embeddings, by default 512
+        nhead : int, optional
+            the number of heads, by default 8
+        num_layers : int, optional
+            the number of layers of the encoder and the decoder, by default 8
+        dropout : float, optional
+            the dropout rate, by default 0.1
+        prec_window : int, optional
+            not used now, by default 0
+        decode_mode : str, optional
+            "parallel" decodes all lead times in one pass with a causal mask;
+            "incremental" decodes lead time by lead time with encoder memory and keys/values
+            of the decoder cached (see decode_step), which gives the same outputs;
+            by default "parallel"
+        """
         super().__init__()
+        if decode_mode not in ["parallel", "incremental"]:
+            raise ValueError(f"Unknown decode_mode: {decode_mode}")
+        self.decode_mode = decode_mode
 
         self.input_pos_embedding = torch.nn.Embedding(num_embeddings, channels)
         self.target_pos_embedding = torch.nn.Embedding(num_embeddings, channels)
@@ -324,12 +356,168 @@ class Transformer(nn.Module):
 
         trg = pos_decoder + trg_start
         trg_mask = gen_trg_mask(out_sequence_len, trg.device)
-        out = self.decoder(tgt=trg, memory=memory, tgt_mask=trg_mask) + trg_start
+        out = (
+            self.decoder(tgt=trg, memory=memory, tgt_mask=trg_mask, tgt_is_causal=True)
+            + trg_start
+        )
         out = self.do(out)
         out = self.linear(out)
         return out
 
+    def init_decoding(self, src):
+        """
+        Encode the source sequence and set up the cache for incremental decoding
+
+        Parameters
+        ----------
+        src : torch.Tensor
+            the input of the encoder, [time, batch, n_encoder_inputs]
+
+        Returns
+        -------
+        TransformerDecodingCache
+            encoder memory projected to keys/values of each decoder layer, and empty
+            self-attention keys/values
+        """
+        memory = self.encode_src(src)
+        cache = TransformerDecodingCache()
+        for layer in self.decoder.layers:
+            cache.memory_kv.append(_memory_key_value(layer.multihead_attn, memory))
+            cache.self_kv.append(None)
+        return cache
+
+    def decode_step(self, trg_t, cache):
+        """
+        Decode one lead time with cached keys/values of previous lead times
+
+        Only the new lead time is projected and it attends to the cached prefix, so the cost of
+        a step grows linearly with the lead time rather than recomputing the whole prefix.
+
+        Parameters
+        ----------
+        trg_t : torch.Tensor
+            the input of the decoder at this lead time, [1, batch, n_decoder_inputs]
+        cache : TransformerDecodingCache
+            the cache from init_decoding, which is updated in this step
+
+        Returns
+        -------
+        torch.Tensor
+            the output at this lead time, [1, batch, n_decoder_output]
+        """
+        trg_start = self.output_projection(trg_t)
+        pos = torch.full(
+            (1, trg_t.shape[1]), cache.step, dtype=torch.long, device=trg_t.device
+        )
+        x = trg_start + self.target_pos_embedding(pos)
+        for i, layer in enumerate(self.decoder.layers):
+            x, cache.self_kv[i] = _decoder_layer_step(
+                layer, x, cache.self_kv[i], cache.memory_kv[i]
+            )
+        if self.decoder.norm is not None:
+            x = self.decoder.norm(x)
+        cache.step += 1
+        out = self.do(x + trg_start)
+        return self.linear(out)
+
+    def decode_incremental(self, trg, src):
+        cache = self.init_decoding(src)
+        outputs = [self.decode_step(trg_t, cache) for trg_t in trg.split(1)]
+        return torch.cat(outputs)
+
     def forward(self, *x):
         src, trg = x
+        if self.decode_mode == "incremental":
+            return self.decode_incremental(trg, src)
         src = self.encode_src(src)
         return self.decode_trg(trg=trg, memory=src)
+
+
+class TransformerDecodingCache(object):
+    """
+    Cached tensors for incremental decoding of Transformer
+
+    memory_kv has the keys and values of encoder memory for the cross-attention of each decoder
+    layer, which are computed once; self_kv has the keys and values of all decoded lead times for
+    the self-attention of each decoder layer, which grow by one lead time in each step. All of them
+    are [batch, head, time, head_dim].
+    """
+
+    def __init__(self):
+        self.memory_kv = []
+        self.self_kv = []
+        self.step = 0
+
+
+def _attention(q, k, v, dropout_p=0.0):
+    """attention of q over k/v ([batch, head, time, head_dim]), fused when SDPA is available"""
+    if hasattr(F, "scaled_dot_product_attention"):
+        return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+    weights = torch.softmax(q @ k.transpose(-2, -1) / math.sqrt(q.shape[-1]), dim=-1)
+    return F.dropout(weights, p=dropout_p) @ v
+
+
+def _split_heads(x, nhead):
+    """[time, batch, channels] -> [batch, head, time, head_dim]"""
+    return x.reshape(x.shape[0], x.shape[1], nhead, -1).permute(1, 2, 0, 3)
+
+
+def _merge_heads(x):
+    """[batch, head, time, head_dim] -> [time, batch, channels]"""
+    return x.permute(2, 0, 1, 3).flatten(2)
+
+
+def _memory_key_value(attn, memory):
+    """keys and values of encoder memory for the cross-attention attn of a decoder layer"""
+    _, w_k, w_v = attn.in_proj_weight.chunk(3)
+    _, b_k, b_v = attn.in_proj_bias.chunk(3)
+    return (
+        _split_heads(F.linear(memory, w_k, b_k), attn.num_heads),
+        _split_heads(F.linear(memory, w_v, b_v), attn.num_heads),
+    )
+
+
+def _multi_head_step(attn, x, k, v):
+    w_q = attn.in_proj_weight[: attn.embed_dim]
+    b_q = attn.in_proj_bias[: attn.embed_dim]
+    q = _split_heads(F.linear(x, w_q, b_q), attn.num_heads)
+    dropout_p = attn.dropout if attn.training else 0.0
+    return attn.out_proj(_merge_heads(_attention(q, k, v, dropout_p)))
+
+
+def _self_attention_step(attn, x, self_kv):
+    """self-attention of the new lead time x over the cached and the new keys/values"""
+    q, k, v = F.linear(x, attn.in_proj_weight, attn.in_proj_bias).chunk(3, dim=-1)
+    k = _split_heads(k, attn.num_heads)
+    v = _split_heads(v, attn.num_heads)
+    if self_kv is not None:
+        k = torch.cat((self_kv[0], k), dim=2)
+        v = torch.cat((self_kv[1], v), dim=2)
+    q = _split_heads(q, attn.num_heads)
+    dropout_p = attn.dropout if attn.training else 0.0
+    out = attn.out_proj(_merge_heads(_attention(q, k, v, dropout_p)))
+    return out, (k, v)
+
+
+def _decoder_layer_step(layer, x, self_kv, memory_kv):
+    """one step of nn.TransformerDecoderLayer for the new lead time x, [1, batch, channels]"""
+
+    def ff_block(y):
+        y = layer.linear2(layer.dropout(layer.activation(layer.linear1(y))))
+        return layer.dropout3(y)
+
+    if layer.norm_first:
+        sa, self_kv = _self_attention_step(layer.self_attn, layer.norm1(x), self_kv)
+        x = x + layer.dropout1(sa)
+        x = x + layer.dropout2(
+            _multi_head_step(layer.multihead_attn, layer.norm2(x), *memory_kv)
+        )
+        x = x + ff_block(layer.norm3(x))
+    else:
+        sa, self_kv = _self_attention_step(layer.self_attn, x, self_kv)
+        x = layer.norm1(x + layer.dropout1(sa))
+        x = layer.norm2(
+            x + layer.dropout2(_multi_head_step(layer.multihead_attn, x, *memory_kv))
+        )
+        x = layer.norm3(x + ff_block(x))
+    return x, self_kv
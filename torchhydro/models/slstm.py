@@ -8,6 +8,8 @@ https://kns.cnki.net/kcms2/article/abstract?v=fSCzX0TVvUiDbeilzEuM5TPhvRQk3Nr469
 """
 
 import math
+from typing import List, Tuple
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -16,6 +18,7 @@ from torch.nn import Module, Parameter
 
 from torchhydro.models.ann import SimpleAnn
 from torchhydro.models.dropout import DropMask, create_mask
+from torchhydro.models.step_mode import get_step
 
 class sLSTM(nn.Module):
     """
@@ -190,9 +193,111 @@ class pcLSTMCell(Module):
 
         return h_t, c_t
 
+def pclstm_step(
+    gx0: Tensor,
+    h: Tensor,
+    c: Tensor,
+    w_rec: List[Tensor],
+    w_c: List[Tensor],
+    w_co: List[Tensor],
+    b: List[Tensor],
+    dropout: float = 0.0,
+) -> Tuple[Tensor, Tensor]:
+    """
+    one time step of all layers of pcLSTM, with the weights of 4 gates fused, see pcLSTM.fused_weights.
+    the hidden and cell states go through the layers one by one, and the input of layers after the first is h.
+
+    Parameters
+    ----------
+    gx0
+        the input projection of the first layer, [batch, 4 * hidden], gates in the order of f, i, g, o
+    h, c
+        hidden and cell states, [batch, hidden]
+    w_rec
+        recurrent weights of layers, [hidden, 4 * hidden]; input weights are added for layers after the first
+    w_c
+        peephole weights of f and i, [hidden, 2 * hidden]
+    w_co
+        peephole weights of o, [hidden, hidden]
+    b
+        biases of layers, [4 * hidden]; the bias of the first layer is in gx0
+    dropout
+        the dropout rate of hidden states, 0 in evaluation
+
+    Returns
+    -------
+    Tuple[Tensor, Tensor]
+        h, c
+    """
+    hidden = h.shape[-1]
+    for i in range(len(w_rec)):
+        gates = torch.addmm(gx0 if i == 0 else b[i], h, w_rec[i])
+        fi = torch.sigmoid(torch.addmm(gates[:, :2 * hidden], c, w_c[i]))
+        g = torch.tanh(gates[:, 2 * hidden:3 * hidden])
+        c = c * fi[:, :hidden] + fi[:, hidden:] * g
+        o = torch.sigmoid(torch.addmm(gates[:, 3 * hidden:], c, w_co[i]))
+        h = o * torch.tanh(c)
+        if dropout > 0.0:
+            h = F.dropout(h, p=dropout)
+    return h, c
+
+
+def gru_step(
+    gx0: Tensor,
+    h: Tensor,
+    w_rec: List[Tensor],
+    w_hn: List[Tensor],
+    b: List[Tensor],
+    dropout: float = 0.0,
+) -> Tensor:
+    """
+    one time step of all layers of stackedGRU, with the weights of 3 gates fused, see stackedGRU.fused_weights.
+    the hidden state goes through the layers one by one, and the input of layers after the first is h.
+
+    Parameters
+    ----------
+    gx0
+        the input projection of the first layer, [batch, 3 * hidden], gates in the order of r, z, n
+    h
+        hidden state, [batch, hidden]
+    w_rec
+        recurrent weights of layers; [hidden, 2 * hidden] of r, z for the first layer,
+        [hidden, 3 * hidden] of r, z, n with input weights added for layers after the first
+    w_hn
+        weights of r * h in the new gate, [hidden, hidden]
+    b
+        biases of layers, [3 * hidden]; the bias of the first layer is in gx0
+    dropout
+        the dropout rate of hidden states, 0 in evaluation
+
+    Returns
+    -------
+    Tensor
+        h
+    """
+    hidden = h.shape[-1]
+    for i in range(len(w_rec)):
+        if i == 0:
+            rz = torch.addmm(gx0[:, :2 * hidden], h, w_rec[i])
+            nx = gx0[:, 2 * hidden:]
+        else:
+            gates = torch.addmm(b[i], h, w_rec[i])
+            rz = gates[:, :2 * hidden]
+            nx = gates[:, 2 * hidden:]
+        rz = torch.sigmoid(rz)
+        n = torch.tanh(torch.addmm(nx, rz[:, :hidden] * h, w_hn[i]))
+        z = rz[:, hidden:]
+        h = (1 - z) * h + z * n
+        if dropout > 0.0:
+            h = F.dropout(h, p=dropout)
+    return h
+
+
 class pcLSTM(Module):
     """
     stacked pcLSTM model.  peephole connections.
+    layers have their own weights; the whole sequence is calculated by pclstm_step with fused gates,
+    and outputs are created on the device of input.
     """
     def __init__(
         self,
@@ -202,7 +307,21 @@ class pcLSTM(Module):
         num_layers: int = 10,
         bias: bool = True,
         dropout: float = 0.0,
+        step_mode: str = "eager",
     ):
+        """
+
+        Parameters
+        ----------
+        input_size
+        output_size
+        hidden_size
+        num_layers
+        bias
+        dropout
+        step_mode
+            how each time step runs, "eager" (default) or "compile" (torch.compile), see get_step
+        """
         super(pcLSTM, self).__init__()
         self.nx = input_size
         self.ny = output_size
@@ -210,33 +329,52 @@ class pcLSTM(Module):
         self.num_layers = num_layers
         self.bias = bias
         self.dropout = dropout
+        self.step_mode = step_mode
         self.linearIn = torch.nn.Linear(self.nx, self.hidden_size)
-        self.lstm = [
-            pcLSTMCell(
-                input_size=self.hidden_size,
-                hidden_size=self.hidden_size,
-                dropout=self.dropout,
-            )
-        ] * self.num_layers
+        self.lstm = nn.ModuleList(
+            [
+                pcLSTMCell(
+                    input_size=self.hidden_size,
+                    hidden_size=self.hidden_size,
+                    dropout=self.dropout,
+                )
+                for _ in range(self.num_layers)
+            ]
+        )
         self.linearOut = torch.nn.Linear(self.hidden_size, self.ny)
 
+    def fused_weights(self):
+        """weights of cells with gates concatenated, see pclstm_step"""
+        w_x, w_rec, w_c, w_co, b = [], [], [], [], []
+        for i, cell in enumerate(self.lstm):
+            w_xi = torch.cat([cell.w_xf, cell.w_xi, cell.w_xc, cell.w_xo], dim=1)
+            w_hi = torch.cat([cell.w_hf, cell.w_hi, cell.w_hc, cell.w_ho], dim=1)
+            w_x.append(w_xi)
+            # the input of layers after the first is h
+            w_rec.append(w_hi if i == 0 else w_xi + w_hi)
+            w_c.append(torch.cat([cell.c_f, cell.c_i], dim=1))
+            w_co.append(cell.c_o)
+            b.append(torch.cat([cell.b_f, cell.b_i, cell.b_c, cell.b_o]))
+        return w_x, w_rec, w_c, w_co, b
+
     def forward(self, x):
         nt, ngrid, nx = x.shape
-        out = torch.zeros(nt, ngrid, self.ny)
-        ht = None
-        ct = None
+        x = torch.where(torch.isnan(x), torch.full_like(x, 0), x)
+        x0 = F.relu(self.linearIn(x))
+        w_x, w_rec, w_c, w_co, b = self.fused_weights()
+        # input projections of the first layer for all time steps at once;
+        # unbind rather than index each step, so backward doesn't make a zero gradient of gx0 in each step
+        gx0 = (torch.matmul(x0, w_x[0]) + b[0]).unbind(0)
+        step = get_step(pclstm_step, self.step_mode)
+        dropout = self.dropout if self.training else 0.0
+        ht = x0.new_zeros(ngrid, self.hidden_size)
+        ct = x0.new_zeros(ngrid, self.hidden_size)
+        out = []
         for t in range(nt):
-            xt = x[t, :, :]
-            xt = torch.where(torch.isnan(xt), torch.full_like(xt, 0), xt)
-            x0 = F.relu(self.linearIn(xt))
-            for i in range(self.num_layers):
-                if i == 0:
-                    ht, ct = self.lstm[i](x=x0, hx=(ht, ct))
-                else:
-                    ht, ct = self.lstm[i](x=ht, hx=(ht, ct))
-            yt = self.linearOut(ht)
-            out[t, :, :] = yt
-        return out
+            ht, ct = step(gx0[t], ht, ct, w_rec, w_c, w_co, b, dropout)
+            out.append(ht)
+        # stacked once rather than written into a buffer step by step, whose backward copies the whole buffer each step
+        return self.linearOut(torch.stack(out))
 
 
 class biLSTM(nn.Module):
@@ -426,6 +564,8 @@ class GRUCell(Module):
 class stackedGRU(Module):
     """
     stacked GRU model.
+    layers have their own weights; the whole sequence is calculated by gru_step with fused gates,
+    and outputs are created on the device of input.
     """
     def __init__(
         self,
@@ -435,7 +575,21 @@ class stackedGRU(Module):
         num_layers: int = 10,
         bias: bool = True,
         dropout: float = 0.0,
+        step_mode: str = "eager",
     ):
+        """
+
+        Parameters
+        ----------
+        input_size
+        output_size
+        hidden_size
+        num_layers
+        bias
+        dropout
+        step_mode
+            how each time step runs, "eager" (default) or "compile" (torch.compile), see get_step
+        """
         super(stackedGRU, self).__init__()
         self.nx = input_size
         self.ny = output_size
@@ -443,35 +597,51 @@ class stackedGRU(Module):
         self.num_layers = num_layers
         self.bias = bias
         self.dropout = dropout
+        self.step_mode = step_mode
         self.linearIn = torch.nn.Linear(self.nx, self.hidden_size)
-        self.gru = [
+        self.gru = nn.ModuleList(
+            [
                 GRUCell(
                     input_size=self.hidden_size,
                     hidden_size=self.hidden_size,
                     dropout=self.dropout,
                 )
-        ]*self.num_layers
-        # print("grucell model list")
-        # for i in range(self.num_layers):
-        #     print(self.gru[i])
+                for _ in range(self.num_layers)
+            ]
+        )
         self.linearOut = torch.nn.Linear(self.hidden_size, self.ny)
 
+    def fused_weights(self):
+        """weights of cells with gates concatenated, see gru_step"""
+        w_x, w_rec, w_hn, b = [], [], [], []
+        for i, cell in enumerate(self.gru):
+            w_xi = torch.cat([cell.w_ir, cell.w_iz, cell.w_in], dim=1)
+            w_x.append(w_xi)
+            if i == 0:
+                w_rec.append(torch.cat([cell.w_hr, cell.w_hz], dim=1))
+            else:
+                # the input of layers after the first is h
+                w_rec.append(w_xi + torch.cat([cell.w_hr, cell.w_hz, torch.zeros_like(cell.w_hn)], dim=1))
+            w_hn.append(cell.w_hn)
+            b.append(torch.cat([cell.b_r, cell.b_z, cell.b_n]))
+        return w_x, w_rec, w_hn, b
+
     def forward(self, x):
         nt, ngrid, nx = x.shape
-        out = torch.zeros(nt, ngrid, self.ny)
-        ht = None
+        x = torch.where(torch.isnan(x), torch.full_like(x, 0), x)
+        x0 = F.relu(self.linearIn(x))
+        w_x, w_rec, w_hn, b = self.fused_weights()
+        # input projections of the first layer for all time steps at once;
+        # unbind rather than index each step, so backward doesn't make a zero gradient of gx0 in each step
+        gx0 = (torch.matmul(x0, w_x[0]) + b[0]).unbind(0)
+        step = get_step(gru_step, self.step_mode)
+        dropout = self.dropout if self.training else 0.0
+        ht = x0.new_zeros(ngrid, self.hidden_size)
+        out = []
         for t in range(nt):
-            xt = x[t, :, :]
-            xt = torch.where(torch.isnan(xt), torch.full_like(xt, 0), xt)
-            x0 = F.relu(self.linearIn(xt))
-            for i in range(self.num_layers):
-                if i == 0:
-                    ht = self.gru[i](x=x0, hx=ht)
-                else:
-                    ht = self.gru[i](x=ht, hx=ht)
-            yt = self.linearOut(ht)
-            out[t, :, :] = yt
-        return out
+            ht = step(gx0[t], ht, w_rec, w_hn, b, dropout)
+            out.append(ht)
+        return self.linearOut(torch.stack(out))
 
 
 class GruCellTied(nn.Module):
@@ -625,9 +795,40 @@ class CpuGruModel(nn.Module):
         return out
 
 
+def native_gru(input, hx, weight, training=False):
+    """
+    one-layer GRU by the native kernel of nn.GRU (oneDNN on CPU), used where cuDNN is not available
+
+    Parameters
+    ----------
+    input
+        [seq_len, batch, input_size]
+    hx
+        initial state, [1, batch, hidden_size]
+    weight
+        [w_irz, w_hrz, w_in, w_hn, b_irz, b_hrz, b_in, b_hn] of CudnnGru; dropout masks should have been applied on them
+    training
+        whether in training mode
+
+    Returns
+    -------
+    tuple
+        output, hy
+    """
+    w_irz, w_hrz, w_in, w_hn, b_irz, b_hrz, b_in, b_hn = weight
+    # nn.GRU keeps the gates r, z, n in one tensor
+    flat_weight = [
+        torch.cat([w_irz, w_in]),
+        torch.cat([w_hrz, w_hn]),
+        torch.cat([b_irz, b_in]),
+        torch.cat([b_hrz, b_hn]),
+    ]
+    return torch._VF.gru(input, hx, flat_weight, True, 1, 0.0, training, False, False)
+
+
 class CudnnGru(nn.Module):
     """
-    Only run in GPU; the CPU version is GruCellTied in this file
+    cuDNN is used in GPU; in CPU, the same weights with the same dropout masks are given to native_gru
     """
     def __init__(self, *, input_size, hidden_size, dr=0.5):
         """
@@ -746,7 +947,9 @@ class CudnnGru(nn.Module):
             ]
         else:
             weight = [self.w_irz, self.w_hrz, self.w_in, self.w_hn, self.b_irz, self.b_hrz, self.b_in, self.b_hn]
-        if torch.__version__ < "1.8":
+        if not input.is_cuda:
+            output, hy = native_gru(input, hx, weight, self.training)
+        elif torch.__version__ < "1.8":
             output, hy, cy, reserve, new_weight_buf = torch._cudnn_rnn(
                 input,
                 weight,
@@ -797,7 +1000,7 @@ class CudnnGru(nn.Module):
 class CudnnGruModel(nn.Module):
     def __init__(self, input_size, output_size, hidden_size, dr=0.5):
         """
-        only gpu version Gru Model
+        Gru Model; cuDNN is used in GPU, and the native kernel of nn.GRU in CPU, see CudnnGru
 
         Parameters
         ----------
@@ -0,0 +1,38 @@
+"""Step modes of models with time loops: a python step function or the one compiled by torch.compile"""
+
+import torch
+
+# compiled steps are shared by all instances of models;
+# they are built lazily because torch.compile is slow to set up and not always needed
+_COMPILED_STEPS = {}
+
+
+def get_step(step, step_mode="eager"):
+    """
+    Get the function used for one time step of a model
+
+    Parameters
+    ----------
+    step
+        the python step function, such as xaj_step
+    step_mode
+        "eager" -- step itself, the default one;
+        "compile" -- step compiled by torch.compile (it needs torch>=2.0);
+        the results are same, but compiled one has less python overhead for long sequences
+
+    Returns
+    -------
+    Callable
+        the step function with same signature as step
+    """
+    if step_mode == "eager":
+        return step
+    if step_mode == "compile":
+        if not hasattr(torch, "compile"):
+            raise NotImplementedError("step_mode 'compile' needs torch>=2.0")
+        if step not in _COMPILED_STEPS:
+            _COMPILED_STEPS[step] = torch.compile(step)
+        return _COMPILED_STEPS[step]
+    raise NotImplementedError(
+        "We don't provide this step mode!! Please choose 'eager' or 'compile'"
+    )
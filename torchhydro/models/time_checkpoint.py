@@ -0,0 +1,74 @@
+"""Time loops of physics-based models with activation checkpointing over time chunks"""
+
+from contextlib import nullcontext
+from typing import Callable, Optional, Sequence, Tuple
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+from torchhydro.models.deferred_check import deferred_nan_check, is_deferred
+
+
+def run_time_loop(
+    step: Callable[[int, Tuple[torch.Tensor, ...]], Tuple[Sequence, Sequence]],
+    n_step: int,
+    states: Sequence[torch.Tensor],
+    time_chunk: Optional[int] = None,
+) -> Tuple[Tuple[torch.Tensor, ...], Tuple[torch.Tensor, ...]]:
+    """
+    Run the time loop of a physics-based model, optionally with checkpointing over time chunks
+
+    Backpropagation through a time loop keeps all intermediate tensors of all periods. With time_chunk,
+    the loop is split into chunks of time_chunk periods: only the states at the boundaries of chunks
+    are kept in the forward pass, and each chunk is calculated again in the backward pass, so memory
+    grows with time_chunk rather than the length of the sequence, at the cost of one more forward pass.
+
+    Parameters
+    ----------
+    step
+        the function for one period: step(i, states) -> (outputs, states), where outputs and states are
+        tuples of tensors of the i-th period; it should not change any tensor outside in place
+    n_step
+        the number of periods
+    states
+        the initial states
+    time_chunk
+        the number of periods in a chunk; None or 0 means no checkpointing, which is also the case
+        when gradients are not calculated
+
+    Returns
+    -------
+    tuple
+        outputs stacked over time (each is [time, ...]) and the final states
+    """
+    n_state = len(states)
+    deferred = is_deferred()
+
+    def run_chunk(start, end, *chunk_states):
+        outputs = []
+        # in the backward pass, chunks are calculated again outside the deferred_nan_check context of
+        # the forward pass; their checks were reported in the forward pass, so they are dropped
+        with deferred_nan_check(report=False) if deferred else nullcontext():
+            for i in range(start, end):
+                output, chunk_states = step(i, tuple(chunk_states))
+                outputs.append(output)
+        return tuple(torch.stack(output) for output in zip(*outputs)) + tuple(
+            chunk_states
+        )
+
+    if not time_chunk or not torch.is_grad_enabled():
+        results = run_chunk(0, n_step, *states)
+        return results[: len(results) - n_state], results[len(results) - n_state :]
+    chunk_outputs = []
+    for start in range(0, n_step, time_chunk):
+        results = checkpoint(
+            run_chunk,
+            start,
+            min(start + time_chunk, n_step),
+            *states,
+            use_reentrant=False,
+        )
+        chunk_outputs.append(results[: len(results) - n_state])
+        states = results[len(results) - n_state :]
+    outputs = tuple(torch.cat(output) for output in zip(*chunk_outputs))
+    return outputs, tuple(states)
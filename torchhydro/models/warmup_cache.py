@@ -0,0 +1,173 @@
+"""A cache of the initial states given by warmup periods of physics-based models in dPL"""
+
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Sequence, Tuple
+
+import torch
+
+
+class WarmupStateCache(object):
+    """
+    A cache of initial states from warmup periods, keyed by basin and window start
+
+    Physics-based models in dPL (such as Xaj4Dpl, Hbv4Dpl, Gr4j4Dpl, Sac4Dpl and Tank4Dpl) simulate
+    the warmup period again in each forward pass to initialize their states. When the same windows
+    are simulated with the same parameters, e.g. evaluating a trained model several times, the
+    initial states could be reused rather than simulating the warmup period again.
+
+    As the model doesn't know which basins and windows are in a batch, the caller should set keys
+    for each batch by set_keys, such as [(basin, window start), ...] in the order of basins in the
+    batch. Without keys, the cache is not used. DeepHydro sets keys from BaseDataset.sample_keys in
+    validation and inference when a dPL model is built with warmup_cache in model_hyperparam, and in
+    training when "warmup_cache_in_training" is True in training_cfgs; the cache is cleared each epoch.
+
+    Cached states stay on the device of the model. At most max_size basin-windows are kept, and the
+    least recently used ones are dropped first; call clear() to free them all, e.g. after evaluation.
+
+    Usage:
+        cache = WarmupStateCache()
+        model.pb_model.warmup_cache = cache
+        cache.set_keys(dataset.sample_keys(batch_items))
+        model(x, z)
+    """
+
+    def __init__(self, strict: bool = True, max_size: Optional[int] = 100000):
+        """
+        Parameters
+        ----------
+        strict
+            if True, the cached states are used only when the parameters of all basins in the batch are
+            the same as when they were cached, which costs one comparison on the device for each batch;
+            if False, parameters are not checked, so the cached states are reused even when parameters
+            change, e.g. for attribute-only parameterizations within an epoch; then call clear() when
+            the cached states should be refreshed
+        max_size
+            the max number of cached basin-windows; None means no limit
+        """
+        self.strict = strict
+        self.max_size = max_size
+        self.keys = None
+        self._parameters = {}
+        self._states = OrderedDict()
+
+    def __len__(self):
+        return len(self._states)
+
+    def set_keys(self, keys: Optional[Sequence[Hashable]]):
+        """set keys for basins in the next batch; None means the cache is not used"""
+        self.keys = None if keys is None else list(keys)
+
+    def clear(self):
+        """remove all cached states"""
+        self._parameters.clear()
+        self._states.clear()
+
+    def _check_keys(self, parameters: torch.Tensor):
+        if len(self.keys) != parameters.shape[0]:
+            raise ValueError(
+                f"{len(self.keys)} keys are set but there are {parameters.shape[0]} basins in the batch"
+            )
+
+    def get(self, parameters: torch.Tensor) -> Optional[Tuple[torch.Tensor, ...]]:
+        """
+        Get the cached initial states of all basins in the batch
+
+        Parameters
+        ----------
+        parameters
+            parameters of the physics-based model, [basin, parameter]
+
+        Returns
+        -------
+        Optional[Tuple[torch.Tensor, ...]]
+            initial states, whose first dim is basin; None if any basin is not cached
+        """
+        if self.keys is None:
+            return None
+        self._check_keys(parameters)
+        if any(key not in self._states for key in self.keys):
+            return None
+        for key in self.keys:
+            self._states.move_to_end(key)
+        if self.strict:
+            cached_parameters = torch.stack([self._parameters[key] for key in self.keys])
+            if not torch.equal(cached_parameters, parameters.detach()):
+                return None
+        n_state = len(self._states[self.keys[0]])
+        return tuple(
+            torch.stack([self._states[key][i] for key in self.keys])
+            for i in range(n_state)
+        )
+
+    def put(self, parameters: torch.Tensor, states: Sequence[torch.Tensor]):
+        """
+        Cache the initial states of all basins in the batch
+
+        Parameters
+        ----------
+        parameters
+            parameters of the physics-based model, [basin, parameter]
+        states
+            initial states, whose first dim is basin
+        """
+        if self.keys is None:
+            return
+        self._check_keys(parameters)
+        parameters = parameters.detach()
+        for j, key in enumerate(self.keys):
+            self._parameters[key] = parameters[j]
+            self._states[key] = tuple(state[j].detach() for state in states)
+            self._states.move_to_end(key)
+        while self.max_size is not None and len(self._states) > self.max_size:
+            key, _ = self._states.popitem(last=False)
+            del self._parameters[key]
+
+    def warmup(
+        self, parameters: torch.Tensor, run_warmup: Callable[[], Sequence[torch.Tensor]]
+    ) -> Tuple[torch.Tensor, ...]:
+        """
+        Get initial states from the cache, or run the warmup period and cache its states
+
+        Parameters
+        ----------
+        parameters
+            parameters of the physics-based model, [basin, parameter]
+        run_warmup
+            a function without arguments simulating the warmup period and returning the states
+
+        Returns
+        -------
+        Tuple[torch.Tensor, ...]
+            initial states
+        """
+        states = self.get(parameters)
+        if states is None:
+            states = tuple(run_warmup())
+            self.put(parameters, states)
+        return states
+
+
+def make_warmup_cache(warmup_cache) -> Optional[WarmupStateCache]:
+    """
+    Make a WarmupStateCache from the warmup_cache argument of dPL models, e.g. in model_hyperparam
+
+    Parameters
+    ----------
+    warmup_cache
+        None or False for no cache; True for a cache with default settings; a dict of kwargs of
+        WarmupStateCache, such as {"strict": False, "max_size": 1000}; or a WarmupStateCache
+
+    Returns
+    -------
+    Optional[WarmupStateCache]
+        the cache or None
+    """
+    if warmup_cache is None or warmup_cache is False:
+        return None
+    if warmup_cache is True:
+        return WarmupStateCache()
+    if isinstance(warmup_cache, dict):
+        return WarmupStateCache(**warmup_cache)
+    if isinstance(warmup_cache, WarmupStateCache):
+        return warmup_cache
+    raise TypeError(f"Unsupported warmup_cache: {warmup_cache!r}")
@@ -0,0 +1,65 @@
+"""A dict whose classes are imported on first use, for registries of models, datasets and data sources"""
+
+import importlib
+
+
+class LazyImport(object):
+    """A placeholder of an object which is imported when it is resolved"""
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path
+            "module:name", such as "torchhydro.models.dpl4xaj:DplLstmXaj"
+        """
+        self.path = path
+
+    def resolve(self):
+        module_name, _, attr_name = self.path.partition(":")
+        return getattr(importlib.import_module(module_name), attr_name)
+
+    def __repr__(self):
+        return f"LazyImport({self.path!r})"
+
+
+class LazyDict(dict):
+    """
+    A dict mapping names to classes, where a class given as "module:name" is imported on first use
+
+    Registries like pytorch_model_dict used to import all models, datasets and data sources
+    (with their heavy dependencies) when they were created; with LazyDict only the one which is
+    used is imported. Classes could still be registered directly, e.g. d["my_model"] = MyModel.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, str):
+            value = LazyImport(value)
+        super().__setitem__(key, value)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, LazyImport):
+            value = value.resolve()
+            super().__setitem__(key, value)
+        return value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self):
+        return LazyDict(super().items())
@@ -22,13 +22,14 @@ import torch.distributed as dist
 import torch.nn as nn
 from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.optim.lr_scheduler import *
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
 from tqdm import tqdm
 
 from torchhydro.configs.config import update_nested_dict
 from torchhydro.datasets.data_dict import datasets_dict
-from torchhydro.datasets.data_sets import BaseDataset
+from torchhydro.datasets.data_sets import BaseDataset, get_collate_fn
 from torchhydro.datasets.sampler import (
+    RecordedBatchSampler,
     fl_sample_basin,
     fl_sample_region,
     data_sampler_dict,
@@ -46,12 +47,34 @@ from torchhydro.trainers.train_utils import (
     denormalize4eval,
     evaluate_validation,
     compute_validation,
+    keyed_batches,
     model_infer,
     read_pth_from_model_loader,
     torch_single_train,
 )
 from torchhydro.datasets.mi_stl import Decomposition
 
+
+def _get_warmup_cache(model):
+    """the WarmupStateCache of a physics-based model in model, if it has one"""
+    for module in model.modules():
+        if getattr(module, "warmup_cache", None) is not None:
+            return module.warmup_cache
+    return None
+
+
+def _batching(dataset, batch_size, sampler=None, shuffle=False, record=False):
+    """
+    Batching kwargs of DataLoader; with record, batches are drawn by a RecordedBatchSampler,
+    so that keys of a warmup cache could be set for them, see keyed_batches
+    """
+    if not record:
+        return {"batch_size": batch_size, "shuffle": shuffle, "sampler": sampler}
+    if sampler is None:
+        sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return {"batch_sampler": RecordedBatchSampler(sampler, batch_size)}
+
+
 class DeepHydroInterface(ABC):
     """
     An abstract class used to handle different configurations
@@ -268,7 +291,11 @@ class DeepHydro(DeepHydroInterface):
             training_cfgs, data_cfgs
         )
         logger = TrainLogger(model_filepath, self.cfgs, opt)
+        warmup_cache = _get_warmup_cache(self.model)
         for epoch in range(start_epoch, max_epochs + 1):  # train and valid for every single epoch.
+            if warmup_cache is not None:
+                # parameters are changed in each epoch, so are the states given by warmup periods
+                warmup_cache.clear()
             with logger.log_epoch_train(epoch) as train_logs:
                 total_loss, n_iter_ep = torch_single_train(
                     self.model,
@@ -277,6 +304,12 @@ class DeepHydro(DeepHydroInterface):
                     data_loader,
                     device=self.device,
                     which_first_tensor=training_cfgs["which_first_tensor"],
+                    loss_check_steps=training_cfgs.get("loss_check_steps", 1),
+                    warmup_cache=(
+                        warmup_cache
+                        if training_cfgs.get("warmup_cache_in_training", False)
+                        else None
+                    ),
                 )
                 train_logs["train_loss"] = total_loss
                 train_logs["model"] = self.model
@@ -352,6 +385,7 @@ class DeepHydro(DeepHydroInterface):
             validation_data_loader,
             device=self.device,
             which_first_tensor=training_cfgs["which_first_tensor"],
+            warmup_cache=_get_warmup_cache(self.model),
         )
         valid_logs["valid_loss"] = valid_loss
         if self.cfgs["evaluation_cfgs"]["calc_metrics"]:
@@ -401,7 +435,10 @@ class DeepHydro(DeepHydroInterface):
         test_preds = []
         obss = []
         with torch.no_grad():
-            for xs, ys in test_dataloader:
+            # initial states of windows evaluated before are reused if the model has a warmup cache
+            for xs, ys in keyed_batches(
+                test_dataloader, _get_warmup_cache(self.model)
+            ):
                 # here the a batch doesn't mean a basin; it is only an index in lookup table
                 # for NtoN mode, only basin is index in lookup table, so the batch is same as basin
                 # for Nto1 mode, batch is only an index
@@ -489,27 +526,31 @@ class DeepHydro(DeepHydroInterface):
         """get DataLoader
 
         """
+        # batches are recorded to set keys of the warmup cache of a model, see keyed_batches
+        record = _get_warmup_cache(self.model) is not None
         if mode == "infer":  # test period
             ngrid = self.testdataset.ngrid
             if data_cfgs["sampler"] != "BasinBatchSampler":
                 # TODO: this case should be tested more
                 return DataLoader(
                     self.testdataset,
-                    batch_size=training_cfgs["batch_size"],
-                    shuffle=False,
-                    sampler=None,
-                    batch_sampler=None,
+                    **_batching(
+                        self.testdataset, training_cfgs["batch_size"], record=record
+                    ),
                     drop_last=False,
                     timeout=0,
+                    collate_fn=get_collate_fn(self.testdataset),
                     worker_init_fn=None,
                 )
             test_num_samples = self.testdataset.num_samples
             return DataLoader(
                 self.testdataset,
-                batch_size=test_num_samples // ngrid,
-                shuffle=False,
+                **_batching(
+                    self.testdataset, test_num_samples // ngrid, record=record
+                ),
                 drop_last=False,
                 timeout=0,
+                collate_fn=get_collate_fn(self.testdataset),
             )
         # train period
         worker_num = 0
@@ -523,21 +564,28 @@ class DeepHydro(DeepHydroInterface):
         sampler = self._get_sampler(data_cfgs, self.traindataset)
         data_loader = DataLoader(
             self.traindataset,
-            batch_size=training_cfgs["batch_size"],
-            shuffle=(sampler is None),
-            sampler=sampler,
+            **_batching(
+                self.traindataset,
+                training_cfgs["batch_size"],
+                sampler=sampler,
+                shuffle=(sampler is None),
+                record=record and training_cfgs.get("warmup_cache_in_training", False),
+            ),
             num_workers=worker_num,
             pin_memory=pin_memory,
             timeout=0,
+            collate_fn=get_collate_fn(self.traindataset),
         )
         if data_cfgs["t_range_valid"] is not None:  # valid period
             validation_data_loader = DataLoader(
                 self.validdataset,
-                batch_size=training_cfgs["batch_size"],
-                shuffle=False,
+                **_batching(
+                    self.validdataset, training_cfgs["batch_size"], record=record
+                ),
                 num_workers=worker_num,
                 pin_memory=pin_memory,
                 timeout=0,
+                collate_fn=get_collate_fn(self.validdataset),
             )
             return data_loader, validation_data_loader
 
@@ -959,6 +1007,7 @@ class DistributedDeepHydro(MultiTaskHydro):
                     data_loader,
                     device=self.device,
                     which_first_tensor=training_cfgs["which_first_tensor"],
+                    loss_check_steps=training_cfgs.get("loss_check_steps", 1),
                 )
                 train_logs["train_loss"] = total_loss
                 train_logs["model"] = self.model
@@ -15,13 +15,9 @@ from hydroutils.hydro_stat import stat_error
 from hydrodatasource.utils.utils import streamflow_unit_conv
 
 from torchhydro.configs.model_config import MODEL_PARAM_TEST_WAY
-from torchhydro.datasets.data_sources import data_sources_dict
+from torchhydro.datasets.data_sets import get_collate_fn
+from torchhydro.datasets.data_sources import get_data_source
 from torchhydro.trainers.train_logger import save_model_params_log
-from torchhydro.explainers.shap import (
-    deep_explain_model_heatmap,
-    deep_explain_model_summary_plot,
-    shap_summary_plot,
-)
 from torchhydro.trainers.train_utils import (
     calculate_and_record_metrics,
     cellstates_when_inference,
@@ -175,6 +171,9 @@ class Resulter:
         # Finally, try to explain model behaviour using shap
         is_shap = self.cfgs["evaluation_cfgs"]["explainer"] == "shap"
         if is_shap:
+            # shap and plotting libraries are slow to import, so they are imported only when needed
+            from torchhydro.explainers.shap import shap_summary_plot
+
             shap_summary_plot(self.model, self.traindataset, self.testdataset)  #模型的可解释性画图
             # deep_explain_model_summary_plot(self.model, test_data)
             # deep_explain_model_heatmap(self.model, test_data)
@@ -194,7 +193,7 @@ class Resulter:
         source_name = data_cfgs["source_cfgs"]["source_name"]
         source_path = data_cfgs["source_cfgs"]["source_path"]
         other_settings = data_cfgs["source_cfgs"].get("other_settings", {})
-        data_source = data_sources_dict[source_name](source_path, **other_settings)
+        data_source = get_data_source(source_name, source_path, **other_settings)
         basin_id = data_cfgs["object_ids"]
         # NOTE: all datasource should have read_area method
         basin_area = data_source.read_area(basin_id)
@@ -257,6 +256,7 @@ class Resulter:
             batch_sampler=None,
             drop_last=False,
             timeout=0,
+            collate_fn=get_collate_fn(deephydro.testdataset),
             worker_init_fn=None,
         )
         deephydro.model.eval()
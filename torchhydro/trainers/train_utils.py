@@ -245,7 +245,11 @@ def evaluate_validation(
     if isinstance(fill_nan, list) and len(fill_nan) != len(target_col):
         raise ValueError("Length of fill_nan must be equal to length of target_col.")
     eval_log = {}
-    batch_size = validation_data_loader.batch_size
+    # batch_size of a DataLoader is None when it is given a batch_sampler, e.g. a RecordedBatchSampler
+    batch_size = (
+        validation_data_loader.batch_size
+        or validation_data_loader.batch_sampler.batch_size
+    )
     evaluation_metrics = evaluation_cfgs["metrics"]
     if evaluation_cfgs["rolling"]:
         target_scaler = validation_data_loader.dataset.target_scaler
@@ -369,6 +373,46 @@ def compute_loss(
     return criterion(output, labels.float())
 
 
+def keyed_batches(data_loader, warmup_cache=None):
+    """
+    Batches of a DataLoader, with keys of warmup_cache set for each of them
+
+    Parameters
+    ----------
+    data_loader
+        object for loading data; with warmup_cache, it must be a DataLoader of a BaseDataset whose
+        batch_sampler is a RecordedBatchSampler
+    warmup_cache
+        the WarmupStateCache of the model; None means no keys are set
+
+    Yields
+    ------
+    the batches of data_loader
+    """
+    if warmup_cache is None:
+        yield from data_loader
+        return
+    try:
+        for batch in data_loader:
+            items = data_loader.batch_sampler.batches.popleft()
+            warmup_cache.set_keys(data_loader.dataset.sample_keys(items))
+            yield batch
+    finally:
+        warmup_cache.set_keys(None)
+
+
+def _check_loss_flags(n_inf, n_high, n_high_checked):
+    """inspect anomaly flags accumulated on device; it is the only host sync of the deferred guard"""
+    if n_inf.item() > 0:
+        raise ValueError(
+            "Error infinite loss detected. Try normalizing data or performing interpolation"
+        )
+    n_high = int(n_high.item())
+    if n_high > n_high_checked:
+        print(f"Warning: high loss detected in {n_high - n_high_checked} batches")
+    return n_high
+
+
 def torch_single_train(
     model,
     opt: optim.Optimizer,
@@ -383,7 +427,8 @@ def torch_single_train(
     Parameters
     ----------
     model
-        a PyTorch model inherit from nn.Module
+        a PyTorch model inherit from nn.Module;
+        if it has an attribute `retain_graph` being True, the graph is retained in backward
     opt
         optimizer function from PyTorch optim.Optimizer
     criterion
@@ -392,6 +437,18 @@ def torch_single_train(
         object for loading data to the model
     device
         where we put the tensors and models
+    kwargs
+        which_first_tensor: "sequence" or "batch";
+        loss_check_steps: how often nan/inf/high loss are checked, by default 1, i.e. every batch;
+        if it is n > 1, anomaly flags are accumulated on the device and checked every n batches and at the end,
+        so there is no host sync in each step; if it is 0, they are only checked at the end of the epoch.
+        In this deferred mode, the optimizer step of a nan-loss batch is skipped on the device, so training is the
+        same as skipping the batch: a fused optimizer (e.g. "optim_params": {"fused": True}) skips it by found_inf
+        as torch.amp.GradScaler does; for other ones, parameters and optimizer states are copied before each step
+        and set back, and host states (e.g. "step" of Adam on CUDA) are only set back at the next check, so a few
+        steps before it may use a larger "step" than skipping.
+        warmup_cache: the WarmupStateCache of the model, whose keys are set for each batch, see keyed_batches;
+        by default None
 
     Returns
     -------
@@ -409,7 +466,22 @@ def torch_single_train(
     running_loss = 0.0
     which_first_tensor = kwargs["which_first_tensor"]
     seq_first = which_first_tensor != "batch"
-    pbar = tqdm(data_loader)  # load data
+    loss_check_steps = kwargs.get("loss_check_steps", 1)
+    retain_graph = getattr(model, "retain_graph", False)
+    if loss_check_steps != 1:
+        return _torch_single_train_deferred_check(
+            model,
+            opt,
+            criterion,
+            data_loader,
+            device,
+            seq_first,
+            retain_graph,
+            **kwargs,
+        )
+    pbar = tqdm(
+        keyed_batches(data_loader, kwargs.get("warmup_cache")), total=len(data_loader)
+    )  # load data
 
     for _, (src, trg) in enumerate(pbar):  # call __getitem__ in NarxDataset class
         trg, output = model_infer(seq_first, device, model, src, trg)  # src, forcing data, e.g. prce|pet  trg, target data, e.g. streamflow.
@@ -419,8 +491,7 @@ def torch_single_train(
             print("Warning: high loss detected")
         if torch.isnan(loss):
             continue
-        # loss.backward()  # Backpropagate to compute the current gradient   # todo: temp comments.
-        loss.backward(retain_graph=True)   # todo: temp modify.
+        loss.backward(retain_graph=retain_graph)  # Backpropagate to compute the current gradient
         opt.step()  # Update network parameters based on gradients
         model.zero_grad()  # clear gradient
         if loss == float("inf"):
@@ -437,6 +508,109 @@ def torch_single_train(
     return total_loss, n_iter_ep
 
 
+@torch.no_grad()
+def _step_unless(condition, opt, host_changes):
+    """
+    An optimizer step which changes nothing where condition (a 0-dim bool tensor) is True, without a host sync
+
+    Optimizers taking found_inf (the fused ones) skip the step on the device, as torch.amp.GradScaler does.
+    For other ones, parameters and states on the device of condition are set back by torch.where, so they are
+    copied before the step; states on the host (e.g. "step" of Adam on CUDA) are left to the next check, and
+    their changes are appended to host_changes as (state, change, condition) for _undo_host_changes.
+    """
+    if getattr(opt, "_step_supports_amp_scaling", False):
+        opt.grad_scale = None
+        opt.found_inf = condition.float()
+        try:
+            opt.step()
+        finally:
+            del opt.grad_scale, opt.found_inf
+        return
+    device = condition.device
+    params = [param for group in opt.param_groups for param in group["params"]]
+    old_params = [param.clone() for param in params]
+    old_states = {
+        param: {k: v.clone() for k, v in state.items() if torch.is_tensor(v)}
+        for param, state in opt.state.items()
+    }
+    opt.step()
+    for param, old in zip(params, old_params):
+        param.copy_(torch.where(condition, old, param))
+    for param, state in opt.state.items():
+        old_state = old_states.get(param, {})
+        for key, value in state.items():
+            if not torch.is_tensor(value):
+                continue
+            # states created in this step are set back to zeros, i.e. fresh states of built-in optimizers
+            old = old_state.get(key, torch.zeros_like(value))
+            if value.device == device:
+                value.copy_(torch.where(condition, old, value))
+            else:
+                host_changes.append((value, value - old, condition))
+
+
+@torch.no_grad()
+def _undo_host_changes(host_changes):
+    """undo the changes of host states recorded by _step_unless whose condition is True"""
+    if host_changes:
+        conditions = torch.stack([condition for _, _, condition in host_changes]).tolist()
+        for (value, change, _), condition in zip(host_changes, conditions):
+            if condition:
+                value.sub_(change)
+    host_changes.clear()
+
+
+def _torch_single_train_deferred_check(
+    model,
+    opt,
+    criterion,
+    data_loader,
+    device,
+    seq_first,
+    retain_graph,
+    **kwargs,
+):
+    """the part of torch_single_train where loss is checked every loss_check_steps batches"""
+    loss_check_steps = kwargs["loss_check_steps"]
+    running_loss = None
+    host_changes = []
+    pbar = tqdm(
+        keyed_batches(data_loader, kwargs.get("warmup_cache")), total=len(data_loader)
+    )  # load data
+    for i, (src, trg) in enumerate(pbar):
+        trg, output = model_infer(seq_first, device, model, src, trg)
+        loss = compute_loss(trg, output, criterion, **kwargs)
+        if running_loss is None:
+            running_loss = torch.zeros((), device=loss.device)
+            n_valid = torch.zeros((), device=loss.device)
+            n_inf = torch.zeros((), device=loss.device)
+            n_high = torch.zeros((), device=loss.device)
+            n_high_checked = 0
+        loss_ = loss.detach()
+        is_nan = torch.isnan(loss_)
+        loss.backward(retain_graph=retain_graph)
+        # a nan-loss batch must not change anything, so its step is skipped on the device rather than on the host
+        _step_unless(is_nan, opt, host_changes)
+        model.zero_grad()
+        running_loss += torch.where(is_nan, torch.zeros_like(loss_), loss_)
+        n_valid += ~is_nan
+        n_inf += torch.isinf(loss_)
+        n_high += loss_ > 100
+        if loss_check_steps > 0 and (i + 1) % loss_check_steps == 0:
+            _undo_host_changes(host_changes)
+            n_high_checked = _check_loss_flags(n_inf, n_high, n_high_checked)
+    _undo_host_changes(host_changes)
+    if running_loss is not None:
+        _check_loss_flags(n_inf, n_high, n_high_checked)
+    n_iter_ep = 0 if running_loss is None else int(n_valid.item())
+    if n_iter_ep == 0:
+        raise ValueError(
+            "All batch computations of loss result in NAN. Please check the data."
+        )
+    total_loss = running_loss.item() / float(n_iter_ep)
+    return total_loss, n_iter_ep
+
+
 def compute_validation(
     model,
     criterion,
@@ -457,6 +631,9 @@ def compute_validation(
         The data-loader of either validation or test-data
     device
         torch.device
+    kwargs
+        which_first_tensor: "sequence" or "batch";
+        warmup_cache: the WarmupStateCache of the model, whose keys are set for each batch, see keyed_batches
 
     Returns
     -------
@@ -468,7 +645,7 @@ def compute_validation(
     obs = []
     preds = []
     with torch.no_grad():
-        for src, trg in data_loader:
+        for src, trg in keyed_batches(data_loader, kwargs.get("warmup_cache")):
             trg, output = model_infer(seq_first, device, model, src, trg)
             obs.append(trg)
             preds.append(output)
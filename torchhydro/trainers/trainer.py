@@ -8,8 +8,10 @@ FilePath: \torchhydro\torchhydro\trainers\trainer.py
 Copyright (c) 2021-2022 Wenyu Ouyang. All rights reserved.
 """
 
+from concurrent.futures import ProcessPoolExecutor
 import copy
 from datetime import datetime
+import multiprocessing
 import os
 from pathlib import Path
 import random
@@ -172,8 +174,8 @@ def _create_kfold_discontinuous_periods(train_period, test_period, kfold):
     return cross_validation_sets
 
 
-def _nested_loop_train_and_evaluate(keys, index, my_dict, update_dict, perform_count=0):
-    """a recursive function to update the update_dict and perform train_and_evaluate
+def _nested_loop_ensemble_cfgs(keys, index, my_dict, update_dict, cfgs=None):
+    """a recursive function to generate the configs of all sub-experiments
 
     Parameters
     ----------
@@ -185,26 +187,91 @@ def _nested_loop_train_and_evaluate(keys, index, my_dict, update_dict, perform_c
         the dict we want to loop
     update_dict : dict
         the dict we want to update
-    perform_count : int, optional
-        a counter for naming different experiments, by default 0
+    cfgs : list, optional
+        configs generated before; the length of it is used for naming different experiments
+
+    Returns
+    -------
+    list
+        configs of sub-experiments in the order of the nested loop
     """
+    if cfgs is None:
+        cfgs = []
     if index == len(keys):
-        return perform_count
+        return cfgs
     current_key = keys[index]
     for value in my_dict[current_key]:
         # update the update_dict
         cfg = _update_cfg_with_1ensembleitem(update_dict, current_key, value)
-        # for final key, perform train and evaluate
+        # for final key, a sub-experiment is generated
         if index == len(keys) - 1:
-            cfg = _update_cfg_with_1ensembleitem(cfg, "expdir", perform_count)
-            train_and_evaluate(cfg)
-            # print(perform_count)
-            perform_count += 1
+            cfg = _update_cfg_with_1ensembleitem(cfg, "expdir", len(cfgs))
+            cfgs.append(cfg)
         # recursive
-        perform_count = _nested_loop_train_and_evaluate(
-            keys, index + 1, my_dict, cfg, perform_count
-        )
-    return perform_count
+        _nested_loop_ensemble_cfgs(keys, index + 1, my_dict, cfg, cfgs)
+    return cfgs
+
+
+def _nested_loop_train_and_evaluate(keys, index, my_dict, update_dict):
+    """perform train_and_evaluate for all sub-experiments one by one
+
+    Parameters
+    ----------
+    keys : list
+        a list of keys
+    index : int
+        the loop index
+    my_dict : dict
+        the dict we want to loop
+    update_dict : dict
+        the dict we want to update
+
+    Returns
+    -------
+    int
+        the number of sub-experiments
+    """
+    cfgs = _nested_loop_ensemble_cfgs(keys, index, my_dict, update_dict)
+    for cfg in cfgs:
+        train_and_evaluate(cfg)
+    return len(cfgs)
+
+
+def _init_ensemble_worker(n_threads):
+    """limit the threads of torch in a worker process, so workers don't compete for cores"""
+    torch.set_num_threads(n_threads)
+
+
+def _parallel_train_and_evaluate(cfgs, n_workers, n_threads=None):
+    """perform train_and_evaluate for sub-experiments in a local process pool
+
+    Each sub-experiment has its own test_path, so results are saved in the same folders as
+    the sequential way. Processes are spawned, hence scripts calling this function
+    should be guarded by `if __name__ == "__main__":`.
+
+    Parameters
+    ----------
+    cfgs : list
+        configs of sub-experiments
+    n_workers : int
+        the number of worker processes
+    n_threads : int, optional
+        the number of torch threads in each worker;
+        by default, cpu cores are divided equally among workers
+    """
+    n_workers = min(n_workers, len(cfgs))
+    if n_threads is None:
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_ensemble_worker,
+        initargs=(n_threads,),
+    ) as executor:
+        futures = [executor.submit(train_and_evaluate, cfg) for cfg in cfgs]
+        # raise the exception of any failed sub-experiment
+        for future in futures:
+            future.result()
 
 
 def _trans_kfold_to_periods(update_dict, ensemble_items, current_key="kfold"):
@@ -247,4 +314,11 @@ def ensemble_train_and_evaluate(cfgs: Dict):
     keys_list = list(ensemble_items.keys())
     if "kfold" in keys_list:
         _trans_kfold_to_periods(cfgs, ensemble_items, "kfold")
-    _nested_loop_train_and_evaluate(keys_list, 0, ensemble_items, cfgs)
+    n_workers = cfgs["training_cfgs"].get("ensemble_workers", 1)
+    if n_workers is None or n_workers <= 1:
+        _nested_loop_train_and_evaluate(keys_list, 0, ensemble_items, cfgs)
+    else:
+        sub_cfgs = _nested_loop_ensemble_cfgs(keys_list, 0, ensemble_items, cfgs)
+        _parallel_train_and_evaluate(
+            sub_cfgs, n_workers, cfgs["training_cfgs"].get("ensemble_threads")
+        )